@@ -0,0 +1,135 @@
+"""
+Offline backtest of the All-Star predictions over past seasons.
+
+For every season, the ensemble scores the players (predict_season, so results already in cache/predictions are
+reused), get_all_star_predictions picks the rosters, and the picks are checked against the All-Stars of that
+season. The labels are the stats.all_star of data/raw/<season>.json, read from the feature store, so nothing
+is fetched from basketball-reference. The seasons are spread across a process pool, each worker loads the
+models once.
+
+For each season the report has the number of players picked, the number of actual All-Stars (injury
+replacements included), the hits, precision (hits/picked) and recall (hits/All-Stars), for the whole season and
+per conference. Seasons without any All-Star in the data yet (the current one) are skipped. The totals add the
+hits of every season up before dividing.
+
+Most of the labelled seasons are ones the models were trained on, so every season is marked with its "split":
+"test" for the seasons train.load_data holds out (the same random.seed(6969) draw) and those after its last
+one, "train" for the others. Next to the total of all seasons, "held_out" is the total of the test seasons
+alone, the one that says how the models do on seasons they have not seen.
+
+Run from the repo root:
+
+python backtest.py                          # every season with labels
+python backtest.py 2010-2019 1998 --jobs 4  # ranges and single seasons
+python backtest.py --models svm abc --out backtest_svm_abc.json
+"""
+
+import os
+import json
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from feature_store import open_store, season_rows
+from registry import MODEL_NAMES, get_models
+from season_cache import predict_season
+from predict import get_all_star_predictions
+
+REPORT_PATH = "./backtest.json"
+CONFERENCES = ["East", "West"]
+
+_model_names = None
+_held_out = set()
+
+def init_worker(model_names, held_out):
+  global _model_names, _held_out
+  _model_names = model_names
+  _held_out = held_out
+  get_models(model_names, compiled=True)
+
+def held_out_seasons(seasons):
+  # The seasons the models were not trained on. train imports sklearn, the workers do not need it
+  from train import SEASONS, test_seasons
+  return {season for season in seasons if season not in SEASONS} | set(test_seasons())
+
+def season_labels(store, season):
+  # player_id -> conference of every All-Star of the season
+  rows = season_rows(store, season)
+  all_star = store["all_star"][rows] == 1
+  return {str(p): str(c) for p, c in zip(store["player_id"][rows][all_star], store["conference"][rows][all_star])}
+
+def scores(picked, actual):
+  hits = len(picked & actual)
+  return {
+    "picked": len(picked),
+    "all_stars": len(actual),
+    "hits": hits,
+    "precision": round(hits/len(picked), 4) if picked else None,
+    "recall": round(hits/len(actual), 4) if actual else None
+  }
+
+def backtest_season(season):
+  labels = season_labels(open_store(), season)
+  east, west = get_all_star_predictions(predict_season(season, _model_names))
+  picked = {r[0]: r[3] for r in east + west}
+
+  result = scores(set(picked), set(labels))
+  result["season"] = season
+  result["split"] = "test" if season in _held_out else "train"
+  for conf in CONFERENCES:
+    result[conf.lower()] = scores({p for p, c in picked.items() if c == conf}, {p for p, c in labels.items() if c == conf})
+  result["missed"] = sorted(set(labels) - set(picked))
+  result["wrong"] = sorted(set(picked) - set(labels))
+  return result
+
+def parse_seasons(args, available):
+  if not args:
+    return available
+  seasons = []
+  for arg in args:
+    first, _, last = arg.partition("-")
+    seasons.extend(range(int(first), int(last or first) + 1))
+  # Ranges step over seasons that are not in the data, like 1999
+  return [s for s in sorted(set(seasons)) if s in available]
+
+def totals(results):
+  total = {}
+  for key in [None] + [conf.lower() for conf in CONFERENCES]:
+    rs = [r[key] if key else r for r in results]
+    picked, all_stars, hits = sum(r["picked"] for r in rs), sum(r["all_stars"] for r in rs), sum(r["hits"] for r in rs)
+    entry = {"picked": picked, "all_stars": all_stars, "hits": hits, "precision": round(hits/picked, 4) if picked else None, "recall": round(hits/all_stars, 4) if all_stars else None}
+    if key:
+      total[key] = entry
+    else:
+      total.update(entry)
+  return total
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Backtest the All-Star predictions on past seasons, offline")
+  parser.add_argument("seasons", nargs="*", help="seasons or ranges like 2010-2019, default all seasons with All-Stars in the data")
+  parser.add_argument("--models", nargs="+", default=MODEL_NAMES, choices=MODEL_NAMES, help="models of the ensemble")
+  parser.add_argument("--jobs", type=int, default=os.cpu_count(), help="worker processes")
+  parser.add_argument("--out", default=REPORT_PATH, help="where to write the JSON report")
+  args = parser.parse_args()
+
+  store = open_store()
+  labelled = sorted(int(s) for s in store["meta"]["seasons"] if season_labels(store, int(s)))
+  seasons = parse_seasons(args.seasons, labelled)
+  if not seasons:
+    parser.error("no season with All-Stars in the data was given")
+
+  held_out = held_out_seasons(labelled)
+  with ProcessPoolExecutor(min(args.jobs, len(seasons)), initializer=init_worker, initargs=(args.models, held_out)) as pool:
+    results = list(pool.map(backtest_season, seasons))
+
+  tested = [r for r in results if r["split"] == "test"]
+  report = {"models": args.models, "seasons": results, "total": totals(results), "held_out": totals(tested)}
+  with open(args.out + ".tmp", "w") as fp:
+    json.dump(report, fp, sort_keys=True, indent=2, separators=(',', ': '))
+  os.replace(args.out + ".tmp", args.out)
+
+  print("{:>8} {:>5} {:>7} {:>9} {:>5} {:>9} {:>7}".format("season", "split", "picked", "all-stars", "hits", "precision", "recall"))
+  rows = results + [dict(report["total"], season="total", split="all")]
+  if tested:
+    rows.append(dict(report["held_out"], season="held out", split="test"))
+  for r in rows:
+    print("{:>8} {:>5} {:>7} {:>9} {:>5} {:>9.3f} {:>7.3f}".format(r["season"], r["split"], r["picked"], r["all_stars"], r["hits"], r["precision"], r["recall"]))
+  print("Report written to {}".format(args.out))
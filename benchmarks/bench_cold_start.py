@@ -0,0 +1,73 @@
+"""
+Cold start benchmark for prediction.
+
+Times fresh Python processes that import predict.py and score a season, the way a cron job or CLI call would:
+
+- before: the old imports (sklearn.metrics, requests and bs4 through data.bb_ref) and all three full
+  GridSearchCV files loaded eagerly with joblib
+- sklearn: predict.py as it is, with the sklearn models loaded from the registry (get_models(compiled=False))
+- default: predict.py as it is, with the models of get_models(), the compiled ones (see compiled.py) that
+  predict.py and the service score with. The run fails if it imports sklearn or joblib
+
+The target is a default start under TARGET_SECONDS.
+
+Each run is a new process, so the OS file cache is warm but nothing is imported or loaded yet.
+Run from the repo root:
+
+python benchmarks/bench_cold_start.py [runs]
+"""
+
+import sys
+import time
+import statistics
+import subprocess
+
+SEASON = 2020
+TARGET_SECONDS = 1.0
+
+BEFORE = """
+from sklearn import metrics
+from joblib import load
+import data.bb_ref
+import predict
+models = [load('./models/svm.joblib'), load('./models/nn.joblib'), load('./models/abc.joblib')]
+predict.predict_all_star_prob_for_season(models, {season})
+""".format(season=SEASON)
+
+SKLEARN = """
+import predict
+predict.predict_all_star_prob_for_season(predict.get_models(compiled=False), {season})
+""".format(season=SEASON)
+
+DEFAULT = """
+import sys
+import predict
+predict.predict_all_star_prob_for_season(predict.get_models(), {season})
+assert "sklearn" not in sys.modules and "joblib" not in sys.modules, "the default path imported sklearn"
+""".format(season=SEASON)
+
+IMPORT_ONLY = """
+import predict
+"""
+
+def time_process(code, runs):
+  times = []
+  for _ in range(runs):
+    start = time.perf_counter()
+    subprocess.run([sys.executable, "-W", "ignore", "-c", code], check=True, stdout=subprocess.DEVNULL)
+    times.append(time.perf_counter() - start)
+  return statistics.median(times), min(times)
+
+if __name__ == "__main__":
+  runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+
+  # Make sure the slim artifacts, the compiled models and the feature store exist, so the timed runs measure a
+  # normal start
+  time_process(SKLEARN, 1)
+  time_process(DEFAULT, 1)
+
+  print("{:>28} {:>10} {:>10}".format("", "median(s)", "min(s)"))
+  for label, code in [("import predict", IMPORT_ONLY), ("before: import + score", BEFORE), ("sklearn: import + score", SKLEARN), ("default: import + score", DEFAULT)]:
+    median, best = time_process(code, runs)
+    print("{:>28} {:>10.3f} {:>10.3f}".format(label, median, best))
+  print("Default start {} the {:.1f}s target".format("meets" if median < TARGET_SECONDS else "misses", TARGET_SECONDS))
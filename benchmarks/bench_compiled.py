@@ -0,0 +1,70 @@
+"""
+Benchmark of the compiled models (compiled.py) against sklearn.
+
+For every season in data/raw, scores the season with each model, through sklearn's predict_proba and through
+the compiled model, and checks that the probabilities agree within compiled.TOLERANCE and that
+predict_all_star_prob_for_season gives the same ranking either way. Also times single rows, the batch size of
+predict_player and of a lone query to serve.py.
+
+Run from the repo root:
+
+python benchmarks/bench_compiled.py [season ...] [--repeat 5]
+"""
+
+import os
+import sys
+import time
+import argparse
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from compiled import TOLERANCE
+from feature_store import open_store, season_rows
+from registry import MODEL_NAMES, get_models
+from predict import ensemble_prob, predict_all_star_prob_for_season
+
+def best_time(fn, *args, repeat=5):
+  times = []
+  for _ in range(repeat):
+    start = time.perf_counter()
+    result = fn(*args)
+    times.append(time.perf_counter() - start)
+  return result, min(times)
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Compare the compiled models against sklearn")
+  parser.add_argument("seasons", type=int, nargs="*")
+  parser.add_argument("--repeat", type=int, default=5)
+  args = parser.parse_args()
+
+  store = open_store()
+  seasons = args.seasons or sorted(int(s) for s in store["meta"]["seasons"])
+  models = get_models(compiled=False)
+  compiled = get_models()
+
+  print("{:>6} {:>8} {:>10} {:>11} {:>8} {:>10} {:>6}".format("season", "players", "sklearn(s)", "compiled(s)", "speedup", "max diff", "same"))
+  totals = np.zeros(2)
+  max_diffs = np.zeros(len(MODEL_NAMES))
+  all_same = True
+  for season in seasons:
+    x = np.asarray(store["features"][season_rows(store, season)])
+    before, t_before = best_time(ensemble_prob, models, x, repeat=args.repeat)
+    after, t_after = best_time(ensemble_prob, compiled, x, repeat=args.repeat)
+    for i, (model, compiled_model) in enumerate(zip(models, compiled)):
+      max_diffs[i] = max(max_diffs[i], np.abs(model.predict_proba(x)[:,1] - compiled_model.predict_proba(x)[:,1]).max())
+    same = predict_all_star_prob_for_season(models, season, store) == predict_all_star_prob_for_season(compiled, season, store)
+    all_same = all_same and same
+    totals += [t_before, t_after]
+    print("{:>6} {:>8} {:>10.4f} {:>11.4f} {:>7.1f}x {:>10.1e} {:>6}".format(season, len(x), t_before, t_after, t_before/t_after, np.abs(before - after).max(), str(same)))
+  print("{:>6} {:>8} {:>10.4f} {:>11.4f} {:>7.1f}x".format("total", "", totals[0], totals[1], totals[0]/totals[1]))
+
+  x = np.asarray(store["features"][:1])
+  _, t_before = best_time(ensemble_prob, models, x, repeat=max(args.repeat, 20))
+  _, t_after = best_time(ensemble_prob, compiled, x, repeat=max(args.repeat, 20))
+  print("single row: sklearn {:.2f} ms, compiled {:.2f} ms, {:.1f}x".format(t_before*1000, t_after*1000, t_before/t_after))
+
+  for name, diff in zip(MODEL_NAMES, max_diffs):
+    print("{}: max difference {:.1e} ({})".format(name, diff, "ok" if diff <= TOLERANCE else "ABOVE TOLERANCE {}".format(TOLERANCE)))
+  if (max_diffs > TOLERANCE).any() or not all_same:
+    exit(1)
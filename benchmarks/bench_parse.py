@@ -0,0 +1,101 @@
+"""
+Parse-throughput benchmark for bb_ref.
+
+Renders fixture pages for a season (see fixtures.py) and runs every page through the old BeautifulSoup
+parsing and through the targeted lxml parsing in bb_ref, checking both return the same results.
+Pages are served from memory, so only parsing is timed.
+
+Run from the repo root:
+
+python benchmarks/bench_parse.py [season] [num_players]
+"""
+
+import io
+import os
+import sys
+import time
+import contextlib
+from bs4 import BeautifulSoup
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from data import bb_ref
+from fixtures import STANDINGS_DATE, MemoryCache, load_season, render_season
+
+# The BeautifulSoup versions of the bb_ref functions, as they were before targeted parsing
+
+def bs4_player_ids_for_season(season):
+  soup = BeautifulSoup(bb_ref.fetch('/leagues/NBA_' + str(season) + '_totals.html'), 'html.parser')
+  rows = soup.find("table", { "id": "totals_stats" }).find("tbody").find_all("tr", class_=lambda x: x != 'thead')
+  return set(player.find("td", {"class":"left"})['data-append-csv'] for player in rows)
+
+def bs4_stats_by_id_and_season(player_id, season):
+  soup = BeautifulSoup(bb_ref.fetch('/players/' + player_id[0] + '/' + player_id + '/splits/' + str(season)), 'html.parser')
+  parent = soup.find("table", {"id": "splits"}).find("th", text="All-Star").parent
+  stats_dict = {}
+  for s in parent.find_all("td"):
+    if s.get("data-stat") == "split_value" and s.text != "Pre":
+      return -1
+    elif s.text != "Pre":
+      stats_dict[s.get("data-stat")] = s.text
+  return stats_dict
+
+def bs4_player_info_by_id(player_id, season):
+  soup = BeautifulSoup(bb_ref.fetch('/players/' + player_id[0] + '/' + player_id + '.html'), 'html.parser')
+  name = soup.find("h1", {"itemprop": "name"}).text
+  trs = soup.find("table", {"id": "per_game"}).find("tbody").find_all("tr", {"class": ["full_table", "partial_table"]})
+  for tr in trs:
+    if tr.get("id").split(".")[1] == str(season):
+      position = tr.find("td", {"data-stat": "pos"}).text
+      td = tr.find("td", {"data-stat": "team_id"})
+      if td.find("a"):
+        team = td.find("a").text
+  return name, position, team
+
+def bs4_standings_and_win_pct_by_date(season, date):
+  standings = {}
+  for conf in ["eastern", "western"]:
+    soup = BeautifulSoup(bb_ref.fetch("/leagues/NBA_" + str(season) + "_standings_by_date_" + conf + "_conference.html"), 'html.parser')
+    row = soup.find("table", {"id": "standings_by_date"}).find("a", text=date).parent.parent
+    for t in row.find_all("td"):
+      wins, losses = [int(x) for x in t.find("small").text[1:-1].split("-")]
+      standings[t.get("class")[1]] = {
+        "conference": "East" if conf == "eastern" else "West",
+        "name": t.get("class")[1],
+        "rank": int(t.get("data-stat")[:-2]),
+        "record": float(wins)/float(wins + losses)
+      }
+  return standings
+
+def run(calls):
+  results = []
+  start = time.perf_counter()
+  with contextlib.redirect_stdout(io.StringIO()):
+    for fn, args in calls:
+      results.append(fn(*args))
+  return results, time.perf_counter() - start
+
+if __name__ == "__main__":
+  season = int(sys.argv[1]) if len(sys.argv) > 1 else 2019
+  num_players = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+
+  pages = render_season(load_season(season, num_players), season)
+  bb_ref.configure(base_url="", cache=MemoryCache(pages), offline=True, rate=0)
+  player_ids = sorted(bs4_player_ids_for_season(season))
+  date = STANDINGS_DATE.format(season)
+
+  workloads = [
+    ("totals_stats", [(bs4_player_ids_for_season, (season,))], [(bb_ref.get_player_ids_for_season, (season,))]),
+    ("splits", [(bs4_stats_by_id_and_season, (p, season)) for p in player_ids], [(bb_ref.get_stats_by_id_and_season, (p, season)) for p in player_ids]),
+    ("per_game", [(bs4_player_info_by_id, (p, season)) for p in player_ids], [(bb_ref.get_player_info_by_id, (p, season)) for p in player_ids]),
+    ("standings_by_date", [(bs4_standings_and_win_pct_by_date, (season, date))], [(bb_ref.get_standings_and_win_pct_by_date, (season, date))]),
+  ]
+
+  total_mb = sum(len(p.encode("utf-8")) for p in pages.values()) / 2**20
+  print("{} fixture pages, {:.1f} MB".format(len(pages), total_mb))
+  print("{:>18} {:>6} {:>12} {:>12} {:>12} {:>8} {:>6}".format("table", "pages", "bs4 (s)", "lxml (s)", "lxml pages/s", "speedup", "same"))
+  for name, old_calls, new_calls in workloads:
+    old_results, t_old = run(old_calls)
+    new_results, t_new = run(new_calls)
+    num_pages = len(new_calls) * (2 if name == "standings_by_date" else 1)
+    print("{:>18} {:>6} {:>12.3f} {:>12.3f} {:>12.0f} {:>7.1f}x {:>6}".format(name, num_pages, t_old, t_new, num_pages/t_new, t_old/t_new, str(old_results == new_results)))
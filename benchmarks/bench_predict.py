@@ -0,0 +1,68 @@
+"""
+Before/after benchmark for season scoring.
+
+Compares the old per-player loop (one predict_proba call per player per model) against the
+batched predict_all_star_prob_for_season on every season in data/raw, and checks that both
+produce the same normalized ranking.
+
+Run from the repo root:
+
+python benchmarks/bench_predict.py [season ...]
+
+The old loop takes over half a minute per season, so pass a few seasons for a quick run.
+"""
+
+import os
+import sys
+import glob
+import json
+import time
+import numpy as np
+from joblib import load
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from util import player_data_to_input
+from predict import predict_all_star_prob_for_season
+
+def per_player_prob_for_season(models, season):
+  # The scoring loop as it was before batching, kept here as the baseline
+  with open("./data/raw/" + str(season) + ".json") as players_data_file:
+    players_data = json.load(players_data_file)
+  results = []
+  for p, data in players_data.items():
+    x = player_data_to_input(p, data).astype(float)
+    total_prob = 0
+    for model in models:
+      total_prob += model.predict_proba(x)[:,1][0]
+    results.append((p, data, total_prob/len(models)))
+
+  sorted_results = sorted(results, key = lambda x: x[2], reverse=True)
+  max_prob = sorted_results[0][2]
+  sorted_results_simple = []
+  for r in sorted_results:
+    prob = round(r[2]/max_prob, 3)
+    sorted_results_simple.append([r[0], r[1]["details"]["name"], r[1]["details"]["position"], r[1]["team"]["conference"], prob])
+  return sorted_results_simple
+
+def time_call(fn, *args):
+  start = time.perf_counter()
+  result = fn(*args)
+  return result, time.perf_counter() - start
+
+if __name__ == "__main__":
+  models = [load('./models/svm.joblib'), load('./models/nn.joblib'), load('./models/abc.joblib')]
+  seasons = [int(s) for s in sys.argv[1:]] or sorted(int(os.path.basename(f)[:-5]) for f in glob.glob("./data/raw/*.json") if os.path.basename(f)[:-5].isdigit())
+
+  total_before = 0
+  total_after = 0
+  print("{:>6} {:>8} {:>10} {:>10} {:>8} {:>6}".format("season", "players", "before(s)", "after(s)", "speedup", "same"))
+  for season in seasons:
+    before, t_before = time_call(per_player_prob_for_season, models, season)
+    after, t_after = time_call(predict_all_star_prob_for_season, models, season)
+    same = before == after
+    total_before += t_before
+    total_after += t_after
+    print("{:>6} {:>8} {:>10.3f} {:>10.3f} {:>7.1f}x {:>6}".format(season, len(after), t_before, t_after, t_before/t_after, str(same)))
+
+  print("{:>6} {:>8} {:>10.3f} {:>10.3f} {:>7.1f}x".format("total", "", total_before, total_after, total_before/total_after))
@@ -0,0 +1,172 @@
+"""
+Scaling benchmark suite.
+
+Generates synthetic copies of data/raw at each requested scale (see synthetic.py) and times every stage of the
+pipeline on them:
+
+- process_data             the process_data.py transform, every season from raw JSON to csv
+- build_store              feature_store.build_store, every season
+- load_data                train.load_data on the synthetic store
+- player_data_to_input     util.player_data_to_input, one call per player of the latest season
+- predict_season           predict_all_star_prob_for_season on the latest season, with the models in models/
+- get_all_star_predictions on the result of predict_season
+- parse_totals             bb_ref.get_player_ids_for_season on the totals page of the latest season
+- parse_players            the splits and per_game pages of PARSE_SAMPLE players (these pages do not grow with
+                           the season, so a fixed sample is enough)
+- parse_standings          bb_ref.get_standings_and_win_pct_by_date
+
+Each stage is run --repeat times and the fastest run is kept. Results can be saved with --out, and a later run
+compared against them with --baseline: any stage more than --tolerance (and at least --min-delta seconds) slower
+than in the baseline is reported as a regression and the script exits with status 1, so it can gate a deploy.
+
+Run from the repo root:
+
+python benchmarks/bench_suite.py [--scales 1 10 100] [--repeat 3] [--work-dir dir] [--out results.json]
+                                 [--baseline results.json] [--tolerance 0.25] [--min-delta 0.05]
+
+The 100x data is about 1.3 GB of JSON. Pass --work-dir to keep the generated data between runs, otherwise it
+is written to a temporary folder and removed afterwards.
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import contextlib
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from data import bb_ref
+from data import process_data
+from util import player_data_to_input
+from feature_store import build_store, open_store
+from predict import predict_all_star_prob_for_season, get_all_star_predictions
+from registry import get_models
+from train import load_data
+from synthetic import raw_seasons, write_seasons
+from fixtures import STANDINGS_DATE, MemoryCache, render_season, totals_page
+
+PARSE_SAMPLE = 200
+
+@contextlib.contextmanager
+def working_dir(path):
+  # process_data.py works on ./raw and ./processed of the folder it runs in
+  cwd = os.getcwd()
+  os.chdir(path)
+  try:
+    yield
+  finally:
+    os.chdir(cwd)
+
+def time_stage(fn, repeat):
+  best = None
+  with contextlib.redirect_stdout(io.StringIO()):
+    for _ in range(repeat):
+      start = time.perf_counter()
+      result = fn()
+      elapsed = time.perf_counter() - start
+      best = elapsed if best is None else min(best, elapsed)
+  return result, best
+
+def prepare(scale_dir, scale):
+  raw_dir = os.path.join(scale_dir, "raw")
+  if raw_seasons(raw_dir) != raw_seasons():
+    write_seasons(raw_dir, scale)
+  os.makedirs(os.path.join(scale_dir, "processed"), exist_ok=True)
+  return raw_dir
+
+def run_scale(scale_dir, scale, models, repeat):
+  raw_dir = prepare(scale_dir, scale)
+  store_dir = os.path.join(scale_dir, "store")
+  seasons = raw_seasons(raw_dir)
+  season = seasons[-1]
+  with open(os.path.join(raw_dir, str(season) + ".json")) as players_data_file:
+    players_data = json.load(players_data_file)
+
+  def run_process_data():
+    with working_dir(scale_dir):
+      for year in seasons:
+        process_data.process_season(year)
+
+  results = {}
+  def record(stage, fn, rows):
+    result, seconds = time_stage(fn, repeat)
+    results[stage] = {"rows": rows, "seconds": seconds}
+    return result
+
+  record("process_data", run_process_data, None)
+  meta = record("build_store", lambda: build_store(raw_dir, store_dir), None)
+  num_rows = meta["num_rows"]
+  results["process_data"]["rows"] = results["build_store"]["rows"] = num_rows
+
+  record("load_data", lambda: load_data(store=open_store(raw_dir, store_dir)), num_rows)
+  record("player_data_to_input", lambda: [player_data_to_input(p, data) for p, data in players_data.items()], len(players_data))
+
+  store = open_store(raw_dir, store_dir)
+  prob_list = record("predict_season", lambda: predict_all_star_prob_for_season(models, season, store), len(players_data))
+  record("get_all_star_predictions", lambda: get_all_star_predictions(prob_list), len(prob_list))
+
+  sample = {p: players_data[p] for p in sorted(players_data)[:PARSE_SAMPLE]}
+  pages = render_season(sample, season)
+  pages["/leagues/NBA_{}_totals.html".format(season)] = totals_page(players_data, season)
+  bb_ref.configure(base_url="", cache=MemoryCache(pages), offline=True, rate=0)
+  record("parse_totals", lambda: bb_ref.get_player_ids_for_season(season), len(players_data))
+  record("parse_players", lambda: [(bb_ref.get_stats_by_id_and_season(p, season), bb_ref.get_player_info_by_id(p, season)) for p in sample], 2*len(sample))
+  record("parse_standings", lambda: bb_ref.get_standings_and_win_pct_by_date(season, STANDINGS_DATE.format(season)), 2)
+
+  return results
+
+def find_regressions(results, baseline, tolerance, min_delta):
+  # Stages that only take a few milliseconds are mostly timer noise, so a regression has to be at least min_delta seconds
+  regressions = []
+  for scale, stages in results.items():
+    for stage, r in stages.items():
+      base = baseline.get(scale, {}).get(stage)
+      if base and r["seconds"] > base["seconds"]*(1 + tolerance) and r["seconds"] - base["seconds"] >= min_delta:
+        regressions.append((scale, stage, base["seconds"], r["seconds"]))
+  return regressions
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Time every stage of the pipeline on synthetic data at several scales")
+  parser.add_argument("--scales", type=int, nargs="+", default=[1, 10, 100])
+  parser.add_argument("--repeat", type=int, default=3, help="runs per stage, the fastest one is kept")
+  parser.add_argument("--work-dir", help="where to keep the synthetic data, reused between runs")
+  parser.add_argument("--out", help="save the results as JSON")
+  parser.add_argument("--baseline", help="results of an earlier run to compare against")
+  parser.add_argument("--tolerance", type=float, default=0.25, help="how much slower than the baseline counts as a regression")
+  parser.add_argument("--min-delta", type=float, default=0.05, help="smallest slowdown in seconds that counts as a regression")
+  args = parser.parse_args()
+
+  work_dir = args.work_dir or tempfile.mkdtemp(prefix="bench_suite_")
+  # The sklearn models, so the timings stay comparable with saved baselines
+  models = get_models(compiled=False)
+  results = {}
+  try:
+    for scale in args.scales:
+      results["{}x".format(scale)] = run_scale(os.path.join(work_dir, "{}x".format(scale)), scale, models, args.repeat)
+  finally:
+    if not args.work_dir:
+      shutil.rmtree(work_dir, ignore_errors=True)
+
+  print("{:>6} {:>26} {:>10} {:>12} {:>12}".format("scale", "stage", "rows", "seconds", "rows/s"))
+  for scale, stages in results.items():
+    for stage, r in stages.items():
+      print("{:>6} {:>26} {:>10} {:>12.4f} {:>12.0f}".format(scale, stage, r["rows"], r["seconds"], r["rows"]/r["seconds"]))
+
+  if args.out:
+    with open(args.out, "w") as fp:
+      json.dump(results, fp, sort_keys=True, indent=2, separators=(',', ': '))
+
+  if args.baseline:
+    with open(args.baseline) as fp:
+      baseline = json.load(fp)
+    regressions = find_regressions(results, baseline, args.tolerance, args.min_delta)
+    for scale, stage, before, after in regressions:
+      print("REGRESSION {} {}: {:.4f}s -> {:.4f}s ({:+.0f}%)".format(scale, stage, before, after, 100*(after/before - 1)))
+    if regressions:
+      sys.exit(1)
+    print("No regressions against {} (tolerance {:.0f}%)".format(args.baseline, 100*args.tolerance))
@@ -0,0 +1,144 @@
+"""
+Renders saved-page fixtures in the layout of basketball-reference.com, from the raw JSON in data/raw.
+
+The pages only carry what bb_ref reads (the totals_stats, splits, per_game and standings_by_date tables, the
+player name and the All-Star rosters), surrounded by filler tables, some of them inside HTML comments, so they
+are about as large as the real pages. They are used by the parsing benchmarks, and can be served with
+http.server to run the scraper offline.
+
+Run from the repo root:
+
+python benchmarks/fixtures.py <season> <out_dir> [num_players]
+"""
+
+import os
+import sys
+import json
+from html import escape
+
+STANDINGS_DATE = "Feb 15, {}"
+
+class MemoryCache:
+  # Stands in for bb_ref's ResponseCache, so fixture pages are served from memory
+  def __init__(self, pages):
+    self.pages = pages
+
+  def get(self, url, ttl=None):
+    return self.pages.get(url)
+
+  def put(self, url, text):
+    self.pages[url] = text
+
+def filler(num_tables, num_rows, seed):
+  # Tables that are not read by bb_ref, every other one hidden in a comment like bb-ref does
+  parts = []
+  for t in range(num_tables):
+    rows = []
+    for r in range(num_rows):
+      cells = "".join('<td class="right " data-stat="col_{}">{}.{}</td>'.format(c, (seed + t*31 + r*7 + c) % 97, c) for c in range(20))
+      rows.append('<tr><th scope="row" class="left " data-stat="season">{}</th>{}</tr>'.format(r, cells))
+    table = '<div class="table_container" id="div_extra_{0}"><table class="stats_table" id="extra_{0}"><tbody>{1}</tbody></table></div>'.format(t, "".join(rows))
+    parts.append("<!--\n" + table + "\n-->" if t % 2 else table)
+  return "".join(parts)
+
+def page(body, seed):
+  head = '<!DOCTYPE html><html><head><meta charset="utf-8"><title>fixture</title><meta itemprop="name" content="Basketball Reference"></head><body><div id="wrap">'
+  return head + filler(6, 60, seed) + body + filler(6, 60, seed + 1) + '</div></body></html>'
+
+def ordinal(n):
+  if n % 10 == 1 and n != 11:
+    return "{}st".format(n)
+  if n % 10 == 2 and n != 12:
+    return "{}nd".format(n)
+  if n % 10 == 3 and n != 13:
+    return "{}rd".format(n)
+  return "{}th".format(n)
+
+def totals_page(players_data, season):
+  player_ids = sorted(players_data)
+  rows = []
+  for i, p in enumerate(player_ids):
+    data = players_data[p]
+    rows.append(
+      '<tr class="full_table"><th scope="row" class="right " data-stat="ranker">{}</th>'
+      '<td class="left " data-append-csv="{}" data-stat="player"><a href="/players/{}/{}.html">{}</a></td>'
+      '<td class="center " data-stat="pos">{}</td>'
+      '<td class="left " data-stat="team_id"><a href="/teams/{}/{}.html">{}</a></td>'
+      '<td class="right " data-stat="g">{}</td><td class="right " data-stat="pts">{}</td></tr>'.format(
+        i + 1, p, p[0], p, escape(data["details"]["name"]), data["details"]["position"],
+        data["team"]["name"], season, data["team"]["name"], data["stats"]["g"], data["stats"]["pts"]))
+    if i % 20 == 19:
+      rows.append('<tr class="thead"><th>Rk</th><th>Player</th></tr>')
+  return page('<table class="sortable stats_table" id="totals_stats"><thead><tr><th>Rk</th></tr></thead><tbody>{}</tbody></table>'.format("".join(rows)), season)
+
+def render_season(players_data, season):
+  pages = {}
+  player_ids = sorted(players_data)
+  pages["/leagues/NBA_{}_totals.html".format(season)] = totals_page(players_data, season)
+
+  for n, p in enumerate(player_ids):
+    data = players_data[p]
+    cells = "".join('<td class="right " data-stat="{}">{}</td>'.format(k, v) for k, v in sorted(data["stats"].items()) if k != "all_star")
+    splits = (
+      '<table class="stats_table" id="splits"><tbody>'
+      '<tr><th scope="row" class="left ">Total</th><td class="left " data-stat="split_value">Total</td></tr>'
+      '<tr><th scope="row" class="left ">All-Star</th><td class="left " data-stat="split_value">Pre</td>{}</tr>'
+      '<tr><th scope="row" class="left "></th><td class="left " data-stat="split_value">Post</td></tr>'
+      '</tbody></table>').format(cells)
+    pages["/players/{}/{}/splits/{}".format(p[0], p, season)] = page(splits, n)
+
+    per_game = (
+      '<h1 itemprop="name">{}</h1>'
+      '<table class="row_summable sortable stats_table" id="per_game"><tbody>'
+      '<tr id="per_game.{}" class="full_table"><th scope="row" class="left " data-stat="season">x</th>'
+      '<td class="center " data-stat="pos">{}</td>'
+      '<td class="left " data-stat="team_id"><a href="/teams/{}/{}.html">{}</a></td></tr>'
+      '<tr id="per_game.{}" class="full_table"><th scope="row" class="left " data-stat="season">x</th>'
+      '<td class="center " data-stat="pos">{}</td><td class="left " data-stat="team_id">TOT</td></tr>'
+      '</tbody></table>').format(
+        escape(data["details"]["name"]), season, data["details"]["position"], data["team"]["name"], season,
+        data["team"]["name"], season - 1, data["details"]["position"])
+    pages["/players/{}/{}.html".format(p[0], p)] = page(per_game, n + 1)
+
+  teams = {}
+  for data in players_data.values():
+    teams[data["team"]["name"]] = data["team"]
+  date = STANDINGS_DATE.format(season)
+  for conf, conf_name in [("eastern", "East"), ("western", "West")]:
+    conf_teams = sorted([t for t in teams.values() if t["conference"] == conf_name], key=lambda t: t["rank"])
+    cells = []
+    for t in conf_teams:
+      wins = int(round(t["record"]*50))
+      cells.append('<td class="left {}" data-stat="{}"><a href="/teams/{}/{}.html">{}</a> <small>({}-{})</small></td>'.format(t["name"], ordinal(t["rank"]), t["name"], season, t["name"], wins, 50 - wins))
+    table = '<table class="stats_table" id="standings_by_date"><tbody><tr><th scope="row"><a href="#">Jan 1, {}</a></th></tr><tr><th scope="row"><a href="#">{}</a></th>{}</tr></tbody></table>'.format(season, date, "".join(cells))
+    pages["/leagues/NBA_{}_standings_by_date_{}_conference.html".format(season, conf)] = page(table, season + len(conf))
+
+  rosters = []
+  for conf in ["East", "West"]:
+    ids = [p for p in player_ids if players_data[p]["stats"]["all_star"] and players_data[p]["team"]["conference"] == conf]
+    rosters.append("<tbody>" + "".join('<tr><th data-stat="player" data-append-csv="{}">x</th></tr>'.format(p) for p in ids) + "</tbody>")
+  pages["/allstar/NBA_{}.html".format(season)] = page('<div class="overthrow table_container"><tbody></tbody></div><div class="overthrow table_container">{}</div><div class="overthrow table_container">{}</div>'.format(*rosters), season)
+
+  return pages
+
+def load_season(season, num_players=None):
+  with open("./data/raw/" + str(season) + ".json") as players_data_file:
+    players_data = json.load(players_data_file)
+  if num_players:
+    players_data = {p: players_data[p] for p in sorted(players_data)[:num_players]}
+  return players_data
+
+def write_pages(pages, out_dir):
+  for path, text in pages.items():
+    out_path = os.path.join(out_dir, path.lstrip("/"))
+    os.makedirs(os.path.dirname(out_path), exist_ok=True)
+    with open(out_path, "w", encoding="utf-8") as f:
+      f.write(text)
+
+if __name__ == "__main__":
+  season = int(sys.argv[1])
+  out_dir = sys.argv[2]
+  num_players = int(sys.argv[3]) if len(sys.argv) > 3 else None
+  pages = render_season(load_season(season, num_players), season)
+  write_pages(pages, out_dir)
+  print("Wrote {} pages for {} to {} (standings date: {})".format(len(pages), season, out_dir, STANDINGS_DATE.format(season)))
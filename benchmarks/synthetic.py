@@ -0,0 +1,89 @@
+"""
+Synthetic seasons for the scaling benchmarks.
+
+A synthetic season follows the schema of data/raw/<season>.json exactly, and is made from the real one:
+every real player is copied `scale` times, with each numeric stat jittered a little and written back in the
+same format bb-ref uses ("31", "19.0", ".323", "+2.3"). The copies keep the team and the All-Star label of
+the player they come from, so a 10x season has ten times the players, teams stay in their conference, and the
+class balance is the same as in the real data. Generation is seeded, so a scale always gives the same data.
+
+Player ids of the copies are the real id with "s<k>" appended, so they stay unique and keep the first letter
+bb-ref uses in its URLs.
+
+Run from the repo root:
+
+python benchmarks/synthetic.py <scale> <out_dir> [season ...]
+"""
+
+import os
+import sys
+import glob
+import json
+import random
+
+RAW_DIR = "./data/raw"
+SPREAD = 0.05
+
+# Shooting percentages are fractions written as ".323", usg_pct is a percentage written as "12.4"
+FRACTION_STATS = {"fg_pct", "fg3_pct", "ft_pct", "ts_pct"}
+
+def jitter(key, value, rng):
+  if not isinstance(value, str) or value == "":
+    return value
+  try:
+    x = float(value)
+  except ValueError:
+    return value
+  x *= 1 + rng.gauss(0, SPREAD)
+
+  decimals = len(value.split(".")[1]) if "." in value else 0
+  if key in FRACTION_STATS:
+    text = "{:.3f}".format(min(max(x, 0.0), 1.0))
+    return text[1:] if text.startswith("0") else text
+  if value.startswith(("+", "-")):
+    return "{:+.{}f}".format(x, decimals)
+  return "{:.{}f}".format(max(x, 0.0), decimals)
+
+def jitter_player(data, rng):
+  stats = {k: jitter(k, v, rng) for k, v in data["stats"].items() if k != "all_star"}
+  stats["all_star"] = data["stats"]["all_star"]
+  # Games are divided by, and no one starts more games than they played
+  stats["g"] = str(max(int(stats["g"]), 1))
+  stats["gs"] = str(min(int(stats["gs"]), int(stats["g"])))
+  return {
+    "details": dict(data["details"]),
+    "stats": dict(sorted(stats.items())),
+    "team": dict(data["team"])
+  }
+
+def make_season(players_data, scale, seed):
+  rng = random.Random(seed)
+  synthetic = {}
+  for p in sorted(players_data):
+    for k in range(scale):
+      synthetic["{}s{}".format(p, k)] = jitter_player(players_data[p], rng)
+  return synthetic
+
+def raw_seasons(raw_dir=RAW_DIR):
+  stems = [os.path.basename(path)[:-len(".json")] for path in glob.glob(os.path.join(raw_dir, "*.json"))]
+  return sorted(int(stem) for stem in stems if stem.isdigit())
+
+def write_seasons(out_dir, scale, seasons=None, raw_dir=RAW_DIR):
+  # Writes out_dir/<season>.json for every season, returns the number of players written
+  os.makedirs(out_dir, exist_ok=True)
+  num_players = 0
+  for season in seasons or raw_seasons(raw_dir):
+    with open(os.path.join(raw_dir, str(season) + ".json")) as players_data_file:
+      players_data = json.load(players_data_file)
+    synthetic = make_season(players_data, scale, seed=season*1000 + scale)
+    with open(os.path.join(out_dir, str(season) + ".json"), "w") as fp:
+      json.dump(synthetic, fp, indent=2)
+    num_players += len(synthetic)
+  return num_players
+
+if __name__ == "__main__":
+  scale = int(sys.argv[1])
+  out_dir = sys.argv[2]
+  seasons = [int(s) for s in sys.argv[3:]]
+  num_players = write_seasons(out_dir, scale, seasons)
+  print("Wrote {} synthetic players at {}x to {}".format(num_players, scale, out_dir))
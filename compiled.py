@@ -0,0 +1,241 @@
+"""
+Compiled inference for the models of the ensemble.
+
+sklearn's predict_proba validates its input, converts it and dispatches through several layers on every call,
+and each model evaluates in float64. compile_model() turns a fitted model into a few flat arrays, and a
+CompiledModel evaluates them for a whole batch with NumPy alone:
+
+- SVC (RBF)           support vectors and their squared norms, dual coefficients, intercept, gamma and the Platt
+                      parameters of probability=True. With f the decision value in libsvm's sign (the opposite of
+                      decision_function()'s for two classes), r = 1/(1 + exp(probA*f + probB)), clipped to
+                      [1e-7, 1 - 1e-7], is the Platt probability of the first class. libsvm does not return r and
+                      1 - r as they are, but runs them through the iterative solver that couples the pairwise
+                      probabilities of more than two classes, which stops once it is within 0.005/2, so
+                      pairwise_coupling() runs the same iterations. The SVC is evaluated in float64: its dual
+                      coefficients go up to C and sum to ~1e5 in absolute value, but cancel out to decision values
+                      of about 1, which would turn the float32 rounding of the kernel into errors of 1e-2
+- CalibratedClassifierCV  (cv="prefit", method="sigmoid") of an RBF SVC, as train.py saves the SVM. The same arrays,
+                      with the sigmoid it fit on the decision function in place of the Platt parameters:
+                      P(All-Star) = 1/(1 + exp(a*d + b)) with d = decision_function() = -f, so probA = -a and
+                      probB = b, and the probability is that of the second class directly, without coupling
+- MLPClassifier       the weight matrix and bias of every layer, and the hidden activation, in float32. The output
+                      layer is logistic
+- AdaBoostClassifier  (SAMME.R) in float32, every tree packed into node arrays: feature, threshold, left and right child.
+                      A leaf loops back onto itself, so every sample walks max_depth steps down every tree at once.
+                      SAMME.R averages log(p1) - log(p0) of the leaves over the trees and squashes it with a
+                      sigmoid, so each leaf just holds its log(p1) - log(p0), divided by the sum of the estimator
+                      weights. Thresholds are rounded down to float32, so a float32 feature goes the same way as
+                      in sklearn, which compares it with the float64 threshold
+
+Only binary models with these estimators can be compiled, anything else raises a ValueError. The probabilities
+match sklearn's to about 1e-6 (the benchmark checks it against TOLERANCE). Compiled models are saved as .npz,
+the registry keeps one next to each model (see registry.py).
+
+Every .npz carries the VERSION of the code that wrote it, the content hash of this file, and load() turns down
+one of another version: a change to how models are compiled or scored makes the saved ones stale, and the
+predictions cached from them (see season_cache.py).
+"""
+
+import hashlib
+import numpy as np
+
+TOLERANCE = 1e-4
+
+with open(__file__, "rb") as _f:
+  VERSION = hashlib.sha256(_f.read()).hexdigest()
+
+# libsvm clips the Platt probabilities to this, and stops coupling them at this error or number of iterations
+MIN_PROB = 1e-7
+COUPLING_EPS = 0.005/2
+COUPLING_MAX_ITER = 100
+
+def relu(x):
+  return np.maximum(x, 0, out=x)
+
+def tanh(x):
+  return np.tanh(x, out=x)
+
+def logistic(x):
+  np.negative(x, out=x)
+  # exp overflows to inf for very negative x, and 1/inf is the 0 it should be
+  with np.errstate(over="ignore"):
+    np.exp(x, out=x)
+  x += 1
+  return np.reciprocal(x, out=x)
+
+def identity(x):
+  return x
+
+ACTIVATIONS = {"relu": relu, "tanh": tanh, "logistic": logistic, "identity": identity}
+
+def check_binary(model):
+  if len(model.classes_) != 2:
+    raise ValueError("Only binary models can be compiled, {} has {} classes".format(type(model).__name__, len(model.classes_)))
+
+def compile_svc(model):
+  if not model.probability:
+    raise ValueError("Only SVCs with probability=True can be compiled on their own")
+  return dict(compile_svc_kernel(model), prob_a=np.float64(model.probA_[0]), prob_b=np.float64(model.probB_[0]), coupled=np.bool_(True))
+
+def compile_calibrated(model):
+  if model.method != "sigmoid" or len(model.calibrated_classifiers_) != 1:
+    raise ValueError("Only a prefit CalibratedClassifierCV with method=\"sigmoid\" can be compiled")
+  calibrated = model.calibrated_classifiers_[0]
+  # The attribute names changed between sklearn versions
+  svc = getattr(calibrated, "base_estimator", None) or getattr(calibrated, "estimator", None)
+  calibrators = getattr(calibrated, "calibrators", None) or getattr(calibrated, "calibrators_")
+  from sklearn.svm import SVC
+  if not isinstance(svc, SVC):
+    raise ValueError("Only a calibrated SVC can be compiled, not {}".format(type(svc).__name__))
+  check_binary(svc)
+  return dict(compile_svc_kernel(svc), prob_a=np.float64(-calibrators[0].a_), prob_b=np.float64(calibrators[0].b_), coupled=np.bool_(False))
+
+def compile_svc_kernel(model):
+  if model.kernel != "rbf":
+    raise ValueError("Only RBF SVCs can be compiled")
+  sv = np.asarray(model.support_vectors_, dtype=np.float64)
+  return {
+    "support_vectors": sv,
+    "sv_norms": (sv**2).sum(axis=1),
+    # Back to libsvm's sign, that Platt scaling was fit on
+    "dual_coef": -np.asarray(model.dual_coef_[0], dtype=np.float64),
+    "intercept": -np.asarray(model.intercept_, dtype=np.float64),
+    "gamma": np.float64(model._gamma)
+  }
+
+def compile_mlp(model):
+  if model.out_activation_ != "logistic":
+    raise ValueError("Only MLPs with a logistic output can be compiled")
+  arrays = {"activation": np.array(model.activation), "num_layers": np.int32(len(model.coefs_))}
+  for i, (coef, intercept) in enumerate(zip(model.coefs_, model.intercepts_)):
+    arrays["coef{}".format(i)] = np.asarray(coef, dtype=np.float32)
+    arrays["intercept{}".format(i)] = np.asarray(intercept, dtype=np.float32)
+  return arrays
+
+def float32_thresholds(thresholds):
+  # The largest float32 <= each threshold, x <= t is then the same for every float32 x
+  t32 = thresholds.astype(np.float32)
+  above = t32.astype(np.float64) > thresholds
+  t32[above] = np.nextafter(t32[above], np.float32(-np.inf))
+  return t32
+
+def compile_adaboost(model):
+  if model.algorithm != "SAMME.R":
+    raise ValueError("Only SAMME.R AdaBoost can be compiled")
+  trees = [estimator.tree_ for estimator in model.estimators_]
+  offsets = np.cumsum([0] + [tree.node_count for tree in trees])
+  feature, threshold, left, right, value = [], [], [], [], []
+  for offset, tree in zip(offsets, trees):
+    nodes = np.arange(tree.node_count)
+    is_leaf = tree.children_left == -1
+    feature.append(np.where(is_leaf, 0, tree.feature))
+    threshold.append(np.where(is_leaf, np.inf, tree.threshold))
+    left.append(offset + np.where(is_leaf, nodes, tree.children_left))
+    right.append(offset + np.where(is_leaf, nodes, tree.children_right))
+    proba = tree.value[:, 0, :]/tree.value[:, 0, :].sum(axis=1, keepdims=True)
+    log_proba = np.log(np.clip(proba, np.finfo(proba.dtype).eps, None))
+    value.append(log_proba[:, 1] - log_proba[:, 0])
+  weight = model.estimator_weights_[:len(trees)].sum()
+  return {
+    "roots": offsets[:-1].astype(np.int32),
+    "feature": np.concatenate(feature).astype(np.int32),
+    "threshold": float32_thresholds(np.concatenate(threshold)),
+    "left": np.concatenate(left).astype(np.int32),
+    "right": np.concatenate(right).astype(np.int32),
+    "value": (np.concatenate(value)/weight).astype(np.float32),
+    "max_depth": np.int32(max(tree.max_depth for tree in trees))
+  }
+
+def svc_prob(arrays, X):
+  X = X.astype(np.float64)
+  sv = arrays["support_vectors"]
+  distances = X @ sv.T
+  distances *= -2
+  distances += (X*X).sum(axis=1)[:, None]
+  distances += arrays["sv_norms"]
+  np.maximum(distances, 0, out=distances)
+  distances *= -arrays["gamma"]
+  kernel = np.exp(distances, out=distances)
+  f = kernel @ arrays["dual_coef"] + arrays["intercept"]
+  r = logistic(-(f*arrays["prob_a"] + arrays["prob_b"]))
+  # Compiled SVCs saved before calibrated ones could be compiled are all Platt scaled
+  if not arrays.get("coupled", True):
+    return r
+  np.clip(r, MIN_PROB, 1 - MIN_PROB, out=r)
+  return pairwise_coupling(r)
+
+def pairwise_coupling(r):
+  # libsvm's multiclass_probability() for two classes, with r the pairwise probability of the first class, on
+  # every row at once. Returns the probability of the second class
+  q = [[(1 - r)**2, -(1 - r)*r], [-(1 - r)*r, r**2]]
+  p = [np.full(len(r), 0.5), np.full(len(r), 0.5)]
+  for _ in range(COUPLING_MAX_ITER):
+    qp = [q[t][0]*p[0] + q[t][1]*p[1] for t in range(2)]
+    pqp = p[0]*qp[0] + p[1]*qp[1]
+    active = np.maximum(np.abs(qp[0] - pqp), np.abs(qp[1] - pqp)) >= COUPLING_EPS
+    if not active.any():
+      break
+    for t in range(2):
+      diff = np.where(active, (pqp - qp[t])/q[t][t], 0)
+      p[t] = p[t] + diff
+      pqp = (pqp + diff*(diff*q[t][t] + 2*qp[t]))/(1 + diff)**2
+      qp = [(qp[j] + diff*q[t][j])/(1 + diff) for j in range(2)]
+      p = [p[j]/(1 + diff) for j in range(2)]
+  return p[1]
+
+def mlp_prob(arrays, X):
+  activation = ACTIVATIONS[str(arrays["activation"])]
+  num_layers = int(arrays["num_layers"])
+  a = X
+  for i in range(num_layers):
+    a = a @ arrays["coef{}".format(i)]
+    a += arrays["intercept{}".format(i)]
+    if i < num_layers - 1:
+      a = activation(a)
+  return logistic(a[:, 0])
+
+def adaboost_prob(arrays, X):
+  rows = np.arange(len(X))[:, None]
+  nodes = np.broadcast_to(arrays["roots"], (len(X), len(arrays["roots"])))
+  for _ in range(int(arrays["max_depth"])):
+    go_left = X[rows, arrays["feature"][nodes]] <= arrays["threshold"][nodes]
+    nodes = np.where(go_left, arrays["left"][nodes], arrays["right"][nodes])
+  return logistic(arrays["value"][nodes].sum(axis=1))
+
+ENGINES = {"svc": svc_prob, "mlp": mlp_prob, "adaboost": adaboost_prob}
+
+class CompiledModel:
+  def __init__(self, kind, arrays):
+    self.kind = kind
+    self.arrays = arrays
+
+  def predict_proba(self, X):
+    # Same shape as sklearn's, [P(not All-Star), P(All-Star)] per row
+    prob = ENGINES[self.kind](self.arrays, np.asarray(X, dtype=np.float32)).astype(np.float64)
+    return np.column_stack([1 - prob, prob])
+
+def compile_model(model):
+  # Estimators are compiled, not searches, pass best_estimator_ for a GridSearchCV
+  from sklearn.svm import SVC
+  from sklearn.neural_network import MLPClassifier
+  from sklearn.ensemble import AdaBoostClassifier
+  from sklearn.calibration import CalibratedClassifierCV
+
+  model = getattr(model, "best_estimator_", model)
+  for cls, kind, compile_fn in [(SVC, "svc", compile_svc), (CalibratedClassifierCV, "svc", compile_calibrated), (MLPClassifier, "mlp", compile_mlp), (AdaBoostClassifier, "adaboost", compile_adaboost)]:
+    if isinstance(model, cls):
+      check_binary(model)
+      return CompiledModel(kind, compile_fn(model))
+  raise ValueError("{} cannot be compiled".format(type(model).__name__))
+
+def save(compiled, path):
+  with open(path, "wb") as f:
+    np.savez(f, kind=np.array(compiled.kind), version=np.array(VERSION), **compiled.arrays)
+
+def load(path):
+  # The CompiledModel saved in path, or None if it was written by another version of this file
+  with np.load(path) as data:
+    if "version" not in data.files or str(data["version"]) != VERSION:
+      return None
+    arrays = {key: data[key] for key in data.files if key not in ("kind", "version")}
+    return CompiledModel(str(data["kind"]), arrays)
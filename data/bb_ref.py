@@ -1,44 +1,351 @@
 """
 I wrote a quick API to interact with basketball-reference.com
 Not all are used for this project, I decided to toss some, but kept the methods here anyway.
+
+All requests go through one shared Fetcher: a pooled keep-alive session, a politeness rate limiter shared by
+every thread, and retries with exponential backoff. It is configured with environment variables:
+
+- BB_REF_BASE_URL   site to scrape, point it at a local server that serves saved pages to run offline
+- BB_REF_WORKERS    number of concurrent fetches (default 8)
+- BB_REF_RATE       max requests per second across all workers (default 5)
+- BB_REF_RETRIES    retries for connection errors, 429 and 5xx responses (default 4)
+
+Responses are kept in an on-disk cache shared by every function here, so a page that was already fetched (the
+season totals page, a player's page) is read from disk instead of downloaded again. Page bodies are stored by
+content hash, entries expire after a TTL, and the least recently used entries are evicted once the cache grows
+past its size limit. In offline mode nothing is downloaded and every page must come from the cache.
+
+Pages are large but each function only needs one table from them, so rather than building a tree of the whole
+page, the markup of the target table is sliced out of the page text and only that fragment is parsed with lxml.
+table_records() turns a table into compact row records (dicts of data-stat -> cell text) that the functions
+below read directly.
+
+- BB_REF_CACHE_DIR      cache location (default data/cache)
+- BB_REF_CACHE_TTL      seconds before a cached page is fetched again (default 43200, negative never expires)
+- BB_REF_CACHE_MAX_MB   size limit of the cache (default 1024)
+- BB_REF_OFFLINE        set to 1 to replay from the cache only
+
+With tracing on (see tracing.py), every page read is a "fetch" span, every request to the site a "download"
+span and every table parsed a "parse" span, with counters for cache hits and misses, retries and bytes downloaded.
 """
 
+import os
+import json
+import time
+import atexit
+import hashlib
+import threading
 import requests
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor
 from bs4 import BeautifulSoup
+from lxml import html as lxml_html
+
+try:
+  import tracing
+except ImportError:
+  from data import tracing
+
+BASE_URL = os.environ.get("BB_REF_BASE_URL", "https://www.basketball-reference.com").rstrip("/")
+MAX_WORKERS = int(os.environ.get("BB_REF_WORKERS", 8))
+REQUESTS_PER_SECOND = float(os.environ.get("BB_REF_RATE", 5))
+MAX_RETRIES = int(os.environ.get("BB_REF_RETRIES", 4))
+BACKOFF_SECONDS = 1.0
+TIMEOUT_SECONDS = 30
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+CACHE_DIR = os.environ.get("BB_REF_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache"))
+CACHE_TTL = float(os.environ.get("BB_REF_CACHE_TTL", 12*60*60))
+CACHE_MAX_BYTES = int(float(os.environ.get("BB_REF_CACHE_MAX_MB", 1024)) * 2**20)
+OFFLINE = os.environ.get("BB_REF_OFFLINE", "") == "1"
+
+class OfflineCacheMiss(Exception):
+  pass
+
+class ResponseCache:
+  # objects/<sha256 of body> holds the page bodies, index.json maps each URL to its body and timestamps.
+  # The index is flushed every FLUSH_EVERY writes and at exit rather than on every request.
+  FLUSH_EVERY = 50
+
+  def __init__(self, cache_dir=CACHE_DIR, max_bytes=CACHE_MAX_BYTES):
+    self.cache_dir = cache_dir
+    self.objects_dir = os.path.join(cache_dir, "objects")
+    self.index_path = os.path.join(cache_dir, "index.json")
+    self.max_bytes = max_bytes
+    self.lock = threading.Lock()
+    self.pending = 0
+    self.index = {}
+    if os.path.exists(self.index_path):
+      with tracing.span("json_load", path=self.index_path), open(self.index_path) as fp:
+        self.index = json.load(fp)
+    atexit.register(self.flush)
+
+  def object_path(self, digest):
+    return os.path.join(self.objects_dir, digest[:2], digest)
+
+  def get(self, url, ttl=CACHE_TTL):
+    with self.lock:
+      entry = self.index.get(url)
+      if entry is None:
+        return None
+      if ttl >= 0 and time.time() - entry["fetched"] > ttl:
+        return None
+      entry["used"] = time.time()
+      self.pending += 1
+    try:
+      with open(self.object_path(entry["sha256"]), encoding="utf-8") as f:
+        return f.read()
+    except FileNotFoundError:
+      return None
+
+  def put(self, url, text):
+    body = text.encode("utf-8")
+    digest = hashlib.sha256(body).hexdigest()
+    path = self.object_path(digest)
+    if not os.path.exists(path):
+      os.makedirs(os.path.dirname(path), exist_ok=True)
+      tmp_path = "{}.{}.tmp".format(path, threading.get_ident())
+      with open(tmp_path, "wb") as f:
+        f.write(body)
+      os.replace(tmp_path, path)
+
+    with self.lock:
+      now = time.time()
+      self.index[url] = {"sha256": digest, "size": len(body), "fetched": now, "used": now}
+      self.evict()
+      self.pending += 1
+      if self.pending >= self.FLUSH_EVERY:
+        self.flush_locked()
+
+  def evict(self):
+    # Bodies are shared between URLs with identical content, so count each one once
+    sizes = {e["sha256"]: e["size"] for e in self.index.values()}
+    total = sum(sizes.values())
+    if total <= self.max_bytes:
+      return
+    for url in sorted(self.index, key=lambda u: self.index[u]["used"]):
+      if total <= self.max_bytes:
+        break
+      digest = self.index.pop(url)["sha256"]
+      if not any(e["sha256"] == digest for e in self.index.values()):
+        total -= sizes[digest]
+        try:
+          os.remove(self.object_path(digest))
+        except FileNotFoundError:
+          pass
+
+  def flush_locked(self):
+    if not self.pending:
+      return
+    os.makedirs(self.cache_dir, exist_ok=True)
+    tmp_path = self.index_path + ".tmp"
+    with open(tmp_path, "w") as fp:
+      json.dump(self.index, fp)
+    os.replace(tmp_path, self.index_path)
+    self.pending = 0
+
+  def flush(self):
+    with self.lock:
+      self.flush_locked()
+
+class RateLimiter:
+  # Hands out evenly spaced request slots to all threads, so the overall rate never exceeds the limit
+  def __init__(self, rate):
+    self.interval = 1.0/rate if rate > 0 else 0
+    self.next_slot = time.monotonic()
+    self.lock = threading.Lock()
+
+  def wait(self):
+    if not self.interval:
+      return
+    with self.lock:
+      now = time.monotonic()
+      slot = max(self.next_slot, now)
+      self.next_slot = slot + self.interval
+    if slot > now:
+      time.sleep(slot - now)
+
+class Fetcher:
+  def __init__(self, base_url=BASE_URL, max_workers=MAX_WORKERS, rate=REQUESTS_PER_SECOND, max_retries=MAX_RETRIES, backoff=BACKOFF_SECONDS, cache=None, ttl=CACHE_TTL, offline=OFFLINE):
+    self.base_url = base_url
+    self.cache = cache if cache is not None else ResponseCache()
+    self.ttl = ttl
+    self.offline = offline
+    self.max_workers = max_workers
+    self.max_retries = max_retries
+    self.backoff = backoff
+    self.limiter = RateLimiter(rate)
+    self.session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers)
+    self.session.mount("http://", adapter)
+    self.session.mount("https://", adapter)
+
+  def url(self, path):
+    return self.base_url + path
+
+  def get(self, path):
+    url = self.url(path)
+    with tracing.span("fetch", path=path) as span:
+      text = self.cache.get(url, -1 if self.offline else self.ttl)
+      span.set(cached=text is not None)
+      if text is not None:
+        tracing.count("fetch.cache_hit")
+        return text
+      tracing.count("fetch.cache_miss")
+      if self.offline:
+        raise OfflineCacheMiss(url)
+      text = self.download(url)
+      self.cache.put(url, text)
+      return text
+
+  def download(self, url):
+    for attempt in range(self.max_retries + 1):
+      self.limiter.wait()
+      if attempt:
+        tracing.count("download.retry")
+      try:
+        with tracing.span("download", url=url, attempt=attempt) as span:
+          response = self.session.get(url, timeout=TIMEOUT_SECONDS)
+          span.set(status=response.status_code)
+      except (requests.ConnectionError, requests.Timeout):
+        if attempt == self.max_retries:
+          raise
+        time.sleep(self.backoff * 2**attempt)
+        continue
+      if response.status_code in RETRY_STATUSES and attempt < self.max_retries:
+        retry_after = response.headers.get("Retry-After", "")
+        time.sleep(float(retry_after) if retry_after.isdigit() else self.backoff * 2**attempt)
+        continue
+      response.raise_for_status()
+      if "charset" not in response.headers.get("Content-Type", ""):
+        response.encoding = "utf-8"
+      tracing.count("download.bytes", len(response.content))
+      return response.text
+
+  def map(self, fn, items):
+    # Runs fn over items on a bounded thread pool, results come back in the order of items
+    with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+      return list(pool.map(fn, items))
+
+_fetcher = None
+_fetcher_lock = threading.Lock()
+
+def get_fetcher():
+  global _fetcher
+  with _fetcher_lock:
+    if _fetcher is None:
+      _fetcher = Fetcher()
+  return _fetcher
+
+def configure(**kwargs):
+  # Replace the shared fetcher, e.g. configure(base_url="http://localhost:8000", rate=0)
+  global _fetcher
+  with _fetcher_lock:
+    _fetcher = Fetcher(**kwargs)
+  return _fetcher
+
+def fetch(path):
+  return get_fetcher().get(path)
+
+def fetch_concurrently(fn, items):
+  return get_fetcher().map(fn, items)
+
+def extract_element(page, marker, tag):
+  # Returns the markup of the first <tag ...> whose opening tag contains marker, without parsing the page.
+  # Tables that bb-ref hides inside HTML comments are found the same way.
+  open_tag = "<" + tag
+  pos = page.find(marker)
+  while pos >= 0:
+    start = page.rfind(open_tag, 0, pos)
+    if start >= 0 and page.find(">", start, pos) < 0:
+      end = page.find("</" + tag + ">", pos)
+      if end < 0:
+        return None
+      return page[start:end + len(tag) + 3]
+    pos = page.find(marker, pos + len(marker))
+  return None
+
+def find_element(page, marker, tag):
+  fragment = extract_element(page, marker, tag)
+  if fragment is None:
+    return None
+  return lxml_html.fragment_fromstring(fragment)
+
+def find_table(page, table_id):
+  return find_element(page, 'id="' + table_id + '"', "table")
+
+def table_records(page, table_id):
+  with tracing.span("parse", table=table_id):
+    return parse_table_records(page, table_id)
+
+def parse_table_records(page, table_id):
+  # One dict per body row: data-stat -> text for every td, plus the row's "_class", "_id",
+  # the text of its header cell under "_th" and the first data-append-csv (a player id) under "_csv"
+  table = find_table(page, table_id)
+  if table is None:
+    return None
+  records = []
+  for tr in table.iterfind("tbody/tr"):
+    record = {"_class": tr.get("class", ""), "_id": tr.get("id"), "_th": None, "_csv": None}
+    for cell in tr:
+      if cell.tag == "th":
+        if record["_th"] is None:
+          record["_th"] = cell.text_content()
+      elif cell.tag == "td":
+        record[cell.get("data-stat")] = cell.text_content()
+      if record["_csv"] is None:
+        record["_csv"] = cell.get("data-append-csv")
+    records.append(record)
+  return records
+
+def row_has_class(record, classes):
+  return any(c in classes for c in record["_class"].split())
 
 def get_player_ids_for_season(season):
-  page = requests.get('https://www.basketball-reference.com/leagues/NBA_' + str(season) + '_totals.html')
-  soup = BeautifulSoup(page.text, 'html.parser')
-  table = soup.find("table", { "id": "totals_stats" })
-  body = table.find("tbody")
-  rows = body.find_all("tr", class_=lambda x: x != 'thead')
+  page = fetch('/leagues/NBA_' + str(season) + '_totals.html')
+  rows = table_records(page, "totals_stats")
 
   player_id_set = set()
   for player in rows:
-    player_id = player.find("td", {"class":"left"})['data-append-csv']
-    player_id_set.add(player_id)
+    if row_has_class(player, ["thead"]):
+      continue
+    player_id_set.add(player["_csv"])
   
   return player_id_set
 
+def get_games_played_by_season(season):
+  # player_id -> games played so far in the season, over all of the player's teams
+  page = fetch('/leagues/NBA_' + str(season) + '_totals.html')
+  rows = table_records(page, "totals_stats")
+
+  games = {}
+  for player in rows:
+    if row_has_class(player, ["thead"]):
+      continue
+    # A player who changed teams has a TOT row with the games for all of them, and a row per team
+    if player["_csv"] not in games or player["team_id"] == "TOT":
+      games[player["_csv"]] = int(player["g"] or 0)
+
+  return games
+
 def get_stats_by_id_and_season(player_id, season):
-  url = 'https://www.basketball-reference.com/players/' + player_id[0] + '/' + player_id + '/splits/' + str(season)
-  print(url)
-  page = requests.get(url)
+  path = '/players/' + player_id[0] + '/' + player_id + '/splits/' + str(season)
+  print(path)
+  page = fetch(path)
   
-  soup = BeautifulSoup(page.text, 'html.parser')
-  table = soup.find("table", {"id": "splits"})
-  parent = table.find("th", text="All-Star").parent
+  rows = table_records(page, "splits")
+  parent = next(r for r in rows if r["_th"] == "All-Star")
   
   # Check if it's really pre all-star
-  stats = parent.find_all("td")
+  stats = [(k, v) for k, v in parent.items() if not k.startswith("_")]
   stats_dict = {}
-  for s in stats:
-    if s.get("data-stat") == "split_value" and s.text != "Pre":
+  for stat, text in stats:
+    if stat == "split_value" and text != "Pre":
       print("Yo this row is not pre:", stats)
       return -1
     else:
-      if s.text != "Pre":
-        stats_dict[s.get("data-stat")] = s.text
+      if text != "Pre":
+        stats_dict[stat] = text
   return stats_dict
 
 def get_list_of_all_stars(season):
@@ -46,14 +353,15 @@ def get_list_of_all_stars(season):
   if season == 2020:
     return []
 
-  url = "https://www.basketball-reference.com/allstar/NBA_" + str(season) + ".html"
-  print(url)
+  path = "/allstar/NBA_" + str(season) + ".html"
+  print(path)
   if season == 1999:
     print("There was no ASG in 1999")
     return None
 
-  page = requests.get(url)
-  soup = BeautifulSoup(page.text, 'html.parser')
+  page = fetch(path)
+  with tracing.span("parse", table="all_stars"):
+    soup = BeautifulSoup(page, 'html.parser')
   
   divs = soup.find_all("div", {"class": "overthrow table_container"})
   east = divs[1].find("tbody")
@@ -81,23 +389,21 @@ def get_standings_and_win_pct_by_date(season, date):
   standings = {}
 
   for conf in ["eastern", "western"]:
-    url = "https://www.basketball-reference.com/leagues/NBA_" + str(season) + "_standings_by_date_" + conf + "_conference.html"
-    print(url)
+    path = "/leagues/NBA_" + str(season) + "_standings_by_date_" + conf + "_conference.html"
+    print(path)
   
     if season == 1999:
       print("There was no ASG in 1999")
       return None
 
-    page = requests.get(url)
-    soup = BeautifulSoup(page.text, 'html.parser')
-
-    table = soup.find("table", {"id": "standings_by_date"})
-    row = table.find("a", text=date).parent.parent
-    teams = row.find_all("td")
+    page = fetch(path)
+    table = find_table(page, "standings_by_date")
+    row = next(a for a in table.iter("a") if a.text_content() == date).getparent().getparent()
+    teams = row.findall("td")
     for t in teams:
-      team_name = t.get("class")[1]
+      team_name = t.get("class").split()[1]
       position = int(t.get("data-stat")[:-2])
-      record = t.find("small").text[1:-1].split("-")
+      record = t.find(".//small").text_content()[1:-1].split("-")
       wins = int(record[0])
       losses = int(record[1])
       win_pct = float(wins)/float(wins + losses)
@@ -111,23 +417,20 @@ def get_standings_and_win_pct_by_date(season, date):
   return standings
 
 def get_player_team_by_season(season):
-  page = requests.get('https://www.basketball-reference.com/leagues/NBA_' + str(season) + '_totals.html')
-  soup = BeautifulSoup(page.text, 'html.parser')
-  table = soup.find("table", { "id": "totals_stats" })
-  body = table.find("tbody")
-  rows = body.find_all("tr", class_=lambda x: x != 'thead')
+  page = fetch('/leagues/NBA_' + str(season) + '_totals.html')
+  rows = table_records(page, "totals_stats")
 
   player_team_mapping = {}
   for player in rows:
-    player_id = player.find("td", {"class":"left"})['data-append-csv']
-    player_team = player.find("td", {"class":"left", "data-stat": "team_id"})
-    team_a = player_team.find("a")
-    if not team_a:
+    if row_has_class(player, ["thead"]):
+      continue
+    player_id = player["_csv"]
+    if player["team_id"] == "TOT":
       # This player changed teams halfway during the season
       continue
 
-    team_name = team_a.text
-    gp_for_team = player.find("td", {"data-stat": "g"}).text
+    team_name = player["team_id"]
+    gp_for_team = player["g"]
 
     if not player_id in player_team_mapping:
       player_team_mapping[player_id] = (team_name, gp_for_team)
@@ -158,52 +461,44 @@ def get_player_team_by_season(season):
   return player_team_mapping
 
 def get_player_info_by_id(player_id, season):
-  url = 'https://www.basketball-reference.com/players/' + player_id[0] + '/' + player_id + '.html'
-  print(url)
-  page = requests.get(url)
+  path = '/players/' + player_id[0] + '/' + player_id + '.html'
+  print(path)
+  page = fetch(path)
   
-  soup = BeautifulSoup(page.text, 'html.parser')
-  name = soup.find("h1", {"itemprop": "name"}).text
+  name = find_element(page, 'itemprop="name"', "h1").text_content()
 
-  table = soup.find("table", {"id": "per_game"})
-  tbody = table.find("tbody")
-  trs = tbody.find_all("tr", {"class": ["full_table", "partial_table"]})
+  trs = [r for r in table_records(page, "per_game") if row_has_class(r, ["full_table", "partial_table"])]
 
   for tr in trs:
-    year = tr.get("id").split(".")[1]
+    year = tr["_id"].split(".")[1]
 
     if year == str(season):
-      position = tr.find("td", {"data-stat": "pos"}).text
-      td = tr.find("td", {"data-stat": "team_id"})
-      if td.find("a"):
-        team = td.find("a").text
+      position = tr["pos"]
+      if tr["team_id"] != "TOT":
+        team = tr["team_id"]
 
   return name, position, team
 
 def get_player_name_by_id(player_id):
-  url = 'https://www.basketball-reference.com/players/' + player_id[0] + '/' + player_id + '.html'
-  print(url)
-  page = requests.get(url)
+  path = '/players/' + player_id[0] + '/' + player_id + '.html'
+  print(path)
+  page = fetch(path)
   
-  soup = BeautifulSoup(page.text, 'html.parser')
-  name = soup.find("h1", {"itemprop": "name"}).text
+  name = find_element(page, 'itemprop="name"', "h1").text_content()
   return name
 
 def get_player_position_by_id(player_id):
-  url = 'https://www.basketball-reference.com/players/' + player_id[0] + '/' + player_id + '.html'
-  print(url)
-  page = requests.get(url)
+  path = '/players/' + player_id[0] + '/' + player_id + '.html'
+  print(path)
+  page = fetch(path)
   
-  soup = BeautifulSoup(page.text, 'html.parser')
-  table = soup.find("table", {"id": "per_game"})
-  tbody = table.find("tbody")
-  trs = tbody.find_all("tr", {"class": "full_table"})
+  trs = [r for r in table_records(page, "per_game") if row_has_class(r, ["full_table"])]
 
   positions_by_year = {}
 
   for tr in trs:
-    year = tr.get("id").split(".")[1]
-    position = tr.find("td", {"data-stat": "pos"}).text
+    year = tr["_id"].split(".")[1]
+    position = tr["pos"]
     positions_by_year[year] = position
 
   return positions_by_year
@@ -0,0 +1,97 @@
+"""
+The features of a player, as a schema, and the extractor that turns the raw JSON of a season into them.
+
+SCHEMA maps every feature that can be built from data/raw/<season>.json to where it comes from: the section of
+the player's JSON ("stats" or "team"), the key in it, and whether it is divided by games played. FEATURES are
+the ones the models are trained on, in column order. The ones in SCHEMA but not in FEATURES (fga_per_g,
+fg3a_per_g, fta_per_g) are declared so they can be tried out by adding them to FEATURES, the feature store is
+rebuilt when FEATURES changes.
+
+season_matrix() converts a whole season at once, column by column, into a float32 matrix. Missing values are
+handled explicitly: bb-ref leaves a stat blank ("") when there is nothing to compute it from, e.g. fg3_pct of a
+player who never took a three, and a blank or absent stat counts as MISSING_VALUE. Per game stats of a player
+without games are MISSING_VALUE as well.
+
+process_data.py, the feature store and util.py (so training, the service and predict.py) all build their
+features here, so they cannot drift apart.
+"""
+
+import numpy as np
+
+try:
+  import tracing
+except ImportError:
+  from data import tracing
+
+SCHEMA = {
+  # Individual stats
+  "g": ("stats", "g", False),
+  "gs": ("stats", "gs", False),
+  "mp_per_g": ("stats", "mp_per_g", False),
+  "pts_per_g": ("stats", "pts_per_g", False),
+  "trb_per_g": ("stats", "trb_per_g", False),
+  "ast_per_g": ("stats", "ast_per_g", False),
+  "stl_per_g": ("stats", "stl", True),
+  "blk_per_g": ("stats", "blk", True),
+  "fg_pct": ("stats", "fg_pct", False),
+  "fg3_pct": ("stats", "fg3_pct", False),
+  "ft_pct": ("stats", "ft_pct", False),
+  "fga_per_g": ("stats", "fga", True),
+  "fg3a_per_g": ("stats", "fg3a", True),
+  "fta_per_g": ("stats", "fta", True),
+  "usg_pct": ("stats", "usg_pct", False),
+
+  # Team stats
+  "win_pct": ("team", "record", False),
+  "seed": ("team", "rank", False)
+}
+
+FEATURES = ["g", "gs", "mp_per_g", "pts_per_g", "trb_per_g", "ast_per_g", "stl_per_g", "blk_per_g", "fg_pct", "fg3_pct", "ft_pct", "usg_pct", "win_pct", "seed"]
+
+MISSING_VALUE = 0.0
+
+def raw_column(players, section, key):
+  values = np.array([data[section].get(key, "") for data in players], dtype=object)
+  values[values == ""] = MISSING_VALUE
+  return values.astype(np.float64)
+
+def season_matrix(players_data, features=FEATURES):
+  # (player_ids, float32 matrix of len(player_ids) x len(features)), rows follow the order of players_data
+  with tracing.span("extract", rows=len(players_data), features=len(features)):
+    return extract(players_data, features)
+
+def extract(players_data, features):
+  player_ids = list(players_data.keys())
+  players = list(players_data.values())
+  x = np.empty((len(players), len(features)), dtype=np.float32)
+  if not players:
+    return player_ids, x
+
+  g = raw_column(players, "stats", "g")
+  played = g > 0
+  for j, name in enumerate(features):
+    section, key, per_game = SCHEMA[name]
+    values = raw_column(players, section, key)
+    if per_game:
+      values = np.divide(values, g, out=np.full(len(values), MISSING_VALUE), where=played)
+    x[:, j] = values
+  return player_ids, x
+
+def season_csv_rows(players_data, features=FEATURES):
+  # The rows of processed/<season>.csv, features then the label. Stats are written as they are in the raw JSON,
+  # blanks stay blank, and per game stats are divided in float64, so the csv keeps what the float32 matrix rounds
+  rows = []
+  for data in players_data.values():
+    g = data["stats"].get("g", "")
+    row = []
+    for name in features:
+      section, key, per_game = SCHEMA[name]
+      value = data[section].get(key, "")
+      if per_game and value != "":
+        value = str(float(value)/float(g)) if g != "" and float(g) > 0 else ""
+      row.append(value)
+    rows.append(row + [data["stats"]["all_star"]])
+  return rows
+
+def season_labels(players_data):
+  return np.array([data["stats"]["all_star"] for data in players_data.values()], dtype=np.float32)
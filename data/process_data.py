@@ -28,54 +28,113 @@ Our csv will be as follows:
 
 g, gs, mp_per_g, pts_per_g, trb_per_g, ast_per_g, stl_per_g, blk_per_g, fg_pct, fg3_pct, ft_pct, usg_pct, win_pct, seed, all-star
 
+These columns are the FEATURES of features.py, which also declares fga_per_g, fg3a_per_g and fta_per_g for
+trying them out. Stats are written as they are in the raw JSON, blank ones left blank, and per game stats in
+full precision.
+
 Also, to keep our dataset more balanced, we will be filtering out for only the the players that have Usage Rate >= 8 and Minutes Per Game >= 18. Using this filter restricts our dataset to include only players that perform better for their team.
+
+Rebuilds are incremental. processed/manifest.json records the content hash of each raw/<season>.json and of the
+processed/<season>.csv made from it, and only seasons whose raw file changed (or whose csv is missing or was
+edited) are processed again. Stale seasons are spread across a process pool.
+
+Usage (from the data folder):
+
+python process_data.py              # every season from 1985 to 2019 that is out of date
+python process_data.py 2019 2020    # only these seasons, if they are out of date
+python process_data.py --force      # ignore the manifest and rebuild every season (or only the ones given)
+
+Set NBA_TRACE to trace a run, see tracing.py.
 """
 
-import json
+import os
 import csv
+import sys
+import json
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+  import tracing
+  from features import season_csv_rows
+except ImportError:
+  from data import tracing
+  from data.features import season_csv_rows
+
+SEASONS = [year for year in range(1985, 2020) if year != 1999]
+MANIFEST = "./processed/manifest.json"
+
+def file_hash(path):
+  if not os.path.exists(path):
+    return None
+  h = hashlib.sha256()
+  with open(path, "rb") as f:
+    for chunk in iter(lambda: f.read(1 << 20), b""):
+      h.update(chunk)
+  return h.hexdigest()
+
+def raw_path(year):
+  return "./raw/" + str(year) + ".json"
 
-for year in range(1985, 2020):
-  
-  if year == 1999:
-    continue
+def processed_path(year):
+  return "./processed/" + str(year) + ".csv"
 
-  players = []
-  year_str = str(year)
-  with open("./raw/" + year_str + ".json") as players_data_file:
+@tracing.traced("process.season")
+def process_season(year):
+  with tracing.span("json_load", path=raw_path(year)), open(raw_path(year)) as players_data_file:
     players_data = json.load(players_data_file)
 
-    for p, data in players_data.items():
-
-      # Individual stats
-      g = data["stats"]["g"]
-      gs = data["stats"]["gs"]
-      mp_per_g = data["stats"]["mp_per_g"]
-      pts_per_g = data["stats"]["pts_per_g"]
-      trb_per_g = data["stats"]["trb_per_g"]
-      ast_per_g = data["stats"]["ast_per_g"]
-      stl_per_g = str(float(data["stats"]["stl"])/float(g))
-      blk_per_g = str(float(data["stats"]["blk"])/float(g))
-      fg_pct = data["stats"]["fg_pct"]
-      fg3_pct = data["stats"]["fg3_pct"]
-      ft_pct = data["stats"]["ft_pct"]
-      # fga_per_g = str(float(data["stats"]["fga"])/float(g))
-      # fg3a_per_g = str(float(data["stats"]["fg3a"])/float(g))
-      # fta_per_g = str(float(data["stats"]["fta"])/float(g))
-      usg_pct = data["stats"]["usg_pct"]
-      
-      # Team stats
-      win_pct = data["team"]["record"]
-      seed = data["team"]["rank"]
-
-      # Output
-      all_star = data["stats"]["all_star"]
-
-      final_stats = [g, gs, mp_per_g, pts_per_g, trb_per_g, ast_per_g, stl_per_g, blk_per_g, fg_pct, fg3_pct, ft_pct, usg_pct, win_pct, seed, all_star]
-      # final_stats = [g, gs, mp_per_g, pts_per_g, trb_per_g, ast_per_g, stl_per_g, blk_per_g, fg_pct, fg3_pct, ft_pct, fga_per_g, fg3a_per_g, fta_per_g, usg_pct, win_pct, seed, all_star]
-
-      # if float(mp_per_g) >= 18 and float(usg_pct) >= 8:
-      players.append(final_stats)
-  
-  with open("./processed/" + year_str + ".csv", "w", newline="") as output_file:
-    wr = csv.writer(output_file)
+  # The features come from features.py, like the ones the models are trained and served on
+  players = season_csv_rows(players_data)
+
+  with tracing.span("process.write_csv", path=processed_path(year)), open(processed_path(year), "w", newline="") as output_file:
+    wr = csv.writer(output_file, lineterminator="\n")
     wr.writerows(players)
+
+  return year, file_hash(raw_path(year)), file_hash(processed_path(year))
+
+def load_manifest():
+  if not os.path.exists(MANIFEST):
+    return {}
+  with open(MANIFEST) as fp:
+    return json.load(fp)
+
+def save_manifest(manifest):
+  # Write to a temp file first so an interrupted run never leaves a half-written manifest
+  tmp_path = MANIFEST + ".tmp"
+  with open(tmp_path, "w") as fp:
+    json.dump(manifest, fp, sort_keys=True, indent=2, separators=(',', ': '))
+  os.replace(tmp_path, MANIFEST)
+
+def is_stale(year, manifest):
+  entry = manifest.get(str(year))
+  if entry is None:
+    return True
+  return entry["raw"] != file_hash(raw_path(year)) or entry["processed"] != file_hash(processed_path(year))
+
+if __name__ == "__main__":
+  args = sys.argv[1:]
+  force = "--force" in args
+  seasons = [int(a) for a in args if a != "--force"] or SEASONS
+
+  # --force only decides which seasons are rebuilt, the others keep their manifest entries
+  manifest = load_manifest()
+  stale = seasons if force else [year for year in seasons if is_stale(year, manifest)]
+
+  if not stale:
+    print("All {} seasons are up to date.".format(len(seasons)))
+    exit(0)
+
+  print("Processing {} of {} seasons: {}".format(len(stale), len(seasons), ", ".join(str(y) for y in stale)))
+  if len(stale) == 1:
+    results = [process_season(stale[0])]
+  else:
+    with ProcessPoolExecutor() as pool:
+      results = list(pool.map(process_season, stale))
+
+  for year, raw_hash, processed_hash in results:
+    manifest[str(year)] = {
+      "raw": raw_hash,
+      "processed": processed_hash
+    }
+  save_manifest(manifest)
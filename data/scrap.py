@@ -1,10 +1,31 @@
 """
 This script will scrap all pre-ASG stats for all players for a particular season, and write them to a JSON file.
 This script takes in the target season as the only argument.
+
+Player pages are fetched concurrently, see bb_ref.py for the environment variables that control the number of
+workers, the request rate and the site to scrape. Set NBA_TRACE to trace a run, see tracing.py.
+
+With --delta, for refreshing the current season before the All-Star game, the players already in
+raw/<season>.json are only fetched again if their games played on the season totals page changed since, so a
+daily refresh fetches the players who played that day rather than all of them. New players are fetched too.
+Every scrape keeps the games played of the totals page it compared against as "scraped_g" next to each player,
+since the "g" of the stats only counts the games before the All-Star game. The players whose splits have no
+pre-ASG row are kept with theirs in skipped/<season>.json, so they are not fetched again either until they play.
+It is kept out of raw/, which only holds seasons.
+The standings and All-Star lists are read again and applied to every player. The season file is replaced in
+one step, never left half written. Pages come from the bb_ref.py cache while they are younger than
+BB_REF_CACHE_TTL, set it to 0 to refresh more often than that.
+
+Usage (from the data folder):
+
+python scrap.py 2020
+python scrap.py 2020 --delta
 """
 
+import os
 import sys
 import json
+import tracing
 from bb_ref import *
 
 ASG_DATES = {
@@ -47,11 +68,16 @@ ASG_DATES = {
 
 # Checking argument
 
-if len(sys.argv) > 2:
-  print("Detected more than 1 argument. Exiting.")
+args = sys.argv[1:]
+DELTA = "--delta" in args
+if DELTA:
+  args.remove("--delta")
+
+if len(args) != 1:
+  print("Expected the season as the only argument, and optionally --delta. Exiting.")
   exit(1)
 
-SEASON = sys.argv[1]
+SEASON = args[0]
 
 if not SEASON.isnumeric():
   print("Provided year is not a number. Exiting.")
@@ -79,25 +105,61 @@ if season == 2020:
     asg_date = today.strftime("%b %d, %Y")
 
 # Get the standings for all teams just before ASG
-standings = get_standings_and_win_pct_by_date(SEASON, asg_date)
+with tracing.span("scrap.standings", season=season):
+  standings = get_standings_and_win_pct_by_date(SEASON, asg_date)
+
+raw_path = "./raw/" + SEASON + ".json"
+skipped_path = "./skipped/" + SEASON + ".json"
+existing = None
+skipped = {}
+if DELTA:
+  if os.path.exists(raw_path):
+    with tracing.span("json_load", path=raw_path), open(raw_path) as fp:
+      existing = json.load(fp)
+    if os.path.exists(skipped_path):
+      with open(skipped_path) as fp:
+        skipped = json.load(fp)
+  else:
+    print("There is no {} yet, scraping every player.".format(raw_path))
 
 # Get all player_ids that were active during this season
-player_ids = get_player_ids_for_season(season)
+with tracing.span("scrap.player_ids", season=season):
+  # The games played of every player, on the totals page, kept to compare against in the next --delta
+  games = get_games_played_by_season(season)
+  if existing is None:
+    player_ids = get_player_ids_for_season(season)
+  else:
+    # Only the players whose games played changed, and new players. A player scraped before scraped_g was kept
+    # is fetched once more
+    last_games = {**skipped, **{p: data.get("scraped_g") for p, data in existing.items()}}
+    player_ids = {p for p, g in games.items() if last_games.get(p) != g}
+    print("{} of {} players played since the last scrape".format(len(player_ids), len(games)))
 
-# Initialise dictionary for all players this season
-all_players = {}
+# Initialise dictionary for all players this season, from the last scrape with --delta
+all_players = {} if existing is None else existing
 
 # We first obtain the list of all stars for this season
-all_stars = get_list_of_all_stars(season)
+with tracing.span("scrap.all_stars", season=season):
+  all_stars = get_list_of_all_stars(season)
 
-# For each player
-for p in player_ids:
+# Players that are not fetched again keep their stats, with today's standings and All-Stars
+for p, data in all_players.items():
+  data["team"] = standings[data["team"]["name"]]
+  data["stats"]["all_star"] = 1 if p in all_stars else 0
 
-  # Get the player info
-  name, position, team = get_player_info_by_id(p, season)
+# Fetch the info and splits pages of every player concurrently
+def scrap_player(p):
+  with tracing.span("scrap.player", player_id=p):
+    name, position, team = get_player_info_by_id(p, season)
+    stats = get_stats_by_id_and_season(p, season)
+  return name, position, team, stats
 
-  # Get the player individual stats
-  stats = get_stats_by_id_and_season(p, season)
+player_ids = sorted(player_ids)
+with tracing.span("scrap.players", season=season, players=len(player_ids)):
+  scraped = fetch_concurrently(scrap_player, player_ids)
+
+# For each player
+for p, (name, position, team, stats) in zip(player_ids, scraped):
 
   # Get the player team stats
   team_stats = standings[team]
@@ -106,8 +168,11 @@ for p in player_ids:
   if stats == -1:
     # This row is not pre for some reason. 
     # Could be injury, hence the player has no pre-ASG stats
-    pass
+    all_players.pop(p, None)
+    skipped[p] = games.get(p)
   else:
+    skipped.pop(p, None)
+
     # Indicate whether player was an all-star this season
     stats["all_star"] = 1 if p in all_stars else 0
 
@@ -118,9 +183,15 @@ for p in player_ids:
         "position": position
       },
       "stats": stats,
-      "team": team_stats
+      "team": team_stats,
+      "scraped_g": games.get(p)
     }
 
-# Write to file
-with open("./raw/" + SEASON + '.json', 'w') as fp:
+# Write to file, through a temp file so the season file is never half written
+with tracing.span("json_dump", path=raw_path), open(raw_path + ".tmp", 'w') as fp:
     json.dump(all_players, fp, sort_keys=True, indent=2, separators=(',', ': '))
+os.replace(raw_path + ".tmp", raw_path)
+os.makedirs(os.path.dirname(skipped_path), exist_ok=True)
+with open(skipped_path + ".tmp", 'w') as fp:
+    json.dump(skipped, fp, sort_keys=True, indent=2, separators=(',', ': '))
+os.replace(skipped_path + ".tmp", skipped_path)
@@ -0,0 +1,217 @@
+"""
+Stage-level tracing for scraping, processing, training and prediction.
+
+Tracing is off unless NBA_TRACE is set to the path of a JSON lines file (or enable() is called), and then
+every process of the run appends its events to that file, worker processes included since they inherit the
+environment. Off, span() hands back one shared do-nothing object and count() returns straight away, so the
+hooks can stay in the code. On, a span costs a few microseconds, well below anything it wraps.
+
+- span(name, **attrs)   context manager timing a block, with attributes. span.set(...) adds attributes known
+                        only at the end, e.g. whether a page came from the cache
+- traced(name)          the same as a decorator
+- count(name, value=1)  counters, e.g. cache hits, retries, rows. Their totals are written when they changed
+- NBA_TRACE_MEMORY=1    also starts tracemalloc, and every span records the traced memory (current and peak so
+                        far) when it ends. tracemalloc slows allocations down a lot, so only for memory work
+
+Events are buffered and appended to the file every FLUSH_EVERY events and when the process exits. One line per
+event:
+
+{"type": "span", "name": "fetch", "ts": <start, us since epoch>, "dur": <us>, "pid": ..., "tid": ..., "attrs": {...}}
+{"type": "counter", "name": "fetch.cache_hit", "ts": ..., "pid": ..., "value": <total so far>}
+
+To read a trace, from anywhere:
+
+python tracing.py summary trace.jsonl            # count, total, mean and max time per span name, and counters
+python tracing.py chrome trace.jsonl trace.json  # for chrome://tracing or https://ui.perfetto.dev
+"""
+
+import os
+import sys
+import json
+import time
+import atexit
+import functools
+import threading
+
+FLUSH_EVERY = 1000
+
+_path = None
+_memory = False
+_events = []
+_counters = {}
+_flushed_counters = {}
+_lock = threading.Lock()
+
+class NoSpan:
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc, tb):
+    return False
+
+  def set(self, **attrs):
+    pass
+
+NO_SPAN = NoSpan()
+
+class Span:
+  __slots__ = ("name", "attrs", "ts", "start")
+
+  def __init__(self, name, attrs):
+    self.name = name
+    self.attrs = attrs
+
+  def set(self, **attrs):
+    self.attrs.update(attrs)
+
+  def __enter__(self):
+    self.ts = time.time_ns()//1000
+    self.start = time.perf_counter_ns()
+    return self
+
+  def __exit__(self, exc_type, exc, tb):
+    event = {"type": "span", "name": self.name, "ts": self.ts, "dur": (time.perf_counter_ns() - self.start)/1000, "tid": threading.get_ident()}
+    if self.attrs:
+      event["attrs"] = self.attrs
+    if exc_type is not None:
+      event["error"] = exc_type.__name__
+    if _memory:
+      import tracemalloc
+      event["mem"], event["mem_peak"] = tracemalloc.get_traced_memory()
+    record(event)
+    return False
+
+def is_enabled():
+  return _path is not None
+
+def span(name, **attrs):
+  if _path is None:
+    return NO_SPAN
+  return Span(name, attrs)
+
+def traced(name):
+  def decorator(fn):
+    # functools.wraps keeps the name pickle looks the function up by, for process pools
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+      if _path is None:
+        return fn(*args, **kwargs)
+      with Span(name, {}):
+        return fn(*args, **kwargs)
+    return wrapper
+  return decorator
+
+def count(name, value=1):
+  if _path is None:
+    return
+  with _lock:
+    _counters[name] = _counters.get(name, 0) + value
+
+def record(event):
+  with _lock:
+    _events.append(event)
+    full = len(_events) >= FLUSH_EVERY
+  if full:
+    flush()
+
+def flush():
+  global _events, _flushed_counters
+  if _path is None:
+    return
+  with _lock:
+    events, _events = _events, []
+    counters = {name: value for name, value in _counters.items() if _flushed_counters.get(name) != value}
+    _flushed_counters = dict(_counters)
+  pid = os.getpid()
+  ts = time.time_ns()//1000
+  lines = [json.dumps(dict(event, pid=pid), default=str) for event in events]
+  lines += [json.dumps({"type": "counter", "name": name, "ts": ts, "pid": pid, "value": value}) for name, value in counters.items()]
+  if lines:
+    # One write per flush, so the lines of processes flushing at the same time do not interleave
+    with open(_path, "a") as fp:
+      fp.write("\n".join(lines) + "\n")
+
+def reset_after_fork():
+  # A forked worker starts with the parent's buffer, which the parent writes itself
+  global _events, _flushed_counters
+  _events = []
+  _counters.clear()
+  _flushed_counters = {}
+
+def flush_at_exit(_=None):
+  # Pool workers exit without running atexit, but multiprocessing runs its finalizers. It drops the ones a
+  # forked worker inherits, so this is registered again in every worker it starts
+  from multiprocessing.util import Finalize
+  Finalize(None, flush, exitpriority=100)
+
+def enable(path, memory=False):
+  global _path, _memory
+  first = _path is None
+  _path = os.path.abspath(path)
+  _memory = memory
+  # Worker processes pick tracing up from the environment
+  os.environ["NBA_TRACE"] = _path
+  if memory:
+    import tracemalloc
+    os.environ["NBA_TRACE_MEMORY"] = "1"
+    if not tracemalloc.is_tracing():
+      tracemalloc.start()
+  if first:
+    from multiprocessing.util import register_after_fork
+    atexit.register(flush)
+    flush_at_exit()
+    os.register_at_fork(after_in_child=reset_after_fork)
+    register_after_fork(NO_SPAN, flush_at_exit)
+
+def load(path):
+  with open(path) as fp:
+    return [json.loads(line) for line in fp if line.strip()]
+
+def chrome_trace(events):
+  trace = []
+  for e in events:
+    if e["type"] == "span":
+      args = dict(e.get("attrs", {}))
+      for key in ["error", "mem", "mem_peak"]:
+        if key in e:
+          args[key] = e[key]
+      trace.append({"name": e["name"], "cat": e["name"].split(".")[0], "ph": "X", "ts": e["ts"], "dur": e["dur"], "pid": e["pid"], "tid": e["tid"], "args": args})
+    else:
+      trace.append({"name": e["name"], "ph": "C", "ts": e["ts"], "pid": e["pid"], "args": {"value": e["value"]}})
+  return {"traceEvents": trace, "displayTimeUnit": "ms"}
+
+def summary(events):
+  # (span rows of name, count, total ms, mean ms, max ms, by total), {counter: total over every process}
+  spans = {}
+  counters = {}
+  for e in events:
+    if e["type"] == "span":
+      spans.setdefault(e["name"], []).append(e["dur"]/1000)
+    else:
+      # Each flush writes the running total, the last one of a process is its total
+      counters[(e["pid"], e["name"])] = e["value"]
+  rows = sorted(((name, len(d), sum(d), sum(d)/len(d), max(d)) for name, d in spans.items()), key=lambda r: -r[2])
+  totals = {}
+  for (_, name), value in counters.items():
+    totals[name] = totals.get(name, 0) + value
+  return rows, totals
+
+if os.environ.get("NBA_TRACE"):
+  enable(os.environ["NBA_TRACE"], memory=os.environ.get("NBA_TRACE_MEMORY", "") == "1")
+
+if __name__ == "__main__":
+  if len(sys.argv) < 3 or sys.argv[1] not in ["summary", "chrome"]:
+    print("Usage: python tracing.py summary <trace.jsonl> | chrome <trace.jsonl> <trace.json>")
+    exit(1)
+  events = load(sys.argv[2])
+  if sys.argv[1] == "chrome":
+    with open(sys.argv[3], "w") as fp:
+      json.dump(chrome_trace(events), fp)
+    print("Wrote {} events to {}".format(len(events), sys.argv[3]))
+  else:
+    rows, totals = summary(events)
+    print("{:<28} {:>8} {:>12} {:>10} {:>10}".format("span", "count", "total ms", "mean ms", "max ms"))
+    for name, n, total, mean, longest in rows:
+      print("{:<28} {:>8} {:>12.1f} {:>10.3f} {:>10.1f}".format(name, n, total, mean, longest))
+    for name, value in sorted(totals.items()):
+      print("{:<28} {:>8}".format(name, value))
@@ -0,0 +1,149 @@
+"""
+Columnar feature store built from the raw JSON in data/raw.
+
+Every season is stacked into one set of .npy files under data/store, which are opened with
+memory-mapping so training and prediction can slice them without parsing any text:
+
+- features.npy    (n_rows, len(FEATURES)) float32, the FEATURES of data/features.py, same columns as data/processed/*.csv
+- all_star.npy    (n_rows,) float64, the label column
+- season.npy      (n_rows,) int16
+- player_id.npy, name.npy, position.npy, team.npy, conference.npy    (n_rows,) unicode
+
+Rows are grouped by season and keep the player order of each raw JSON. meta.json holds the
+row range of every season, so slicing one season never touches the others, along with the size
+and mtime of the raw files the store was built from and the signature of its features: FEATURES, their dtype
+and where SCHEMA builds them from. open_store() rebuilds the store whenever a raw file is added or changed, or
+that signature changed, so it never serves stale data.
+
+To build the store by hand, from the repo root:
+
+python feature_store.py
+"""
+
+import os
+import glob
+import json
+import numpy as np
+from data.features import SCHEMA, FEATURES, MISSING_VALUE, season_matrix
+from data import tracing
+
+RAW_DIR = "./data/raw"
+STORE_DIR = "./data/store"
+
+COLUMNS = ["features", "all_star", "season", "player_id", "name", "position", "team", "conference"]
+
+def features_signature():
+  # Everything the feature matrix depends on besides the raw files, as kept in meta.json
+  return {
+    "features": FEATURES,
+    "dtype": "float32",
+    "schema": {feature: list(SCHEMA[feature]) for feature in FEATURES},
+    "missing_value": MISSING_VALUE
+  }
+
+def raw_files_signature(raw_dir=RAW_DIR):
+  # Only the season files, <season>.json, anything else in raw_dir is not a season
+  signature = {}
+  for path in sorted(glob.glob(os.path.join(raw_dir, "*.json"))):
+    if not os.path.basename(path)[:-len(".json")].isdigit():
+      continue
+    st = os.stat(path)
+    signature[os.path.basename(path)] = [st.st_size, st.st_mtime_ns]
+  return signature
+
+@tracing.traced("store.build")
+def build_store(raw_dir=RAW_DIR, store_dir=STORE_DIR):
+  os.makedirs(store_dir, exist_ok=True)
+  signature = raw_files_signature(raw_dir)
+  meta_path = os.path.join(store_dir, "meta.json")
+  if os.path.exists(meta_path):
+    os.remove(meta_path)
+
+  columns = {c: [] for c in COLUMNS}
+  seasons = {}
+  num_rows = 0
+  for filename in signature:
+    season = int(filename[:-len(".json")])
+    with tracing.span("json_load", path=os.path.join(raw_dir, filename)), open(os.path.join(raw_dir, filename)) as players_data_file:
+      players_data = json.load(players_data_file)
+
+    player_ids, x = season_matrix(players_data)
+    columns["features"].append(x)
+    columns["season"].append(np.full(len(player_ids), season, dtype=np.int16))
+    columns["player_id"].extend(player_ids)
+    for p in player_ids:
+      data = players_data[p]
+      columns["all_star"].append(float(data["stats"]["all_star"]))
+      columns["name"].append(data["details"]["name"])
+      columns["position"].append(data["details"]["position"])
+      columns["team"].append(data["team"]["name"])
+      columns["conference"].append(data["team"]["conference"])
+
+    seasons[str(season)] = [num_rows, num_rows + len(player_ids)]
+    num_rows += len(player_ids)
+
+  arrays = {
+    "features": np.vstack(columns["features"]) if columns["features"] else np.empty((0, len(FEATURES)), dtype=np.float32),
+    "all_star": np.array(columns["all_star"], dtype=float),
+    "season": np.concatenate(columns["season"]) if columns["season"] else np.empty(0, dtype=np.int16),
+  }
+  for c in ["player_id", "name", "position", "team", "conference"]:
+    arrays[c] = np.array(columns[c], dtype=str)
+
+  # Replace the files rather than overwrite them, so stores that are already open keep their old mmaps
+  for c, a in arrays.items():
+    path = os.path.join(store_dir, c + ".npy")
+    with open(path + ".tmp", "wb") as f:
+      np.save(f, a)
+    os.replace(path + ".tmp", path)
+
+  # meta.json is written last, a store without it is treated as missing
+  meta = dict(features_signature(), **{
+    "dtype": str(arrays["features"].dtype),
+    "num_rows": num_rows,
+    "seasons": seasons,
+    "raw_files": signature
+  })
+  with open(meta_path, "w") as fp:
+    json.dump(meta, fp, sort_keys=True, indent=2, separators=(',', ': '))
+
+  return meta
+
+def open_store(raw_dir=RAW_DIR, store_dir=STORE_DIR):
+  meta_path = os.path.join(store_dir, "meta.json")
+  meta = None
+  if os.path.exists(meta_path):
+    with open(meta_path) as fp:
+      meta = json.load(fp)
+  if meta is None or meta["raw_files"] != raw_files_signature(raw_dir) or any(meta.get(k) != v for k, v in features_signature().items()):
+    meta = build_store(raw_dir, store_dir)
+
+  store = {"meta": meta}
+  for c in COLUMNS:
+    store[c] = np.load(os.path.join(store_dir, c + ".npy"), mmap_mode="r")
+  return store
+
+def refresh_store(store, raw_dir=RAW_DIR, store_dir=STORE_DIR):
+  # Same store if the raw files are unchanged, otherwise a rebuilt one
+  if store["meta"]["raw_files"] == raw_files_signature(raw_dir):
+    return store
+  return open_store(raw_dir, store_dir)
+
+def season_rows(store, season):
+  start, stop = store["meta"]["seasons"][str(season)]
+  return slice(start, stop)
+
+def has_season(store, season):
+  return str(season) in store["meta"]["seasons"]
+
+def season_index(store, season):
+  # player_id -> row in the store for one season, built on first use and kept with the store
+  indexes = store.setdefault("index", {})
+  if season not in indexes:
+    rows = season_rows(store, season)
+    indexes[season] = {str(p): rows.start + i for i, p in enumerate(store["player_id"][rows])}
+  return indexes[season]
+
+if __name__ == "__main__":
+  meta = build_store()
+  print("Built feature store with {} rows over {} seasons in {}".format(meta["num_rows"], len(meta["seasons"]), STORE_DIR))
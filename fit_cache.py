@@ -0,0 +1,154 @@
+"""
+Persistent cache of the fits of the grid searches.
+
+Every (candidate, fold) fit of a search is keyed by the hash of the training matrix and labels, of the rows of
+its fold, of the estimator class and all of its params, and of the sklearn version. Its score and timings are
+kept in cache/fits/<key>.json, and a search that needs the same fit again takes them from there instead of
+fitting. The model a search refits is kept as well, in cache/fits/<key>.joblib, with all rows as its fold. The
+models of the folds themselves are not kept, the search only needs their scores.
+
+So adding a value to a grid only fits the new candidates, a later stage whose earlier stage picked the same
+params fits nothing, and a refit of the same best candidate is loaded rather than fit. The folds are
+stratified over all the training rows though, so a new season changes every fold, and like any change to the
+training data all of its fits run again.
+
+search.py, halving.py and orchestrate.py look every fit up here before running it. The cache keeps to
+MAX_BYTES on disk, beyond which the least recently used entries are dropped. train.py --no-fit-cache does
+without it.
+"""
+
+import os
+import json
+import glob
+import threading
+from joblib import dump, load, hash as joblib_hash
+from data import tracing
+
+CACHE_DIR = "./cache/fits"
+MAX_BYTES = 2 << 30
+
+# The refit of a search is keyed with this as its fold
+ALL_ROWS = "all"
+
+def data_key(X, y):
+  return joblib_hash((X, y))
+
+def fold_key(train, test):
+  return joblib_hash((train, test))
+
+class FitCache:
+  def __init__(self, cache_dir=CACHE_DIR, max_bytes=MAX_BYTES):
+    self.dir = cache_dir
+    self.max_bytes = max_bytes
+    os.makedirs(self.dir, exist_ok=True)
+    self.sizes = {}
+    for path in glob.glob(os.path.join(self.dir, "*.json")) + glob.glob(os.path.join(self.dir, "*.joblib")):
+      try:
+        self.sizes[path] = os.path.getsize(path)
+      except FileNotFoundError:
+        pass
+    self.total = sum(self.sizes.values())
+    self.lock = threading.Lock()
+
+  def key(self, data, fold, estimator, params, refit=None):
+    # refit is the refit function of the search (see search.refit_best), only for the key of a refit
+    import sklearn
+    from sklearn.base import clone
+    model = clone(estimator).set_params(**params)
+    return joblib_hash((sklearn.__version__, data, fold, type(model).__module__, type(model).__name__, model.get_params(), refit))
+
+  def path(self, key, ext):
+    return os.path.join(self.dir, key + ext)
+
+  def touch(self, path):
+    # So eviction sees it as recently used
+    try:
+      os.utime(path)
+    except FileNotFoundError:
+      pass
+
+  def get_score(self, key):
+    path = self.path(key, ".json")
+    try:
+      with open(path) as fp:
+        result = json.load(fp)
+    except (FileNotFoundError, ValueError):
+      tracing.count("fit_cache.miss")
+      return None
+    tracing.count("fit_cache.hit")
+    self.touch(path)
+    return result
+
+  def save_score(self, key, result):
+    path = self.path(key, ".json")
+    tmp_path = "{}.{}.tmp".format(path, threading.get_ident())
+    with open(tmp_path, "w") as fp:
+      json.dump(result, fp, default=float)
+    os.replace(tmp_path, path)
+    self.added(path)
+
+  def get_model(self, key):
+    # (fitted model, refit time) or None
+    path = self.path(key, ".joblib")
+    if not os.path.exists(path):
+      tracing.count("fit_cache.refit_miss")
+      return None
+    try:
+      with tracing.span("fit_cache.load"):
+        result = load(path)
+    except (EOFError, ValueError):
+      # Cut short by a run that was killed while writing it
+      return None
+    tracing.count("fit_cache.refit_hit")
+    self.touch(path)
+    return result
+
+  def save_model(self, key, model, refit_time):
+    path = self.path(key, ".joblib")
+    tmp_path = "{}.{}.tmp".format(path, threading.get_ident())
+    dump((model, refit_time), tmp_path)
+    os.replace(tmp_path, path)
+    self.added(path)
+
+  def added(self, path):
+    with self.lock:
+      self.total += os.path.getsize(path) - self.sizes.get(path, 0)
+      self.sizes[path] = os.path.getsize(path)
+      if self.total > self.max_bytes:
+        self.evict()
+
+  def evict(self):
+    # Least recently used first, until the cache is back under its size
+    mtimes = {}
+    for path in self.sizes:
+      try:
+        mtimes[path] = os.path.getmtime(path)
+      except FileNotFoundError:
+        mtimes[path] = 0
+    for path in sorted(self.sizes, key=mtimes.get):
+      if self.total <= self.max_bytes:
+        break
+      try:
+        os.remove(path)
+      except FileNotFoundError:
+        pass
+      self.total -= self.sizes.pop(path)
+      tracing.count("fit_cache.evicted")
+
+  def lookup(self, estimator, candidates, X, y, folds):
+    """
+    Scores of the (candidate, fold) fits of a search that are in the cache, as {(i, k): [score, fit_time,
+    score_time]}, and the keys to save the others under.
+    """
+    data = data_key(X, y)
+    folds = [fold_key(train, test) for train, test in folds]
+    keys = {(i, k): self.key(data, fold, estimator, params) for i, params in enumerate(candidates) for k, fold in enumerate(folds)}
+    fits = {}
+    for i_k, key in keys.items():
+      result = self.get_score(key)
+      if result is not None:
+        fits[i_k] = result
+    return fits, keys
+
+  def refit_key(self, estimator, params, refit, X, y):
+    return self.key(data_key(X, y), ALL_ROWS, estimator, params, refit if callable(refit) else None)
@@ -0,0 +1,188 @@
+"""
+Successive halving search, an alternative to GridSearchCV for train.py.
+
+Every candidate of the grid is first cross-validated with models trained on a small stratified sample of each
+training fold. Only the best 1/factor of the candidates move on to the next iteration, which trains on factor
+times more samples, until the last iteration trains on the whole fold like GridSearchCV does. The test folds are
+never subsampled, so scores of the same iteration are comparable. With 25 candidates and factor=3, that is
+25 candidates on 1/9 of the data, 9 on 1/3 and 3 on all of it.
+
+The search can be held to a budget, checked before every iteration:
+
+- max_fits    the number of (candidate, fold) fits. If the first iteration alone does not fit into it, a random
+              sample of the candidates is searched instead of the whole grid
+- max_time    seconds of wall-clock time. The time of the next iteration is estimated from the last one
+
+When the budget runs out the search stops early, and the best candidate of the last iteration that finished is
+refit on the whole training set.
+
+cv_results_ has one row per candidate, with the scores and timings of the last iteration it took part in and
+the `iter` and `n_resources` of that iteration. Candidates that got further rank higher. It has the same keys
+as GridSearchCV's otherwise, so the tables, graphs and scores in train.py work on either.
+
+With a fit cache (see fit_cache.py), the fits and the refit it already has are not run again. They still count
+towards max_fits.
+"""
+
+import math
+import time
+import numpy as np
+from joblib import Parallel, delayed
+from scipy.stats import rankdata
+from sklearn.base import BaseEstimator, clone
+from sklearn.model_selection import ParameterGrid, StratifiedKFold, train_test_split
+from search import refit_cached, lookup_fits, save_fit
+from data import tracing
+
+# Smallest training sample of the first iteration, fewer rows do not have enough All-Stars to learn from
+MIN_RESOURCES = 100
+
+def fit_and_score(estimator, X, y, params, train, test):
+  model = clone(estimator).set_params(**params)
+  start = time.time()
+  with tracing.span("fit", estimator=type(estimator).__name__, params=params, rows=len(train)):
+    model.fit(X[train], y[train])
+  fit_time = time.time() - start
+  with tracing.span("fit.score", estimator=type(estimator).__name__):
+    score = model.score(X[test], y[test])
+  score_time = time.time() - start - fit_time
+  return score, fit_time, score_time
+
+def subsample(train, y, n_resources, random_state):
+  # Stratified, and kept in fold order
+  sample, _ = train_test_split(train, train_size=n_resources, stratify=y[train], random_state=random_state)
+  return np.sort(sample)
+
+class HalvingGridSearch(BaseEstimator):
+  def __init__(self, estimator, param_grid, factor=3, cv=3, refit=True, max_fits=None, max_time=None, random_state=6969, n_jobs=-1, verbose=0, cache=None):
+    self.estimator = estimator
+    self.param_grid = param_grid
+    self.factor = factor
+    self.cv = cv
+    self.refit = refit
+    self.max_fits = max_fits
+    self.max_time = max_time
+    self.random_state = random_state
+    self.n_jobs = n_jobs
+    self.verbose = verbose
+    self.cache = cache
+
+  @property
+  def _estimator_type(self):
+    return self.estimator._estimator_type
+
+  @property
+  def classes_(self):
+    return self.best_estimator_.classes_
+
+  def plan(self, n_candidates, n_train):
+    # Number of iterations and samples of the first one, so the last iteration uses the whole fold
+    n_iterations = 1 + int(math.floor(math.log(max(n_candidates, 1), self.factor)))
+    while n_iterations > 1 and n_train // self.factor**(n_iterations - 1) < MIN_RESOURCES:
+      n_iterations -= 1
+    return n_iterations, n_train // self.factor**(n_iterations - 1)
+
+  def fit(self, X, y):
+    start = time.time()
+    y = np.ravel(y)
+    rng = np.random.RandomState(self.random_state)
+    candidates = list(ParameterGrid(self.param_grid))
+    folds = list(StratifiedKFold(n_splits=self.cv).split(X, y))
+    n_train = min(len(train) for train, _ in folds)
+
+    alive = list(range(len(candidates)))
+    if self.max_fits is not None and len(alive)*self.cv > self.max_fits:
+      alive = sorted(rng.choice(len(candidates), max(self.max_fits // self.cv, 1), replace=False))
+    n_iterations, min_resources = self.plan(len(alive), n_train)
+
+    results = {}
+    n_fits = 0
+    last_time = None
+    for it in range(n_iterations):
+      n_resources = n_train if it == n_iterations - 1 else min_resources*self.factor**it
+      if it > 0:
+        if self.max_fits is not None and n_fits + len(alive)*self.cv > self.max_fits:
+          break
+        if self.max_time is not None:
+          estimate = last_time*len(alive)/last_alive*n_resources/last_resources
+          if time.time() - start + estimate > self.max_time:
+            break
+
+      if self.verbose:
+        print("Halving iteration {}/{}: {} candidates, {} samples per fold, {} fits".format(it + 1, n_iterations, len(alive), n_resources, len(alive)*self.cv))
+      it_start = time.time()
+      # The last iteration trains on the whole folds, exactly like GridSearchCV
+      if it == n_iterations - 1:
+        train_folds = [train for train, _ in folds]
+      else:
+        train_folds = [subsample(train, y, n_resources, self.random_state + k) for k, (train, _) in enumerate(folds)]
+      # Fits of the same candidate on the same sample are taken from the fit cache, see fit_cache.py
+      it_folds = [(train_folds[k], folds[k][1]) for k in range(self.cv)]
+      fits, keys = lookup_fits(self.estimator, [candidates[c] for c in alive], X, y, it_folds, self.cache)
+      todo = [(i, k) for i in range(len(alive)) for k in range(self.cv) if (i, k) not in fits]
+      out = Parallel(n_jobs=self.n_jobs)(
+        delayed(fit_and_score)(self.estimator, X, y, candidates[alive[i]], *it_folds[k])
+        for i, k in todo)
+      for (i, k), result in zip(todo, out):
+        save_fit(fits, keys, i, k, list(result), self.cache)
+      for i, c in enumerate(alive):
+        results[c] = (it, n_resources, [tuple(fits[i, k]) for k in range(self.cv)])
+      n_fits += len(alive)*self.cv
+      last_time, last_alive, last_resources = time.time() - it_start, len(alive), n_resources
+      self.n_iterations_ = it + 1
+
+      # The best 1/factor move on, ties keep grid order
+      scores = [np.mean([s for s, _, _ in results[c][2]]) for c in alive]
+      order = np.argsort(-np.array(scores), kind="stable")
+      alive = sorted(alive[i] for i in order[:int(math.ceil(len(alive)/self.factor))])
+
+    self.cv_results_ = self.make_cv_results(candidates, results)
+    self.best_index_ = int(self.cv_results_["rank_test_score"].argmin())
+    self.best_params_ = self.cv_results_["params"][self.best_index_]
+    self.best_score_ = self.cv_results_["mean_test_score"][self.best_index_]
+    self.n_fits_ = n_fits
+
+    if self.refit:
+      self.best_estimator_, self.refit_time_ = refit_cached(self.estimator, self.best_params_, self.refit, X, y, self.cache)
+    return self
+
+  def make_cv_results(self, candidates, results):
+    # One row per searched candidate, in grid order
+    searched = sorted(results)
+    scores = np.array([[s for s, _, _ in results[c][2]] for c in searched])
+    fit_times = np.array([[t for _, t, _ in results[c][2]] for c in searched])
+    score_times = np.array([[t for _, _, t in results[c][2]] for c in searched])
+    iters = np.array([results[c][0] for c in searched])
+
+    cv_results = {
+      "mean_fit_time": fit_times.mean(axis=1),
+      "std_fit_time": fit_times.std(axis=1),
+      "mean_score_time": score_times.mean(axis=1),
+      "std_score_time": score_times.std(axis=1)
+    }
+    params = [candidates[c] for c in searched]
+    for name in sorted({name for p in params for name in p}):
+      column = np.ma.MaskedArray(np.empty(len(params), dtype=object), mask=True)
+      for i, p in enumerate(params):
+        if name in p:
+          column[i] = p[name]
+      cv_results["param_" + name] = column
+    cv_results["params"] = params
+    for k in range(self.cv):
+      cv_results["split{}_test_score".format(k)] = scores[:, k]
+    cv_results["mean_test_score"] = scores.mean(axis=1)
+    cv_results["std_test_score"] = scores.std(axis=1)
+    # Later iterations first, then by score. Scores are at most 1, so 2*iter always outweighs them
+    cv_results["rank_test_score"] = np.asarray(rankdata(-(2*iters + cv_results["mean_test_score"]), method="min"), dtype=np.int32)
+    cv_results["iter"] = iters
+    cv_results["n_resources"] = np.array([results[c][1] for c in searched])
+    return cv_results
+
+  def predict(self, X):
+    return self.best_estimator_.predict(X)
+
+  def predict_proba(self, X):
+    return self.best_estimator_.predict_proba(X)
+
+  def score(self, X, y):
+    return self.best_estimator_.score(X, y)
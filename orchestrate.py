@@ -0,0 +1,316 @@
+"""
+Concurrent training orchestrator for train.py.
+
+GridSearchCV(n_jobs=-1) runs one search at a time: the workers wait for the slowest fit of a search, then for
+the refit, then for the next stage of the family, and then for the next family. Here every (candidate, fold)
+fit of every family goes on one shared pool of --jobs worker processes instead. A family's next stage is
+scheduled as soon as its previous one finishes, while the other families keep the workers busy, and earlier
+stages go first since later ones wait on them. Each worker runs a single BLAS thread, so --jobs is the CPU
+budget of the whole run.
+
+The folds, the fits and the scores are the same as GridSearchCV(cv=3) would make, and every search comes back
+as a fitted GridSearchCV, so train.py reports and saves them just like in a sequential run. AdaBoost candidates
+that only differ in n_estimators are one staged fit, and SVM candidates that share a gamma one precomputed
+kernel, like in the sequential run (see search.py). The tasks are queued fold by fold, and a worker keeps the
+distances of the fold it built a kernel for while more gammas of that fold are still queued, so it does not
+compute them again for the next one. Those distances are a float64 matrix of the fold's training rows by all of
+its rows, about 750 MB for the full training set, on top of the kernels, and each worker that takes a kernel task
+holds its own: the peak is that times --jobs. A worker drops them as soon as no gamma of the fold is left in the
+queue, or when it is handed any other task.
+
+Progress is checkpointed in cache/train/<hash of the training data>/:
+
+- fits.jsonl             the score and timings of every finished fit
+- <mode>/<model>.joblib  the fitted searches of a family, once all of its stages are done
+- <mode>/<model>.json    its entry of final_scores.json, once it has been reported
+
+<mode> is the hash of the refit mode, train.py's held_out mask or None with --platt-cv. A finished family of
+one mode is never loaded by a run of the other, while the fits, keyed by their estimator, are still shared
+where they are the same.
+
+A run that is interrupted and started again skips all of that work and only fits what is left. Across runs,
+fits are also looked up in the fit cache (see fit_cache.py), so a search whose data and candidates did not all
+change only fits the ones that did.
+
+With tracing on (see data/tracing.py), the workers trace their fits into the same file as the main process.
+"""
+
+import os
+import json
+import time
+import heapq
+import queue
+import shutil
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from joblib import dump, load, hash as joblib_hash
+from sklearn.base import clone
+from sklearn.model_selection import ParameterGrid, StratifiedKFold
+from sklearn.svm import SVC
+from search import N_SPLITS, make_grid_search, refit_best, lookup_fits, save_fit, staged_groups, fit_and_score_staged, kernel_groups, fit_and_score_kernel, squared_distances
+from data import tracing
+
+CHECKPOINT_DIR = "./cache/train"
+
+class Checkpoint:
+  def __init__(self, train_X, train_Y, checkpoint_dir=CHECKPOINT_DIR, fresh=False, refit_mode=None):
+    self.dir = os.path.join(checkpoint_dir, joblib_hash((train_X, train_Y)))
+    if fresh:
+      shutil.rmtree(self.dir, ignore_errors=True)
+    # Finished families depend on how they were refit, not just on the data
+    self.models_dir = os.path.join(self.dir, joblib_hash(refit_mode))
+    os.makedirs(self.models_dir, exist_ok=True)
+
+    self.fits_path = os.path.join(self.dir, "fits.jsonl")
+    self.fits = {}
+    if os.path.exists(self.fits_path):
+      with open(self.fits_path) as fp:
+        lines = fp.read().split("\n")
+      if lines[-1]:
+        # Last line of a run that was killed while writing it, end it so the next fit starts on a new line
+        with open(self.fits_path, "a") as fp:
+          fp.write("\n")
+      for line in lines:
+        if line:
+          try:
+            fit = json.loads(line)
+          except ValueError:
+            continue
+          self.fits[(fit["search"], fit["candidate"], fit["fold"])] = fit["result"]
+    self.lock = threading.Lock()
+
+  def get_fit(self, search_key, candidate, fold):
+    return self.fits.get((search_key, candidate, fold))
+
+  def save_fit(self, search_key, candidate, fold, result):
+    with self.lock:
+      self.fits[(search_key, candidate, fold)] = result
+      with open(self.fits_path, "a") as fp:
+        fp.write(json.dumps({"search": search_key, "candidate": candidate, "fold": fold, "result": result}) + "\n")
+
+  def path(self, name, ext):
+    return os.path.join(self.models_dir, name + ext)
+
+  def load_model(self, name):
+    if not os.path.exists(self.path(name, ".joblib")):
+      return None
+    return load(self.path(name, ".joblib"))
+
+  def save_model(self, name, grids, elapsed):
+    dump((grids, elapsed), self.path(name, ".joblib.tmp"))
+    os.replace(self.path(name, ".joblib.tmp"), self.path(name, ".joblib"))
+
+  def load_result(self, name):
+    if not os.path.exists(self.path(name, ".json")):
+      return None
+    with open(self.path(name, ".json")) as fp:
+      return json.load(fp)
+
+  def save_result(self, name, result):
+    with open(self.path(name, ".json.tmp"), "w") as fp:
+      json.dump(result, fp, sort_keys=True, indent=2, separators=(',', ': '))
+    os.replace(self.path(name, ".json.tmp"), self.path(name, ".json"))
+
+# Worker side, the training data is sent once to every worker when the pool starts
+
+_X = None
+_y = None
+_distances = None
+
+def init_worker(X, y):
+  global _X, _y
+  _X, _y = X, y
+
+def fit_and_score(estimator, params, train, test):
+  model = clone(estimator).set_params(**params)
+  start = time.time()
+  with tracing.span("fit", estimator=type(estimator).__name__, params=params):
+    model.fit(_X[train], _y[train])
+  fit_time = time.time() - start
+  with tracing.span("fit.score", estimator=type(estimator).__name__):
+    score = model.score(_X[test], _y[test])
+  score_time = time.time() - start - fit_time
+  return [score, fit_time, score_time]
+
+def fold_distances(fold, train, test):
+  # Only the last fold is kept, the distances take as much memory as a kernel
+  global _distances
+  if _distances is None or _distances[0] != fold:
+    tracing.count("kernel.distances_miss")
+    _distances = None
+    _distances = (fold, squared_distances(_X, train, test))
+  return _distances[1]
+
+def fit_and_score_group(estimator, params_list, train, test, fold, keep_distances=False):
+  # Candidates that only differ in n_estimators share one staged AdaBoost fit, and SVCs of the same gamma one
+  # kernel, see search.py. The distances of the fold are only kept for the next gamma if keep_distances
+  global _distances
+  if len(params_list) > 1 and isinstance(estimator, SVC):
+    results = fit_and_score_kernel(estimator, _X, _y, params_list, train, test, fold_distances(fold, train, test))
+    if not keep_distances:
+      _distances = None
+    return results
+  _distances = None
+  if len(params_list) > 1:
+    return fit_and_score_staged(estimator, _X, _y, params_list, train, test)
+  return [fit_and_score(estimator, params_list[0], train, test)]
+
+def refit(estimator, params, refit_mode):
+  global _distances
+  _distances = None
+  start = time.time()
+  model = refit_best(estimator, params, refit_mode, _X, _y)
+  return model, time.time() - start
+
+class Family:
+  def __init__(self, name, searches):
+    self.name = name
+    self.searches = searches
+    self.stage = 0
+    self.grids = []
+    self.start = None
+
+  def start_search(self, search, n_rows):
+    self.estimator, self.param_grid, self.refit = search
+    self.candidates = list(ParameterGrid(self.param_grid))
+    self.groups = (staged_groups(self.estimator, self.candidates) or kernel_groups(self.estimator, self.candidates, n_rows)
+      or [[i] for i in range(len(self.candidates))])
+    self.key = joblib_hash((self.name, self.stage, self.estimator, self.param_grid, N_SPLITS))
+    self.fits = {}
+    # Fit cache keys of the fits and of the refit, set by schedule()
+    self.keys = None
+    self.refit_key = None
+
+  def is_searched(self):
+    return len(self.fits) == len(self.candidates)*N_SPLITS
+
+def schedule(families, train_X, train_Y, jobs, checkpoint, done, cache=None):
+  y = train_Y.ravel()
+  folds = list(StratifiedKFold(n_splits=N_SPLITS).split(train_X, y))
+  ready = []
+  counter = [0]
+
+  def push(family, task):
+    # Earlier stages first, they hold up the stages after them
+    heapq.heappush(ready, (family.stage, counter[0], family, task))
+    counter[0] += 1
+
+  def next_search(family, grid):
+    try:
+      search = family.searches.send(grid) if grid is not None else next(family.searches)
+    except StopIteration as e:
+      elapsed = round(time.time() - family.start, 3)
+      checkpoint.save_model(family.name, e.value, elapsed)
+      done.put((family.name, e.value, elapsed))
+      return
+    family.start_search(search, len(train_X))
+    cached, family.keys = lookup_fits(family.estimator, family.candidates, train_X, y, folds, cache)
+    num_tasks = 0
+    for k in range(N_SPLITS):
+      for group in family.groups:
+        for i in group:
+          result = checkpoint.get_fit(family.key, i, k) or cached.get((i, k))
+          if result is not None:
+            family.fits[i, k] = result
+        # A group only fits its candidates that are left
+        todo = [i for i in group if (i, k) not in family.fits]
+        if todo:
+          push(family, ("fit", todo, k))
+          num_tasks += 1
+    print("{}: stage {}, {} candidates x {} folds, {} fits left".format(family.name, family.stage + 1, len(family.candidates), N_SPLITS, num_tasks))
+    if family.is_searched():
+      finish_search(family)
+
+  def finish_search(family):
+    grid = make_grid_search(family.estimator, family.param_grid, False, family.candidates, family.fits)
+    if family.refit:
+      family.refit_key = cache.refit_key(family.estimator, grid.best_params_, family.refit, train_X, y) if cache is not None else None
+      cached = cache.get_model(family.refit_key) if family.refit_key is not None else None
+      if cached is None:
+        push(family, ("refit", grid.best_params_))
+        return
+      grid = make_grid_search(family.estimator, family.param_grid, True, family.candidates, family.fits, *cached)
+    end_stage(family, grid)
+
+  def end_stage(family, grid):
+    family.grids.append(grid)
+    family.stage += 1
+    next_search(family, grid)
+
+  for name, searches in families.items():
+    family = Family(name, searches)
+    saved = checkpoint.load_model(name)
+    if saved is not None:
+      print("{}: all stages already fitted, loaded from {}".format(name, checkpoint.models_dir))
+      done.put((name,) + saved)
+      continue
+    family.start = time.time()
+    next_search(family, None)
+
+  # One BLAS thread per worker, so the workers alone use the CPU budget
+  for var in ["OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS"]:
+    os.environ[var] = "1"
+  context = multiprocessing.get_context("spawn")
+  with ProcessPoolExecutor(jobs, mp_context=context, initializer=init_worker, initargs=(train_X, y)) as pool:
+    in_flight = {}
+    while ready or in_flight:
+      # Only hand the pool as many tasks as it has workers, so the order of the ready queue is kept
+      while ready and len(in_flight) < jobs:
+        _, _, family, task = heapq.heappop(ready)
+        if task[0] == "fit":
+          train, test = folds[task[2]]
+          # Another gamma of the same fold still queued can reuse the distances this one computes
+          keep_distances = any(f is family and t[0] == "fit" and t[2] == task[2] for _, _, f, t in ready)
+          future = pool.submit(fit_and_score_group, family.estimator, [family.candidates[i] for i in task[1]], train, test, task[2], keep_distances)
+        else:
+          future = pool.submit(refit, family.estimator, task[1], family.refit)
+        in_flight[future] = (family, task)
+
+      finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+      for future in finished:
+        family, task = in_flight.pop(future)
+        if task[0] == "fit":
+          _, group, k = task
+          tracing.count("fits", len(group))
+          for i, result in zip(group, future.result()):
+            save_fit(family.fits, family.keys, i, k, result, cache)
+            checkpoint.save_fit(family.key, i, k, result)
+            print("[{}] {}, fold {}: score={:.3f}, total={:.1f}s".format(family.name, family.candidates[i], k + 1, result[0], result[1]))
+          if family.is_searched():
+            finish_search(family)
+        else:
+          best_estimator, refit_time = future.result()
+          if family.refit_key is not None:
+            cache.save_model(family.refit_key, best_estimator, refit_time)
+          grid = make_grid_search(family.estimator, family.param_grid, True, family.candidates, family.fits, best_estimator, refit_time)
+          end_stage(family, grid)
+
+def train_concurrently(families, train_X, train_Y, jobs=None, checkpoint=None, cache=None):
+  """
+  Trains every family of {name: searches generator} on one pool of `jobs` worker processes, with the fits and
+  refits in the FitCache `cache` taken from there.
+  Yields (name, grids, elapsed) for each family as soon as all of its stages are done, the same as
+  train.run_searches() returns, while the other families keep training in the background.
+  """
+  jobs = jobs or os.cpu_count()
+  checkpoint = checkpoint or Checkpoint(train_X, train_Y)
+  done = queue.Queue()
+
+  def run():
+    try:
+      schedule(families, train_X, train_Y, jobs, checkpoint, done, cache)
+      done.put(None)
+    except BaseException as e:
+      done.put(e)
+
+  scheduler = threading.Thread(target=run, daemon=True)
+  scheduler.start()
+  while True:
+    item = done.get()
+    if item is None:
+      break
+    if isinstance(item, BaseException):
+      raise item
+    yield item
+  scheduler.join()
@@ -0,0 +1,130 @@
+"""
+Indexed player store built from the raw JSON in data/raw.
+
+A season file is about 400 KB of JSON, so reading one player out of it means parsing all of it. Here every
+player of every season is a row of one SQLite table in data/players.sqlite, keyed by (player_id, season),
+with the player's raw JSON record as it is in data/raw/<season>.json, and indexes on team and conference:
+
+- players      player_id, season, name, position, team, conference, all_star, data (the raw JSON record)
+- raw_files    the size and mtime of each data/raw/<season>.json the rows were built from
+
+Looking a player up reads one row and parses one small JSON record. The store is kept in sync with data/raw
+by season: whenever a raw file is added, changed or removed, only the rows of that season are rewritten, in
+one transaction, so readers never see half a season.
+
+To build the store by hand, from the repo root:
+
+python player_db.py
+"""
+
+import os
+import json
+import sqlite3
+import threading
+from feature_store import raw_files_signature
+from data import tracing
+
+RAW_DIR = "./data/raw"
+DB_PATH = "./data/players.sqlite"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS players (
+  player_id TEXT NOT NULL,
+  season INTEGER NOT NULL,
+  name TEXT NOT NULL,
+  position TEXT NOT NULL,
+  team TEXT NOT NULL,
+  conference TEXT NOT NULL,
+  all_star INTEGER NOT NULL,
+  data TEXT NOT NULL,
+  PRIMARY KEY (player_id, season)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS players_team ON players (team, season);
+CREATE INDEX IF NOT EXISTS players_conference ON players (conference, season);
+CREATE TABLE IF NOT EXISTS raw_files (
+  season INTEGER PRIMARY KEY,
+  size INTEGER NOT NULL,
+  mtime_ns INTEGER NOT NULL
+);
+"""
+
+_db = None
+_lock = threading.Lock()
+
+def stale_seasons(conn, signature):
+  # Seasons whose raw file changed since their rows were written, and seasons whose raw file is gone
+  built = {season: [size, mtime_ns] for season, size, mtime_ns in conn.execute("SELECT season, size, mtime_ns FROM raw_files")}
+  current = {int(filename[:-len(".json")]): stamp for filename, stamp in signature.items()}
+  changed = [season for season, stamp in current.items() if built.get(season) != stamp]
+  removed = [season for season in built if season not in current]
+  return changed, removed
+
+def sync(conn, raw_dir=RAW_DIR):
+  # Rewrites the rows of every stale season, returns the seasons that were rewritten or removed
+  signature = raw_files_signature(raw_dir)
+  changed, removed = stale_seasons(conn, signature)
+  if not changed and not removed:
+    return []
+
+  with conn:
+    # Take the write lock first and look again, another process may have just done the same work
+    conn.execute("BEGIN IMMEDIATE")
+    changed, removed = stale_seasons(conn, signature)
+    for season in removed:
+      conn.execute("DELETE FROM players WHERE season = ?", (season,))
+      conn.execute("DELETE FROM raw_files WHERE season = ?", (season,))
+    for season in changed:
+      tracing.count("db.seasons_synced")
+      with tracing.span("json_load", path=os.path.join(raw_dir, str(season) + ".json")), open(os.path.join(raw_dir, str(season) + ".json")) as players_data_file:
+        players_data = json.load(players_data_file)
+      conn.execute("DELETE FROM players WHERE season = ?", (season,))
+      conn.executemany("INSERT INTO players VALUES (?, ?, ?, ?, ?, ?, ?, ?)", [
+        (p, season, data["details"]["name"], data["details"]["position"], data["team"]["name"],
+         data["team"]["conference"], int(data["stats"]["all_star"]), json.dumps(data))
+        for p, data in players_data.items()])
+      size, mtime_ns = signature[str(season) + ".json"]
+      conn.execute("INSERT OR REPLACE INTO raw_files VALUES (?, ?, ?)", (season, size, mtime_ns))
+  return sorted(changed + removed)
+
+def connect(db_path=DB_PATH):
+  # isolation_level=None so the only transactions are the ones sync() opens, WAL so readers never wait on it
+  conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+  conn.execute("PRAGMA journal_mode=WAL")
+  conn.executescript(SCHEMA)
+  return conn
+
+def open_db(raw_dir=RAW_DIR, db_path=DB_PATH):
+  conn = connect(db_path)
+  sync(conn, raw_dir)
+  return conn
+
+def get_db():
+  # One connection per process, shared between threads, and synced with data/raw before every use
+  global _db
+  if _db is None:
+    _db = open_db()
+  else:
+    sync(_db)
+  return _db
+
+def get_player(player_id, season):
+  # The raw JSON record of one player, as in data/raw/<season>.json, or None
+  tracing.count("db.lookups")
+  with _lock:
+    row = get_db().execute("SELECT data FROM players WHERE player_id = ? AND season = ?", (player_id, int(season))).fetchone()
+  return json.loads(row[0]) if row is not None else None
+
+def find_players(season=None, team=None, conference=None):
+  # [(player_id, season, record)] of the players matching every filter given, in (player_id, season) order
+  filters = [(column, value) for column, value in [("season", season), ("team", team), ("conference", conference)] if value is not None]
+  where = " AND ".join("{} = ?".format(column) for column, _ in filters) or "1"
+  with _lock:
+    rows = get_db().execute("SELECT player_id, season, data FROM players WHERE " + where + " ORDER BY player_id, season",
+      [int(value) if column == "season" else value for column, value in filters]).fetchall()
+  return [(p, s, json.loads(data)) for p, s, data in rows]
+
+if __name__ == "__main__":
+  conn = connect()
+  seasons = sync(conn)
+  num_rows = conn.execute("SELECT COUNT(*) FROM players").fetchone()[0]
+  print("Player store in {} has {} rows, rebuilt {} seasons".format(DB_PATH, num_rows, len(seasons)))
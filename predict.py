@@ -1,9 +1,9 @@
-import json
 import numpy as np
-from sklearn import metrics
-from joblib import load
 from util import *
-from data.bb_ref import *
+from feature_store import open_store, season_rows
+from registry import get_models
+from season_cache import predict_season
+from data import tracing
 
 def predict_player(model, player_id, season):
   x, details = get_input_and_details_for_player(player_id, season)
@@ -11,31 +11,38 @@ def predict_player(model, player_id, season):
   result = format_single_result(pred, details, season)
   return result
 
-def predict_all_star_prob_for_season(models, season):
-  year_str = str(season)
-  with open("./data/raw/" + year_str + ".json") as players_data_file:
-    players_data = json.load(players_data_file)
-    results = []
+def ensemble_prob(models, x):
+  # Average all-star probability over the ensemble, one predict_proba call per model for all rows of x
+  total_prob = np.zeros(len(x))
+  for model in models:
+    with tracing.span("score", model=type(model).__name__, rows=len(x)):
+      total_prob += model.predict_proba(x)[:,1]
+  return total_prob/len(models)
 
-    for p, data in players_data.items():
-      x = player_data_to_input(p, data).astype(np.float)
-      total_prob = 0
-      for model in models:
-        total_prob += model.predict_proba(x)[:,1][0] 
-      results.append((p, data, total_prob/len(models)))
-    
-    sorted_results = sorted(results, key = lambda x: x[2], reverse=True)
-    max_prob = sorted_results[0][2]
-    sorted_results_simple = []
-    for r in sorted_results:
-      player_id = r[0]
-      name = r[1]["details"]["name"]
-      position = r[1]["details"]["position"]
-      conf = r[1]["team"]["conference"]
-      prob = round(r[2]/max_prob, 3) # Normalized and rounded
-      sorted_results_simple.append([player_id, name, position, conf, prob])
+@tracing.traced("predict.season")
+def predict_all_star_prob_for_season(models, season, store=None):
+  # Slice the season straight out of the memory-mapped feature store, no JSON parsing
+  if store is None:
+    store = open_store()
+  rows = season_rows(store, season)
+  x = np.asarray(store["features"][rows])
+
+  # Score the whole season in one batch
+  probs = ensemble_prob(models, x)
+
+  # Stable sort keeps ties in file order, same as sorted(..., reverse=True)
+  order = np.argsort(-probs, kind="stable")
+  max_prob = probs[order[0]]
+  player_ids = store["player_id"][rows]
+  names = store["name"][rows]
+  positions = store["position"][rows]
+  confs = store["conference"][rows]
+  sorted_results_simple = []
+  for i in order:
+    prob = round(probs[i]/max_prob, 3) # Normalized and rounded
+    sorted_results_simple.append([str(player_ids[i]), str(names[i]), str(positions[i]), str(confs[i]), prob])
 
-    return sorted_results_simple
+  return sorted_results_simple
     
 def get_all_star_predictions(prob_list):
   # For each conference, we have 4 Backcourt, 6 Frontcourt, and 2 wildcards
@@ -66,12 +73,12 @@ def get_all_star_predictions(prob_list):
   west_all_stars = west_backcourt + west_frontcourt
   return east_all_stars, west_all_stars
 
-svm_model = load('./models/svm.joblib')
-nn_model = load('./models/nn.joblib')
-abc_model = load('./models/abc.joblib')
+if __name__ == "__main__":
+  # Only needed for the answers, and it pulls in requests, bs4 and lxml
+  from data.bb_ref import get_list_of_all_stars
 
-SEASON = 2020
+  SEASON = 2020
 
-all_star_prob_list = predict_all_star_prob_for_season([svm_model, nn_model, abc_model], SEASON)
-east_all_stars, west_all_stars = get_all_star_predictions(all_star_prob_list)
-print_result_as_table(west_all_stars, east_all_stars, SEASON, get_list_of_all_stars(SEASON))
+  all_star_prob_list = predict_season(SEASON)
+  east_all_stars, west_all_stars = get_all_star_predictions(all_star_prob_list)
+  print_result_as_table(west_all_stars, east_all_stars, SEASON, get_list_of_all_stars(SEASON))
@@ -0,0 +1,125 @@
+"""
+Registry of the trained models used for prediction.
+
+train.py saves each model as a full GridSearchCV in models/<name>.joblib, including every cv_results_ entry.
+Prediction only needs the fitted best estimator, so the registry exports it on its own to
+models/<name>.best.joblib, saved uncompressed so its arrays can be memory-mapped when loaded.
+The slim artifact is written the first time a model is loaded, and again whenever the full model is newer.
+To export all of them up front:
+
+python registry.py
+
+Models are loaded lazily, on the first get_model() call for that name, and kept for the rest of the process
+unless models/<name>.joblib changes, in which case the next get_model() loads it again.
+joblib (and with it sklearn) is only imported at that point. serve.py calls the registry from its request
+threads and its batcher thread, so loads go through one lock: a model is loaded once, and a thread never sees
+a model without its mtime or the other way round. A model that is already loaded is returned without waiting.
+
+get_compiled_model() returns the model compiled to plain arrays instead (see compiled.py), which scores the same
+with a fraction of sklearn's overhead. It is kept in models/<name>.compiled.npz, written and refreshed like the
+slim artifact, and compiled again when it was written by another version of compiled.py. Loading it does not
+need sklearn at all. A model that cannot be compiled is served by sklearn.
+get_models() returns the compiled models, the ones prediction, the service and the backtest score with, so a
+process that finds the .npz files already written never imports sklearn. get_models(compiled=False) returns the
+sklearn ones.
+"""
+
+import os
+import threading
+from data import tracing
+
+MODELS_DIR = "./models"
+MODEL_NAMES = ["svm", "nn", "abc"]
+
+# Only the MLP is memory-mapped: its weight matrices are a few large arrays. libsvm needs writeable arrays in
+# older sklearn versions, and the AdaBoost model is a thousand small trees, which load faster without mmap.
+MMAP_MODELS = {"nn"}
+
+_models = {}
+_loaded_mtimes = {}
+_compiled = {}
+_compiled_mtimes = {}
+# Reentrant, loading a compiled model may load the sklearn one first
+_lock = threading.RLock()
+
+def full_path(name):
+  return os.path.join(MODELS_DIR, name + ".joblib")
+
+def artifact_path(name):
+  return os.path.join(MODELS_DIR, name + ".best.joblib")
+
+def compiled_path(name):
+  return os.path.join(MODELS_DIR, name + ".compiled.npz")
+
+def is_exported(name, path=None):
+  path = path or artifact_path(name)
+  return os.path.exists(path) and os.path.getmtime(path) >= os.path.getmtime(full_path(name))
+
+def export_model(name):
+  from joblib import load, dump
+  model = load(full_path(name))
+  best = getattr(model, "best_estimator_", model)
+  dump(best, artifact_path(name))
+  return best
+
+def get_model(name):
+  mtime = os.path.getmtime(full_path(name))
+  if _loaded_mtimes.get(name) != mtime:
+    with _lock:
+      if _loaded_mtimes.get(name) != mtime:
+        with tracing.span("model.load", model=name):
+          load_model(name)
+        _loaded_mtimes[name] = mtime
+  return _models[name]
+
+def load_model(name):
+  from joblib import load, dump
+  if is_exported(name):
+    _models[name] = load(artifact_path(name), mmap_mode="r" if name in MMAP_MODELS else None)
+  else:
+    model = load(full_path(name))
+    _models[name] = getattr(model, "best_estimator_", model)
+    try:
+      dump(_models[name], artifact_path(name))
+    except OSError:
+      # Read-only checkout, keep using the full model
+      pass
+
+def get_compiled_model(name):
+  mtime = os.path.getmtime(full_path(name))
+  if _compiled_mtimes.get(name) != mtime:
+    with _lock:
+      if _compiled_mtimes.get(name) != mtime:
+        with tracing.span("model.load", model=name, compiled=True):
+          _compiled[name] = load_compiled_model(name)
+        _compiled_mtimes[name] = mtime
+  return _compiled[name]
+
+def load_compiled_model(name):
+  import compiled
+  if is_exported(name, compiled_path(name)):
+    model = compiled.load(compiled_path(name))
+    if model is not None:
+      return model
+  try:
+    model = compiled.compile_model(get_model(name))
+  except ValueError:
+    return get_model(name)
+  try:
+    compiled.save(model, compiled_path(name))
+  except OSError:
+    pass
+  return model
+
+def get_models(names=MODEL_NAMES, compiled=True):
+  if compiled:
+    return [get_compiled_model(name) for name in names]
+  return [get_model(name) for name in names]
+
+if __name__ == "__main__":
+  import compiled
+  for name in MODEL_NAMES:
+    best = export_model(name)
+    print("Exported {} to {} ({} KB)".format(full_path(name), artifact_path(name), os.path.getsize(artifact_path(name)) // 1024))
+    compiled.save(compiled.compile_model(best), compiled_path(name))
+    print("Compiled {} to {} ({} KB)".format(full_path(name), compiled_path(name), os.path.getsize(compiled_path(name)) // 1024))
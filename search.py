@@ -0,0 +1,284 @@
+"""
+Building blocks shared by the search drivers in train.py and orchestrate.py.
+
+make_grid_search() turns the scores of every (candidate, fold) fit into a fitted GridSearchCV, with the same
+cv_results_ a GridSearchCV(cv=3) fit would have made, so the tables, graphs and saved models do not depend on
+which driver ran the fits.
+
+The AdaBoost n_estimators sweep does not need a fit per n_estimators value. Boosting adds one tree at a time
+and the random state of each tree only depends on the ones before it, so the first 100 trees of a 1,000 tree
+ensemble are exactly the 100 tree ensemble. staged_groups() groups candidates that only differ in
+n_estimators, and fit_and_score_staged() fits the largest ensemble of a group once and scores every smaller one
+from its staged predictions. The fit and score times of the smaller ones are that of the big fit, scaled by
+their share of the trees.
+
+The SVM grid does not need a kernel per fit either. Every candidate of an RBF SVC evaluates the same pairwise
+kernel of the fold, exp(-gamma*|x - x'|^2), only gamma changes it and C does not at all. kernel_groups() groups
+the candidates that share a gamma, and for each fold the squared distances are computed once, each gamma turns
+them into a kernel matrix, and every C of that gamma is fit on it with kernel="precomputed". The scores are the
+same as with kernel="rbf". Only the search works on kernels, the best candidate is refit as the RBF SVC it is,
+so the saved model scores raw feature rows like before. The kernel of a fold takes (2/3 of the training rows)^2
+doubles, so above MAX_KERNEL_ROWS training rows the SVCs are fit one by one again.
+
+Given a fit cache (see fit_cache.py), every search only fits the (candidate, fold) pairs it does not already have
+the score of, and loads its refit when it can. A staged group then only fits its largest candidate that is left,
+and a fold whose kernel candidates are all cached computes no distances.
+
+With tracing on (see data/tracing.py), every fit and refit is a span, as are the distances and kernels of a fold.
+"""
+
+import time
+import numpy as np
+from itertools import product
+from collections import OrderedDict
+from joblib import Parallel, delayed
+from scipy.stats import rankdata
+from sklearn.base import clone
+from sklearn.ensemble import AdaBoostClassifier
+from sklearn.svm import SVC
+from sklearn.metrics import check_scoring
+from sklearn.metrics.pairwise import euclidean_distances
+from sklearn.model_selection import GridSearchCV, ParameterGrid, StratifiedKFold
+from data import tracing
+
+N_SPLITS = 3
+
+# Past this many training rows the distances and kernels of a fold no longer fit comfortably in memory,
+# at 16,000 rows they take about 2.7 GB
+MAX_KERNEL_ROWS = 16000
+
+def make_grid_search(estimator, param_grid, refit, candidates, fits, best_estimator=None, refit_time=None):
+  # A fitted GridSearchCV with the same cv_results_ a GridSearchCV(cv=3) fit would have made.
+  # n_jobs=1 so anything that clones and refits it later stays on one core instead of fanning out again.
+  scores = np.array([[fits[i, k][0] for k in range(N_SPLITS)] for i in range(len(candidates))])
+  fit_times = np.array([[fits[i, k][1] for k in range(N_SPLITS)] for i in range(len(candidates))])
+  score_times = np.array([[fits[i, k][2] for k in range(N_SPLITS)] for i in range(len(candidates))])
+
+  results = {
+    "mean_fit_time": fit_times.mean(axis=1),
+    "std_fit_time": fit_times.std(axis=1),
+    "mean_score_time": score_times.mean(axis=1),
+    "std_score_time": score_times.std(axis=1)
+  }
+  for name in sorted({name for params in candidates for name in params}):
+    column = np.ma.MaskedArray(np.empty(len(candidates), dtype=object), mask=True)
+    for i, params in enumerate(candidates):
+      if name in params:
+        column[i] = params[name]
+    results["param_" + name] = column
+  results["params"] = candidates
+  for k in range(N_SPLITS):
+    results["split{}_test_score".format(k)] = scores[:, k]
+  results["mean_test_score"] = scores.mean(axis=1)
+  results["std_test_score"] = scores.std(axis=1)
+  results["rank_test_score"] = np.asarray(rankdata(-results["mean_test_score"], method="min"), dtype=np.int32)
+
+  grid = GridSearchCV(estimator, param_grid, refit=refit, cv=N_SPLITS, n_jobs=1)
+  grid.cv_results_ = results
+  grid.best_index_ = int(results["rank_test_score"].argmin())
+  grid.best_params_ = candidates[grid.best_index_]
+  grid.best_score_ = results["mean_test_score"][grid.best_index_]
+  grid.multimetric_ = False
+  grid.scorer_ = check_scoring(estimator)
+  grid.n_splits_ = N_SPLITS
+  if refit:
+    grid.best_estimator_ = best_estimator
+    grid.refit_time_ = refit_time
+  return grid
+
+def refit_best(estimator, params, refit, X, y):
+  # refit is either True, to fit the best candidate on all of X, or a function refit(model, X, y) that builds the
+  # model to save from the unfitted best candidate (see train.calibrate_on_held_out)
+  model = clone(estimator).set_params(**params)
+  with tracing.span("refit", estimator=type(estimator).__name__, params=params):
+    return refit(model, X, y) if callable(refit) else model.fit(X, y)
+
+def refit_cached(estimator, params, refit, X, y, cache=None):
+  # refit_best(), or the model it made the last time from the fit cache (see fit_cache.py), and its refit time
+  key = cache.refit_key(estimator, params, refit, X, y) if cache is not None else None
+  cached = cache.get_model(key) if key is not None else None
+  if cached is not None:
+    return cached
+  start = time.time()
+  model = refit_best(estimator, params, refit, X, y)
+  refit_time = time.time() - start
+  if key is not None:
+    cache.save_model(key, model, refit_time)
+  return model, refit_time
+
+def lookup_fits(estimator, candidates, X, y, folds, cache=None):
+  # The (candidate, fold) fits already in the fit cache, and the keys to save the others under
+  if cache is None:
+    return {}, None
+  return cache.lookup(estimator, candidates, X, y, folds)
+
+def save_fit(fits, keys, i, k, result, cache=None):
+  fits[i, k] = result
+  if cache is not None:
+    cache.save_score(keys[i, k], result)
+
+def finish_grid_search(estimator, param_grid, refit, candidates, fits, X, y, cache=None):
+  grid = make_grid_search(estimator, param_grid, False, candidates, fits)
+  if refit:
+    best_estimator, refit_time = refit_cached(estimator, grid.best_params_, refit, X, y, cache)
+    grid = make_grid_search(estimator, param_grid, True, candidates, fits, best_estimator, refit_time)
+  return grid
+
+def fit_and_score(estimator, X, y, params, train, test):
+  model = clone(estimator).set_params(**params)
+  start = time.time()
+  with tracing.span("fit", estimator=type(estimator).__name__, params=params):
+    model.fit(X[train], y[train])
+  fit_time = time.time() - start
+  with tracing.span("fit.score", estimator=type(estimator).__name__):
+    score = model.score(X[test], y[test])
+  score_time = time.time() - start - fit_time
+  return [score, fit_time, score_time]
+
+def fold_grid_search(estimator, param_grid, refit, X, y, n_jobs=-1, verbose=0, cache=None):
+  # Every candidate on every fold, like GridSearchCV(cv=3), for the estimators nothing can be shared between
+  candidates = list(ParameterGrid(param_grid))
+  folds = list(StratifiedKFold(n_splits=N_SPLITS).split(X, y))
+  fits, keys = lookup_fits(estimator, candidates, X, y, folds, cache)
+  todo = [(i, k) for i in range(len(candidates)) for k in range(N_SPLITS) if (i, k) not in fits]
+  if verbose:
+    print("Fitting {} folds for each of {} candidates, {} fits left".format(N_SPLITS, len(candidates), len(todo)))
+  out = Parallel(n_jobs=n_jobs, verbose=verbose)(
+    delayed(fit_and_score)(estimator, X, y, candidates[i], *folds[k]) for i, k in todo)
+  for (i, k), result in zip(todo, out):
+    save_fit(fits, keys, i, k, result, cache)
+
+  return finish_grid_search(estimator, param_grid, refit, candidates, fits, X, y, cache)
+
+def staged_groups(estimator, candidates):
+  # Lists of candidate indices that only differ in n_estimators, or None if there is nothing to share
+  if not isinstance(estimator, AdaBoostClassifier) or not all("n_estimators" in params for params in candidates):
+    return None
+  groups = OrderedDict()
+  for i, params in enumerate(candidates):
+    rest = repr(sorted((name, value) for name, value in params.items() if name != "n_estimators"))
+    groups.setdefault(rest, []).append(i)
+  if all(len(group) == 1 for group in groups.values()):
+    return None
+  return list(groups.values())
+
+def fit_and_score_staged(estimator, X, y, params_list, train, test):
+  sizes = [params["n_estimators"] for params in params_list]
+  largest = int(np.argmax(sizes))
+  model = clone(estimator).set_params(**params_list[largest])
+  start = time.time()
+  with tracing.span("fit", estimator=type(estimator).__name__, params=params_list[largest], staged=len(sizes)):
+    model.fit(X[train], y[train])
+  fit_time = time.time() - start
+
+  scores = {}
+  with tracing.span("fit.score", estimator=type(estimator).__name__):
+    for n, score in enumerate(model.staged_score(X[test], y[test]), 1):
+      if n in sizes:
+        scores[n] = score
+  score_time = time.time() - start - fit_time
+
+  # Boosting stops early once a tree fits perfectly, the larger ensembles are then the one that was fit
+  return [[scores.get(n, score), fit_time*n/sizes[largest], score_time*n/sizes[largest]] for n in sizes]
+
+def staged_grid_search(estimator, param_grid, refit, X, y, n_jobs=-1, verbose=0, cache=None):
+  candidates = list(ParameterGrid(param_grid))
+  groups = staged_groups(estimator, candidates)
+  folds = list(StratifiedKFold(n_splits=N_SPLITS).split(X, y))
+  fits, keys = lookup_fits(estimator, candidates, X, y, folds, cache)
+  # Only the candidates not in the fit cache, the largest of them is fit
+  todo = [([i for i in group if (i, k) not in fits], k) for group, k in product(groups, range(N_SPLITS))]
+  todo = [(group, k) for group, k in todo if group]
+  if verbose:
+    print("Fitting {} folds for each of {} candidates, as {} staged fits".format(N_SPLITS, len(candidates), len(todo)))
+  out = Parallel(n_jobs=n_jobs, verbose=verbose)(
+    delayed(fit_and_score_staged)(estimator, X, y, [candidates[i] for i in group], *folds[k])
+    for group, k in todo)
+
+  for (group, k), results in zip(todo, out):
+    for i, result in zip(group, results):
+      save_fit(fits, keys, i, k, result, cache)
+
+  return finish_grid_search(estimator, param_grid, refit, candidates, fits, X, y, cache)
+
+def kernel_groups(estimator, candidates, n_rows):
+  # Lists of candidate indices of an RBF SVC that share a gamma, or None if there is nothing to share
+  if not isinstance(estimator, SVC) or estimator.kernel != "rbf" or n_rows > MAX_KERNEL_ROWS:
+    return None
+  if not all(isinstance(params.get("gamma"), (int, float)) and "kernel" not in params for params in candidates):
+    return None
+  groups = OrderedDict()
+  for i, params in enumerate(candidates):
+    groups.setdefault(params["gamma"], []).append(i)
+  if all(len(group) == 1 for group in groups.values()):
+    return None
+  return list(groups.values())
+
+def squared_distances(X, train, test):
+  # Of the training rows of a fold to each other, and of its test rows to the training rows. In float64 like
+  # libsvm computes its RBF kernel, the features are float32
+  with tracing.span("kernel.distances", rows=len(train)):
+    X_train = X[train].astype(np.float64)
+    return euclidean_distances(X_train, squared=True), euclidean_distances(X[test].astype(np.float64), X_train, squared=True)
+
+def rbf_kernels(distances, gamma):
+  kernels = []
+  with tracing.span("kernel.rbf", gamma=gamma):
+    for d in distances:
+      kernel = d*-gamma
+      np.exp(kernel, out=kernel)
+      kernels.append(kernel)
+  return kernels
+
+def fit_and_score_precomputed(estimator, kernels, y, params, train, test):
+  model = clone(estimator).set_params(**params).set_params(kernel="precomputed")
+  start = time.time()
+  with tracing.span("fit", estimator=type(estimator).__name__, params=params):
+    model.fit(kernels[0], y[train])
+  fit_time = time.time() - start
+  with tracing.span("fit.score", estimator=type(estimator).__name__):
+    score = model.score(kernels[1], y[test])
+  score_time = time.time() - start - fit_time
+  return [score, fit_time, score_time]
+
+def fit_and_score_kernel(estimator, X, y, params_list, train, test, distances=None):
+  # The candidates of one gamma on one fold, the time to build their kernel is shared between them
+  if distances is None:
+    distances = squared_distances(X, train, test)
+  start = time.time()
+  kernels = rbf_kernels(distances, params_list[0]["gamma"])
+  kernel_time = (time.time() - start)/len(params_list)
+  results = []
+  for params in params_list:
+    score, fit_time, score_time = fit_and_score_precomputed(estimator, kernels, y, params, train, test)
+    results.append([score, fit_time + kernel_time, score_time])
+  return results
+
+def kernel_grid_search(estimator, param_grid, refit, X, y, n_jobs=-1, verbose=0, cache=None):
+  candidates = list(ParameterGrid(param_grid))
+  groups = kernel_groups(estimator, candidates, len(X))
+  folds = list(StratifiedKFold(n_splits=N_SPLITS).split(X, y))
+  fits, keys = lookup_fits(estimator, candidates, X, y, folds, cache)
+  if verbose:
+    print("Fitting {} folds for each of {} candidates, on {} precomputed kernels, {} fits left".format(N_SPLITS, len(candidates), len(groups)*N_SPLITS, len(candidates)*N_SPLITS - len(fits)))
+
+  for k, (train, test) in enumerate(folds):
+    # Only the candidates not in the fit cache, a fold or gamma with none left needs no distances or kernel
+    todo = [[i for i in group if (i, k) not in fits] for group in groups]
+    todo = [group for group in todo if group]
+    if not todo:
+      continue
+    distances = squared_distances(X, train, test)
+    for group in todo:
+      start = time.time()
+      kernels = rbf_kernels(distances, candidates[group[0]]["gamma"])
+      kernel_time = (time.time() - start)/len(group)
+      # libsvm releases the GIL, so threads can share the kernel where worker processes would each need a copy
+      out = Parallel(n_jobs=n_jobs, verbose=verbose, prefer="threads")(
+        delayed(fit_and_score_precomputed)(estimator, kernels, y, candidates[i], train, test) for i in group)
+      for i, (score, fit_time, score_time) in zip(group, out):
+        save_fit(fits, keys, i, k, [score, fit_time + kernel_time, score_time], cache)
+      del kernels
+    del distances
+
+  return finish_grid_search(estimator, param_grid, refit, candidates, fits, X, y, cache)
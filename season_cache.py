@@ -0,0 +1,126 @@
+"""
+Memoized season predictions.
+
+predict_season() returns the same list as predict_all_star_prob_for_season, but remembers it under a key made
+from the content hashes of data/raw/<season>.json and of every model file, from the version of compiled.py that
+scores them, and from the signature of the features of the feature store (FEATURES, their dtype and SCHEMA,
+see feature_store.py). As long as none of them changes, the result comes from memory or, in a new process,
+from cache/predictions/<key>.json. When the season data, a model, compiled.py or the features change, the key
+changes and the season is scored again.
+
+The lock is only held to read and write the in-memory cache, so the threads of serve.py score different
+seasons at the same time. Two threads that miss on the same season both score it, and get the same result.
+
+Both caches are bounded: the in-memory one keeps the MAX_MEMORY_ENTRIES most recently used results, and the
+on-disk one drops the least recently used files beyond MAX_DISK_ENTRIES.
+"""
+
+import os
+import json
+import glob
+import hashlib
+import threading
+from collections import OrderedDict
+from registry import MODEL_NAMES, full_path, get_models
+from feature_store import features_signature
+from compiled import VERSION as COMPILED_VERSION
+from data import tracing
+
+RAW_DIR = "./data/raw"
+CACHE_DIR = "./cache/predictions"
+MAX_MEMORY_ENTRIES = 64
+MAX_DISK_ENTRIES = 512
+
+_hashes = {}
+_results = OrderedDict()
+_lock = threading.Lock()
+
+def file_hash(path):
+  # Hashes are remembered per (size, mtime), so unchanged files are not read again
+  st = os.stat(path)
+  stamp = (st.st_size, st.st_mtime_ns)
+  cached = _hashes.get(path)
+  if cached is not None and cached[0] == stamp:
+    return cached[1]
+  h = hashlib.sha256()
+  with open(path, "rb") as f:
+    for chunk in iter(lambda: f.read(1 << 20), b""):
+      h.update(chunk)
+  _hashes[path] = (stamp, h.hexdigest())
+  return _hashes[path][1]
+
+def season_key(season, model_names=MODEL_NAMES):
+  h = hashlib.sha256()
+  h.update(str(season).encode())
+  h.update(file_hash(os.path.join(RAW_DIR, str(season) + ".json")).encode())
+  h.update(json.dumps(features_signature(), sort_keys=True).encode())
+  for name in model_names:
+    h.update(name.encode())
+    h.update(file_hash(full_path(name)).encode())
+  h.update(COMPILED_VERSION.encode())
+  return h.hexdigest()
+
+def load_from_disk(key):
+  path = os.path.join(CACHE_DIR, key + ".json")
+  try:
+    with open(path) as fp:
+      result = json.load(fp)
+  except (FileNotFoundError, ValueError):
+    return None
+  # Touch the file so disk eviction sees it as recently used
+  try:
+    os.utime(path)
+  except FileNotFoundError:
+    pass
+  return result
+
+def mtime(path):
+  # Another thread or process may have evicted it already
+  try:
+    return os.path.getmtime(path)
+  except FileNotFoundError:
+    return 0
+
+def save_to_disk(key, result):
+  os.makedirs(CACHE_DIR, exist_ok=True)
+  path = os.path.join(CACHE_DIR, key + ".json")
+  tmp_path = "{}.{}.tmp".format(path, threading.get_ident())
+  with open(tmp_path, "w") as fp:
+    json.dump(result, fp, default=float)
+  os.replace(tmp_path, path)
+
+  files = sorted(glob.glob(os.path.join(CACHE_DIR, "*.json")), key=mtime)
+  for old_path in files[:max(0, len(files) - MAX_DISK_ENTRIES)]:
+    try:
+      os.remove(old_path)
+    except FileNotFoundError:
+      pass
+
+def remember(key, result):
+  _results[key] = result
+  _results.move_to_end(key)
+  while len(_results) > MAX_MEMORY_ENTRIES:
+    _results.popitem(last=False)
+
+def predict_season(season, model_names=MODEL_NAMES):
+  # Imported here, predict.py itself uses this module for its cached path
+  from predict import predict_all_star_prob_for_season
+
+  key = season_key(season, model_names)
+  with _lock:
+    if key in _results:
+      tracing.count("predict_cache.memory_hit")
+      _results.move_to_end(key)
+      return _results[key]
+
+  result = load_from_disk(key)
+  if result is not None:
+    tracing.count("predict_cache.disk_hit")
+  else:
+    tracing.count("predict_cache.miss")
+    result = predict_all_star_prob_for_season(get_models(model_names, compiled=True), season)
+    result = [[p, name, position, conf, float(prob)] for p, name, position, conf, prob in result]
+    save_to_disk(key, result)
+  with _lock:
+    remember(key, result)
+  return result
@@ -0,0 +1,193 @@
+"""
+Long-running prediction service.
+
+Keeps the ensemble and the feature store in memory and answers over HTTP with JSON:
+
+- GET /player?id=<player_id>[,<player_id>...]&season=<season>    all-star probability of one or more players
+- GET /season?season=<season>                                    predict_all_star_prob_for_season
+- GET /roster?season=<season>                                    get_all_star_predictions
+- GET /whatif?season=<season>&id=<player_id>&<stat>=<value>...   WhatIf.update, the rosters with that player's
+                                                                 stats changed (see whatif.py)
+
+Player requests are not scored one by one. Each row goes into a queue, and a single worker thread scores
+whatever has queued up (at most --batch-size rows, waiting at most --max-wait-ms for more to arrive) with one
+predict_proba call per model. Many concurrent dashboard queries are coalesced into a few batches that way.
+Season results come from season_cache, so they are only computed again when the season data or a model changes.
+What-ifs keep one scored WhatIf per season, and undo their changes after answering, so every request starts
+from the season as it is. A value of the form +3 adds to the stat (a + needs no %2B escaping here).
+
+python serve.py [--port 8000] [--batch-size 256] [--max-wait-ms 2]
+"""
+
+import json
+import time
+import queue
+import argparse
+import threading
+import numpy as np
+from concurrent.futures import Future
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs, parse_qsl
+from util import format_single_result
+from feature_store import open_store, refresh_store, has_season, season_index
+from predict import ensemble_prob, get_all_star_predictions
+from registry import get_models
+from season_cache import predict_season
+from whatif import WhatIf
+
+class MicroBatcher:
+  def __init__(self, score_fn, max_batch_size=256, max_wait=0.002):
+    self.score_fn = score_fn
+    self.max_batch_size = max_batch_size
+    self.max_wait = max_wait
+    self.queue = queue.Queue()
+    self.worker = threading.Thread(target=self.run, daemon=True)
+    self.worker.start()
+
+  def submit(self, x):
+    future = Future()
+    self.queue.put((x, future))
+    return future
+
+  def next_batch(self):
+    batch = [self.queue.get()]
+    deadline = time.monotonic() + self.max_wait
+    while len(batch) < self.max_batch_size:
+      timeout = deadline - time.monotonic()
+      if timeout <= 0:
+        break
+      try:
+        batch.append(self.queue.get(timeout=timeout))
+      except queue.Empty:
+        break
+    return batch
+
+  def run(self):
+    while True:
+      batch = self.next_batch()
+      try:
+        probs = self.score_fn(np.vstack([x for x, _ in batch]))
+      except Exception as e:
+        for _, future in batch:
+          future.set_exception(e)
+        continue
+      for (_, future), prob in zip(batch, probs):
+        future.set_result(float(prob))
+
+class PredictionService:
+  def __init__(self, max_batch_size=256, max_wait=0.002):
+    # Load the models up front, get_models() then only reloads them if a model file changes
+    get_models(compiled=True)
+    self.store = open_store()
+    self.batcher = MicroBatcher(lambda x: ensemble_prob(get_models(compiled=True), x), max_batch_size, max_wait)
+    self.whatifs = {}
+    self.whatif_lock = threading.Lock()
+
+  def current_store(self):
+    self.store = refresh_store(self.store)
+    return self.store
+
+  def predict_players(self, player_ids, season):
+    store = self.current_store()
+    index = season_index(store, season)
+    rows = [index.get(p) for p in player_ids]
+    futures = [self.batcher.submit(store["features"][r:r + 1]) if r is not None else None for r in rows]
+    results = []
+    for p, r, future in zip(player_ids, rows, futures):
+      if future is None:
+        results.append({"player_id": p, "error": "no such player in {}".format(season)})
+        continue
+      prob = future.result()
+      details = {
+        "details": {"name": str(store["name"][r]), "position": str(store["position"][r])},
+        "team": {"name": str(store["team"][r]), "conference": str(store["conference"][r])}
+      }
+      results.append({
+        "player_id": p,
+        "name": details["details"]["name"],
+        "position": details["details"]["position"],
+        "team": details["team"]["name"],
+        "conference": details["team"]["conference"],
+        "prob": prob,
+        "result": format_single_result(prob, details, season)
+      })
+    return results
+
+  def predict_season(self, season):
+    return predict_season(season)
+
+  def predict_roster(self, season):
+    east_all_stars, west_all_stars = get_all_star_predictions(self.predict_season(season))
+    return {"east": east_all_stars, "west": west_all_stars}
+
+  def whatif(self, season, player_id, changes):
+    store = self.current_store()
+    models = get_models(compiled=True)
+    with self.whatif_lock:
+      # Scored again when the store or a model changed
+      cached = self.whatifs.get(season)
+      if cached is None or cached[0] is not store or any(a is not b for a, b in zip(cached[1], models)):
+        self.whatifs[season] = (store, models, WhatIf(season, models, store))
+      whatif = self.whatifs[season][2]
+      try:
+        return whatif.update({player_id: changes})
+      finally:
+        whatif.reset()
+
+def make_handler(service):
+  class Handler(BaseHTTPRequestHandler):
+    def send_json(self, status, body):
+      data = json.dumps(body, default=float).encode("utf-8")
+      self.send_response(status)
+      self.send_header("Content-Type", "application/json; charset=utf-8")
+      self.send_header("Content-Length", str(len(data)))
+      self.end_headers()
+      self.wfile.write(data)
+
+    def do_GET(self):
+      url = urlparse(self.path)
+      query = parse_qs(url.query)
+      try:
+        season = int(query["season"][0])
+      except (KeyError, ValueError):
+        return self.send_json(400, {"error": "season is required"})
+      if not has_season(service.current_store(), season):
+        return self.send_json(404, {"error": "no data for season {}".format(season)})
+
+      if url.path == "/player":
+        if "id" not in query:
+          return self.send_json(400, {"error": "id is required"})
+        player_ids = [p for ids in query["id"] for p in ids.split(",") if p]
+        return self.send_json(200, service.predict_players(player_ids, season))
+      if url.path == "/season":
+        return self.send_json(200, service.predict_season(season))
+      if url.path == "/roster":
+        return self.send_json(200, service.predict_roster(season))
+      if url.path == "/whatif":
+        if "id" not in query:
+          return self.send_json(400, {"error": "id is required"})
+        # parse_qs reads a + as a space, here it is the sign of a change
+        changes = {stat: value for stat, value in parse_qsl(url.query.replace("+", "%2B")) if stat not in ("season", "id")}
+        try:
+          return self.send_json(200, service.whatif(season, query["id"][0], changes))
+        except ValueError as e:
+          return self.send_json(400, {"error": str(e)})
+      return self.send_json(404, {"error": "unknown endpoint {}".format(url.path)})
+
+    def log_message(self, format, *args):
+      pass
+
+  return Handler
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Serve All-Star predictions over HTTP")
+  parser.add_argument("--host", default="127.0.0.1")
+  parser.add_argument("--port", type=int, default=8000)
+  parser.add_argument("--batch-size", type=int, default=256, help="max rows scored in one batch")
+  parser.add_argument("--max-wait-ms", type=float, default=2, help="how long a batch waits for more rows")
+  args = parser.parse_args()
+
+  service = PredictionService(args.batch_size, args.max_wait_ms/1000)
+  server = ThreadingHTTPServer((args.host, args.port), make_handler(service))
+  print("Serving predictions on http://{}:{}".format(args.host, args.port))
+  server.serve_forever()
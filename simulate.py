@@ -0,0 +1,153 @@
+"""
+Monte Carlo simulation of the All-Star rosters.
+
+get_all_star_predictions picks one roster, greedily, from the ensemble probabilities, which hides how close the
+calls are. Here many possible selections are drawn instead, and every player gets the fraction of draws in
+which they made the roster, and in which they started.
+
+Each draw ranks the players of a conference by a latent score, logit(prob) + logistic noise, with prob the
+ensemble's own probability (season_probs()). Not the probabilities of predict_all_star_prob_for_season: those
+are divided by the season's best and rounded, so the best player would always be picked and anyone rounded
+to 0 never. Probabilities are clipped to [MIN_PROB, 1 - MIN_PROB] so every logit is finite. A player's score
+is above 0 with exactly their probability, so in every draw each player is an All-Star candidate with the
+probability the ensemble gives them, and the candidates rank ahead of the rest. The noise also reorders players
+with close probabilities. Every draw then goes through the same rules as get_all_star_predictions: in ranking order, at
+most MAX_BACKCOURT backcourt and MAX_FRONTCOURT frontcourt players, until ROSTER_SIZE are in. The starters of a
+draw are its first BACKCOURT_STARTERS backcourt and FRONTCOURT_STARTERS frontcourt players, like in
+print_result_as_table. Without the noise, a draw is exactly the roster get_all_star_predictions picks.
+
+There is no loop over draws. A chunk of draws is one matrix of keys, sorted row by row, and the roster rules
+are cumulative counts over the sorted positions. Only the top TOP_K of each draw are sorted, which is as far as
+the rules can reach, unless a draw's top TOP_K hold too few players of a position, then it is sorted entirely. Draws come from
+np.random.default_rng(seed) chunk by chunk, so a seed always gives the same frequencies.
+
+Run from the repo root:
+
+python simulate.py [season] [--draws 100000] [--seed 6969] [--top 30] [--out simulation.json]
+"""
+
+import json
+import argparse
+import numpy as np
+
+ROSTER_SIZE = 12
+MAX_BACKCOURT = 6
+MAX_FRONTCOURT = 8
+BACKCOURT_STARTERS = 2
+FRONTCOURT_STARTERS = 3
+BACKCOURT = {"PG", "SG"}
+
+CHUNK_SIZE = 10000
+TOP_K = 40
+
+# Keeps logit(prob) finite, so no player is certain to be picked or left out
+MIN_PROB = 1e-6
+
+def rank_draws(keys, is_backcourt):
+  """
+  Player indices of every draw, best first, as (ranked, short): ranked is the top TOP_K of every draw, and
+  short the draws whose top TOP_K hold too few players of a position to fill the roster. Those are ranked
+  entirely in ranked_short.
+  """
+  n = keys.shape[1]
+  if n <= TOP_K:
+    return np.argsort(-keys, axis=1), np.zeros(len(keys), dtype=bool)
+  top = np.argpartition(-keys, TOP_K - 1, axis=1)[:, :TOP_K]
+  top = np.take_along_axis(top, np.argsort(-np.take_along_axis(keys, top, axis=1), axis=1), axis=1)
+  # With MAX_BACKCOURT and MAX_FRONTCOURT of each in the top, the roster is full before it runs out
+  num_backcourt = is_backcourt[top].sum(axis=1)
+  short = (num_backcourt < MAX_BACKCOURT) | (TOP_K - num_backcourt < MAX_FRONTCOURT)
+  return top, short
+
+def select(order, is_backcourt):
+  # (selected, starter) masks over the ranked positions of every draw
+  backcourt = is_backcourt[order]
+  frontcourt = ~backcourt
+  num_backcourt = np.cumsum(backcourt, axis=1)
+  num_frontcourt = np.cumsum(frontcourt, axis=1)
+  taken_before = np.minimum(num_backcourt - backcourt, MAX_BACKCOURT) + np.minimum(num_frontcourt - frontcourt, MAX_FRONTCOURT)
+  fits = np.where(backcourt, num_backcourt <= MAX_BACKCOURT, num_frontcourt <= MAX_FRONTCOURT)
+  selected = fits & (taken_before < ROSTER_SIZE)
+  starter = np.where(backcourt, num_backcourt <= BACKCOURT_STARTERS, num_frontcourt <= FRONTCOURT_STARTERS)
+  return selected, starter
+
+def simulate_conference(probs, is_backcourt, draws, rng):
+  # Number of draws each player is selected and starts in
+  n = len(probs)
+  probs = np.clip(probs, MIN_PROB, 1 - MIN_PROB)
+  logits = (np.log(probs) - np.log1p(-probs)).astype(np.float32)
+  selected_counts = np.zeros(n, dtype=np.int64)
+  starter_counts = np.zeros(n, dtype=np.int64)
+  for start in range(0, draws, CHUNK_SIZE):
+    size = min(CHUNK_SIZE, draws - start)
+    # Logistic noise from float32 uniforms, a third of the time of rng.logistic and half the memory
+    u = rng.random((size, n), dtype=np.float32)
+    with np.errstate(divide="ignore"):
+      keys = np.log(u)
+      keys -= np.log1p(-u)
+    keys += logits
+    ranked, short = rank_draws(keys, is_backcourt)
+    for order in [ranked[~short], np.argsort(-keys[short], axis=1)]:
+      selected, starter = select(order, is_backcourt)
+      selected_counts += np.bincount(order[selected], minlength=n)
+      starter_counts += np.bincount(order[starter], minlength=n)
+  return selected_counts, starter_counts
+
+def season_probs(season, models=None, store=None):
+  """
+  [player_id, name, position, conference, prob] of every player of the season, with prob the ensemble's
+  probability as it is, not normalized or rounded like predict_all_star_prob_for_season's.
+  """
+  from feature_store import open_store, season_rows
+  from predict import ensemble_prob
+  from registry import get_models
+  if store is None:
+    store = open_store()
+  if models is None:
+    models = get_models(compiled=True)
+  rows = season_rows(store, season)
+  probs = ensemble_prob(models, np.asarray(store["features"][rows]))
+  return [[str(p), str(name), str(position), str(conf), float(prob)] for p, name, position, conf, prob
+    in zip(store["player_id"][rows], store["name"][rows], store["position"][rows], store["conference"][rows], probs)]
+
+def simulate(prob_list, draws=100000, seed=6969):
+  """
+  prob_list is [player_id, name, position, conference, prob] per player, as season_probs() returns.
+  Returns a list of [player_id, name, position, conference, prob, selected, starter], with selected and starter
+  the fraction of draws, sorted by selected then starter.
+  """
+  rng = np.random.default_rng(seed)
+  results = []
+  for conf in sorted({r[3] for r in prob_list}):
+    players = [r for r in prob_list if r[3] == conf]
+    probs = np.array([r[4] for r in players], dtype=float)
+    is_backcourt = np.array([r[2] in BACKCOURT for r in players])
+    selected, starter = simulate_conference(probs, is_backcourt, draws, rng)
+    results.extend(list(r) + [selected[i]/draws, starter[i]/draws] for i, r in enumerate(players))
+  return sorted(results, key=lambda r: (-r[5], -r[6]))
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Simulate the All-Star selection from the ensemble probabilities")
+  parser.add_argument("season", type=int, nargs="?", default=2020)
+  parser.add_argument("--draws", type=int, default=100000)
+  parser.add_argument("--seed", type=int, default=6969)
+  parser.add_argument("--top", type=int, default=30, help="players printed per conference")
+  parser.add_argument("--out", help="save every player's frequencies as JSON")
+  args = parser.parse_args()
+
+  results = simulate(season_probs(args.season), args.draws, args.seed)
+  for conf in sorted({r[3] for r in results}):
+    print("{} ({} draws, seed {})".format(conf, args.draws, args.seed))
+    print("{:<26} {:>3} {:>6} {:>9} {:>8}".format("player", "pos", "prob", "selected", "starter"))
+    for r in [r for r in results if r[3] == conf][:args.top]:
+      print("{:<26} {:>3} {:>6.3f} {:>9.3f} {:>8.3f}".format(r[1], r[2], r[4], r[5], r[6]))
+    print()
+
+  if args.out:
+    with open(args.out, "w") as fp:
+      json.dump({
+        "season": args.season,
+        "draws": args.draws,
+        "seed": args.seed,
+        "players": [dict(zip(["player_id", "name", "position", "conference", "prob", "selected", "starter"], r)) for r in results]
+      }, fp, indent=2)
@@ -0,0 +1,66 @@
+import os
+import sys
+import time
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+class Site:
+  """
+  Serves pages from memory on localhost, in place of basketball-reference. failures[path] is a list of statuses
+  the path answers with before its page, and every request is logged as (path, time).
+  """
+  def __init__(self):
+    self.pages = {}
+    self.failures = {}
+    self.requests = []
+    self.lock = threading.Lock()
+    site = self
+
+    class Handler(BaseHTTPRequestHandler):
+      def do_GET(self):
+        with site.lock:
+          site.requests.append((self.path, time.monotonic()))
+          failures = site.failures.get(self.path)
+          status = failures.pop(0) if failures else None
+        if status is not None:
+          self.send_response(status)
+          if status == 429:
+            self.send_header("Retry-After", "0")
+          self.send_header("Content-Length", "0")
+          self.end_headers()
+          return
+        page = site.pages.get(self.path)
+        if page is None:
+          self.send_error(404)
+          return
+        body = page.encode("utf-8")
+        self.send_response(200)
+        # No charset, like bb-ref, so the fetcher has to decode it as UTF-8 itself
+        self.send_header("Content-Type", "text/html")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+      def log_message(self, *args):
+        pass
+
+    self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    self.url = "http://127.0.0.1:{}".format(self.server.server_address[1])
+    self.thread = threading.Thread(target=self.server.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True)
+    self.thread.start()
+
+  def hits(self, path):
+    return sum(1 for p, _ in self.requests if p == path)
+
+  def close(self):
+    self.server.shutdown()
+    self.server.server_close()
+
+@pytest.fixture
+def site():
+  site = Site()
+  yield site
+  site.close()
@@ -0,0 +1,62 @@
+"""
+The fetch engine of data/bb_ref.py against a local server (see conftest.py), offline.
+
+Run from the repo root:
+
+python -m pytest tests
+"""
+
+import pytest
+import requests
+from data.bb_ref import Fetcher, ResponseCache, OfflineCacheMiss
+
+def make_fetcher(site, tmp_path, **kwargs):
+  options = dict(base_url=site.url, max_workers=4, rate=0, max_retries=3, backoff=0.01, cache=ResponseCache(str(tmp_path)), ttl=-1)
+  options.update(kwargs)
+  return Fetcher(**options)
+
+def test_fetch_returns_the_page_and_caches_it(site, tmp_path):
+  site.pages["/players/j/jokicni01.html"] = "<h1>Nikola Jokić</h1>"
+  fetcher = make_fetcher(site, tmp_path)
+  assert fetcher.get("/players/j/jokicni01.html") == "<h1>Nikola Jokić</h1>"
+  assert fetcher.get("/players/j/jokicni01.html") == "<h1>Nikola Jokić</h1>"
+  assert site.hits("/players/j/jokicni01.html") == 1
+
+@pytest.mark.parametrize("statuses", [[503], [500, 502], [429], [429, 504, 503]])
+def test_retries_on_429_and_5xx(site, tmp_path, statuses):
+  site.pages["/page.html"] = "page"
+  site.failures["/page.html"] = list(statuses)
+  assert make_fetcher(site, tmp_path).get("/page.html") == "page"
+  assert site.hits("/page.html") == len(statuses) + 1
+
+def test_gives_up_after_max_retries(site, tmp_path):
+  site.pages["/page.html"] = "page"
+  site.failures["/page.html"] = [503]*10
+  with pytest.raises(requests.HTTPError):
+    make_fetcher(site, tmp_path, max_retries=2).get("/page.html")
+  assert site.hits("/page.html") == 3
+
+def test_does_not_retry_other_errors(site, tmp_path):
+  with pytest.raises(requests.HTTPError):
+    make_fetcher(site, tmp_path).get("/missing.html")
+  assert site.hits("/missing.html") == 1
+
+def test_rate_limit_is_shared_by_all_workers(site, tmp_path):
+  paths = ["/page{}.html".format(i) for i in range(11)]
+  for path in paths:
+    site.pages[path] = path
+  fetcher = make_fetcher(site, tmp_path, rate=20)
+  assert fetcher.map(fetcher.get, paths) == paths
+  # 11 requests at 20 per second are spread over at least 0.5 s, whatever the number of workers
+  times = sorted(t for _, t in site.requests)
+  assert times[-1] - times[0] >= 0.45
+
+def test_offline_only_reads_the_cache(site, tmp_path):
+  site.pages["/page.html"] = "page"
+  cache = ResponseCache(str(tmp_path))
+  make_fetcher(site, tmp_path, cache=cache).get("/page.html")
+  offline = make_fetcher(site, tmp_path, cache=cache, offline=True)
+  assert offline.get("/page.html") == "page"
+  with pytest.raises(OfflineCacheMiss):
+    offline.get("/other.html")
+  assert site.hits("/other.html") == 0
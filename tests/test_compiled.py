@@ -0,0 +1,60 @@
+"""
+Saved compiled models and cached predictions go stale with the version of compiled.py.
+
+Run from the repo root:
+
+python -m pytest tests
+"""
+
+import numpy as np
+import pytest
+from joblib import dump
+from sklearn.neural_network import MLPClassifier
+import compiled
+import registry
+import season_cache
+
+@pytest.fixture
+def models_dir(tmp_path, monkeypatch):
+  monkeypatch.setattr(registry, "MODELS_DIR", str(tmp_path))
+  caches = (registry._models, registry._loaded_mtimes, registry._compiled, registry._compiled_mtimes)
+  for cache in caches:
+    cache.clear()
+  rng = np.random.RandomState(0)
+  X = rng.normal(size=(60, 4))
+  model = MLPClassifier(hidden_layer_sizes=(5,), max_iter=50, random_state=0).fit(X, X[:, 0] > 0)
+  dump(model, registry.full_path("nn"))
+  yield X, model
+  for cache in caches:
+    cache.clear()
+
+def test_saved_model_of_this_version_is_loaded(models_dir):
+  X, model = models_dir
+  compiled.save(compiled.compile_model(model), registry.compiled_path("nn"))
+  assert compiled.load(registry.compiled_path("nn")).predict_proba(X) == pytest.approx(model.predict_proba(X), abs=compiled.TOLERANCE)
+
+@pytest.mark.parametrize("version", [None, "0"*64])
+def test_saved_model_of_another_version_is_compiled_again(models_dir, version):
+  X, model = models_dir
+  # Stale arrays, the way a change to how models are compiled would leave them
+  arrays = {key: value*2 if value.dtype.kind == "f" else value for key, value in compiled.compile_model(model).arrays.items()}
+  if version is not None:
+    arrays["version"] = np.array(version)
+  with open(registry.compiled_path("nn"), "wb") as f:
+    np.savez(f, kind=np.array("mlp"), **arrays)
+  assert compiled.load(registry.compiled_path("nn")) is None
+
+  loaded = registry.get_compiled_model("nn")
+  assert loaded.predict_proba(X) == pytest.approx(model.predict_proba(X), abs=compiled.TOLERANCE)
+  # And written again with this version
+  assert compiled.load(registry.compiled_path("nn")) is not None
+
+def test_season_key_changes_with_the_compiled_version(models_dir, tmp_path, monkeypatch):
+  raw_dir = tmp_path / "raw"
+  raw_dir.mkdir()
+  (raw_dir / "2019.json").write_text("{}")
+  monkeypatch.setattr(season_cache, "RAW_DIR", str(raw_dir))
+  key = season_cache.season_key(2019, ["nn"])
+  assert season_cache.season_key(2019, ["nn"]) == key
+  monkeypatch.setattr(season_cache, "COMPILED_VERSION", "0"*64)
+  assert season_cache.season_key(2019, ["nn"]) != key
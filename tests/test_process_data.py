@@ -0,0 +1,27 @@
+"""
+data/process_data.py rebuilds the committed data/processed csv files byte for byte.
+
+Run from the repo root:
+
+python -m pytest tests
+"""
+
+import os
+import json
+import pytest
+from data import process_data
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data")
+
+@pytest.mark.parametrize("year", process_data.SEASONS)
+def test_rebuild_matches_the_committed_csv(year, tmp_path, monkeypatch):
+  (tmp_path / "processed").mkdir()
+  os.symlink(os.path.join(DATA_DIR, "raw"), str(tmp_path / "raw"))
+  monkeypatch.chdir(tmp_path)
+  _, raw_hash, processed_hash = process_data.process_season(year)
+
+  with open(os.path.join(DATA_DIR, "processed", "manifest.json")) as fp:
+    entry = json.load(fp)[str(year)]
+  assert (raw_hash, processed_hash) == (entry["raw"], entry["processed"])
+  with open(os.path.join(DATA_DIR, "processed", "{}.csv".format(year)), "rb") as committed, open(tmp_path / "processed" / "{}.csv".format(year), "rb") as rebuilt:
+    assert rebuilt.read() == committed.read()
@@ -0,0 +1,132 @@
+"""
+data/scrap.py, full and --delta, against fixture pages (benchmarks/fixtures.py) on a local server, offline.
+
+Run from the repo root:
+
+python -m pytest tests
+"""
+
+import os
+import sys
+import json
+import copy
+import subprocess
+import pytest
+from benchmarks import fixtures
+from feature_store import raw_files_signature, open_store, season_rows
+from player_db import open_db
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SEASON = 2019
+NUM_PLAYERS = 6
+# Games played after the All-Star game, on the totals page but not in the pre-ASG splits
+POST_ASG_GAMES = 5
+
+def splits_path(p):
+  return "/players/{}/{}/splits/{}".format(p[0], p, SEASON)
+
+def info_path(p):
+  return "/players/{}/{}.html".format(p[0], p)
+
+class Season:
+  def __init__(self, site, tmp_path, monkeypatch):
+    # The standings are read on the All-Star date of scrap.py's ASG_DATES
+    monkeypatch.setattr(fixtures, "STANDINGS_DATE", "Feb 17, {}")
+    self.site = site
+    self.dir = tmp_path / "data"
+    (self.dir / "raw").mkdir(parents=True)
+    self.cache_dir = tmp_path / "cache"
+    self.players = fixtures.load_season(SEASON, NUM_PLAYERS)
+    self.ids = sorted(self.players)
+    # The last player's splits have no pre-ASG row
+    self.skipped = self.ids[-1]
+    self.totals = {p: int(self.players[p]["stats"]["g"]) + POST_ASG_GAMES for p in self.ids}
+    self.render()
+
+  def render(self):
+    pages = fixtures.render_season(self.players, SEASON)
+    pre = '<td class="left " data-stat="split_value">Pre</td>'
+    pages[splits_path(self.skipped)] = pages[splits_path(self.skipped)].replace(pre, '<td class="left " data-stat="split_value">Post</td>')
+    totals = copy.deepcopy(self.players)
+    for p in self.ids:
+      totals[p]["stats"]["g"] = self.totals[p]
+    pages["/leagues/NBA_{}_totals.html".format(SEASON)] = fixtures.totals_page(totals, SEASON)
+    self.site.pages.update(pages)
+
+  def scrap(self, *args):
+    self.site.requests.clear()
+    env = dict(os.environ, BB_REF_BASE_URL=self.site.url, BB_REF_CACHE_DIR=str(self.cache_dir), BB_REF_RATE="0", BB_REF_CACHE_TTL="0", BB_REF_WORKERS="2")
+    subprocess.run([sys.executable, os.path.join(ROOT, "data", "scrap.py"), str(SEASON)] + list(args), cwd=str(self.dir), env=env, check=True, stdout=subprocess.DEVNULL)
+
+  def raw(self):
+    with open(self.dir / "raw" / "{}.json".format(SEASON)) as fp:
+      return json.load(fp)
+
+  def fetched(self):
+    # Players whose splits were requested in the last scrape
+    return sorted(p for p in self.ids if self.site.hits(splits_path(p)))
+
+@pytest.fixture
+def season(site, tmp_path, monkeypatch):
+  return Season(site, tmp_path, monkeypatch)
+
+def test_full_scrape_keeps_the_totals_games_and_the_skipped_players(season):
+  season.scrap()
+  raw = season.raw()
+  assert sorted(raw) == season.ids[:-1]
+  for p, data in raw.items():
+    assert data["scraped_g"] == season.totals[p]
+    assert data["stats"]["g"] == season.players[p]["stats"]["g"]
+  with open(season.dir / "skipped" / "{}.json".format(SEASON)) as fp:
+    assert json.load(fp) == {season.skipped: season.totals[season.skipped]}
+  # Nothing but the seasons in raw/
+  assert os.listdir(season.dir / "raw") == ["{}.json".format(SEASON)]
+
+def test_delta_only_fetches_the_players_who_played(season):
+  season.scrap()
+  before = season.raw()
+
+  # Nobody played: the post-ASG games and the skipped player do not make anyone be fetched again
+  season.scrap("--delta")
+  assert season.fetched() == []
+  assert season.raw() == before
+
+  played = [season.ids[0], season.skipped]
+  for p in played:
+    season.totals[p] += 1
+  season.render()
+  season.scrap("--delta")
+  assert season.fetched() == sorted(played)
+  raw = season.raw()
+  assert raw[season.ids[0]]["scraped_g"] == season.totals[season.ids[0]]
+  assert {p: data for p, data in raw.items() if p != season.ids[0]} == {p: data for p, data in before.items() if p != season.ids[0]}
+  with open(season.dir / "skipped" / "{}.json".format(SEASON)) as fp:
+    assert json.load(fp) == {season.skipped: season.totals[season.skipped]}
+
+def test_delta_fetches_players_scraped_without_scraped_g_once(season):
+  season.scrap()
+  raw = season.raw()
+  for data in raw.values():
+    del data["scraped_g"]
+  with open(season.dir / "raw" / "{}.json".format(SEASON), "w") as fp:
+    json.dump(raw, fp)
+  season.scrap("--delta")
+  assert season.fetched() == season.ids[:-1]
+  season.scrap("--delta")
+  assert season.fetched() == []
+
+def test_store_and_db_skip_files_that_are_not_seasons(tmp_path):
+  raw_dir = tmp_path / "raw"
+  raw_dir.mkdir()
+  with open(raw_dir / "{}.json".format(SEASON), "w") as fp:
+    json.dump(fixtures.load_season(SEASON, NUM_PLAYERS), fp)
+  (raw_dir / "{}.skipped.json".format(SEASON)).write_text("{}")
+  (raw_dir / "notes.json").write_text("{}")
+  assert list(raw_files_signature(str(raw_dir))) == ["{}.json".format(SEASON)]
+
+  store = open_store(str(raw_dir), str(tmp_path / "store"))
+  assert list(store["meta"]["seasons"]) == [str(SEASON)]
+  assert len(store["player_id"][season_rows(store, SEASON)]) == NUM_PLAYERS
+  conn = open_db(str(raw_dir), str(tmp_path / "players.sqlite"))
+  assert conn.execute("SELECT COUNT(*) FROM players WHERE season = ?", (SEASON,)).fetchone()[0] == NUM_PLAYERS
+  conn.close()
@@ -0,0 +1,65 @@
+"""
+Run from the repo root:
+
+python -m pytest tests
+"""
+
+import os
+import sys
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import train
+from data.features import FEATURES
+
+ROWS_PER_SEASON = 3
+
+def make_store():
+  # ROWS_PER_SEASON players per season, the season in the first feature so rows can be traced back
+  seasons = {}
+  features, all_star = [], []
+  for i, season in enumerate(train.SEASONS):
+    seasons[str(season)] = [i*ROWS_PER_SEASON, (i + 1)*ROWS_PER_SEASON]
+    for j in range(ROWS_PER_SEASON):
+      features.append([season] + [0]*(len(FEATURES) - 1))
+      all_star.append(1 if j == 0 else 0)
+  return {
+    "meta": {"seasons": seasons},
+    "features": np.array(features, dtype=np.float32),
+    "all_star": np.array(all_star, dtype=np.float64)
+  }
+
+def test_load_data_splits_on_the_test_seasons():
+  train_X, train_Y, test_X, test_Y = train.load_data(store=make_store())
+  tested = train.test_seasons()
+  assert sorted(set(test_X[:, 0].astype(int))) == sorted(tested)
+  assert not set(train_X[:, 0].astype(int)) & set(tested)
+  assert len(train_X) + len(test_X) == len(train.SEASONS)*ROWS_PER_SEASON
+  assert train_Y.shape == (len(train_X), 1) and test_Y.shape == (len(test_X), 1)
+
+def test_load_data_returns_the_training_seasons():
+  train_X, train_Y, test_X, test_Y, train_season_ids = train.load_data(store=make_store(), return_seasons=True)
+  assert (train_season_ids == train_X[:, 0]).all()
+  assert len(train_season_ids) == len(train_X)
+
+def test_test_seasons_match_the_seeded_draw():
+  # The same draw as random.sample right after random.seed(6969), which load_data used to make
+  import random
+  random.seed(6969)
+  indices = random.sample(range(len(train.SEASONS)), int(len(train.SEASONS)*0.15))
+  assert train.test_seasons() == [train.SEASONS[i] for i in indices]
+
+def test_accuracy_ci_brackets_the_accuracy():
+  rng = np.random.RandomState(0)
+  test_Y = rng.randint(2, size=2000)
+  pred_Y = np.where(rng.uniform(size=2000) < 0.9, test_Y, 1 - test_Y)
+  low, high = train.accuracy_ci(test_Y, pred_Y)
+  accuracy = (test_Y == pred_Y).mean()
+  assert low < accuracy < high
+  # The binomial standard error is about 0.0067 here, the 95% interval about 4 of them wide
+  assert 0.02 < high - low < 0.033
+  assert train.accuracy_ci(test_Y, pred_Y) == [low, high]
+  scores = train.get_scores(test_Y.reshape(-1, 1), pred_Y, pred_Y.astype(float))
+  assert scores["test_acc_ci"] == [low, high]
+  assert set(scores) == {"test_acc", "test_acc_ci", "recall", "precision", "f1", "roc_auc"}
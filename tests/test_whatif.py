@@ -0,0 +1,82 @@
+"""
+Run from the repo root:
+
+python -m pytest tests
+"""
+
+import os
+import sys
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from data.features import FEATURES
+from predict import predict_all_star_prob_for_season, get_all_star_predictions
+from whatif import WhatIf, FEATURE_INDEX
+
+SEASON = 2020
+NUM_PLAYERS = 40
+
+class PointsModel:
+  # Probability grows with pts_per_g, so what-ifs on it move players in a known direction
+  def predict_proba(self, x):
+    prob = 1/(1 + np.exp(-(np.asarray(x, dtype=np.float64)[:, FEATURE_INDEX["pts_per_g"]] - 20)/3))
+    return np.column_stack([1 - prob, prob])
+
+def make_store():
+  rng = np.random.default_rng(6969)
+  features = np.zeros((NUM_PLAYERS, len(FEATURES)), dtype=np.float32)
+  features[:, FEATURE_INDEX["pts_per_g"]] = rng.uniform(5, 30, NUM_PLAYERS)
+  return {
+    "meta": {"seasons": {str(SEASON): [0, NUM_PLAYERS]}},
+    "features": features,
+    "player_id": np.array(["p{}".format(i) for i in range(NUM_PLAYERS)]),
+    "name": np.array(["Player {}".format(i) for i in range(NUM_PLAYERS)]),
+    "position": np.array([["PG", "SG", "SF", "PF", "C"][i % 5] for i in range(NUM_PLAYERS)]),
+    "conference": np.array(["East" if i % 2 else "West" for i in range(NUM_PLAYERS)])
+  }
+
+def full_rerun(whatif, store, models):
+  # The whole season scored again with the what-if's stats, the path WhatIf stands in for
+  store = dict(store, features=whatif.x)
+  prob_list = predict_all_star_prob_for_season(models, SEASON, store)
+  return prob_list, get_all_star_predictions(prob_list)
+
+def test_update_matches_full_rerun():
+  store, models = make_store(), [PointsModel()]
+  whatif = WhatIf(SEASON, models, store)
+  whatif.update({"p3": {"pts_per_g": "+10"}, "p8": {"pts_per_g": 2}})
+  prob_list, rosters = full_rerun(whatif, store, models)
+  assert whatif.prob_list() == prob_list
+  assert whatif.roster() == rosters
+
+@pytest.mark.parametrize("changes", [
+  {"p3": {"pts_per_g": 30, "bogus": 1}},
+  {"p3": {"pts_per_g": 30, "ast_per_g": "lots"}},
+  {"p3": {"pts_per_g": "nan"}},
+  {"p3": {"pts_per_g": "inf"}},
+  {"p3": {"pts_per_g": 1e39}},
+  {"p3": {"pts_per_g": 30}, "nobody": {"pts_per_g": 1}}
+])
+def test_rejected_update_changes_nothing(changes):
+  store, models = make_store(), [PointsModel()]
+  whatif = WhatIf(SEASON, models, store)
+  before = whatif.prob_list()
+  with pytest.raises(ValueError):
+    whatif.update(changes)
+  np.testing.assert_array_equal(whatif.x, store["features"])
+  assert not whatif.modified
+  assert whatif.prob_list() == before
+  # A no-op change after it still sees the season as it is
+  diff = whatif.update({"p3": {"pts_per_g": "+0"}})
+  assert diff["players"][0][4] == diff["players"][0][5]
+  assert not diff["added"] and not diff["removed"]
+
+def test_reset_restores_the_season():
+  store, models = make_store(), [PointsModel()]
+  whatif = WhatIf(SEASON, models, store)
+  before = (whatif.prob_list(), whatif.roster())
+  whatif.update({"p3": {"pts_per_g": 40}, "p4": {"pts_per_g": "-20"}})
+  whatif.reset()
+  assert (whatif.prob_list(), whatif.roster()) == before
@@ -1,15 +1,22 @@
 import random
 import time
 import json
+import argparse
+from functools import partial
 import numpy as np
 from joblib import dump
 from sklearn import svm, metrics
-from sklearn.model_selection import GridSearchCV, cross_val_score
+from sklearn.model_selection import GridSearchCV, ParameterGrid
 from sklearn.tree import DecisionTreeClassifier
 from sklearn.ensemble import RandomForestClassifier, AdaBoostClassifier
 from sklearn.neural_network import MLPClassifier
+from sklearn.calibration import CalibratedClassifierCV
 from imblearn.over_sampling import SMOTE
 from imblearn.pipeline import Pipeline
+from feature_store import open_store, season_rows
+from search import staged_groups, staged_grid_search, kernel_groups, kernel_grid_search, fold_grid_search
+from fit_cache import FitCache
+from data import tracing
 
 """
 Set seed for reproducible results
@@ -17,52 +24,51 @@ Set seed for reproducible results
 np.random.seed(6969)
 random.seed(6969)
 
+SEASONS = [season for season in range(1985, 2020) if season != 1999]
+
+def test_seasons():
+  # The seasons load_data tests on, drawn the same way as random.sample right after random.seed(6969), so
+  # backtest.py can tell them apart from the ones the models were trained on
+  return [SEASONS[i] for i in random.Random(6969).sample(range(len(SEASONS)), int(len(SEASONS)*0.15))]
+
 """
 Training data set will be some subset of seasons.
 Testing data set will be the remaining seasons.
+With return_seasons, the season of every training row is returned as well.
 """
-def load_data(balance=False, oversample=True):
+@tracing.traced("load_data")
+def load_data(balance=False, oversample=True, store=None, return_seasons=False):
+  if store is None:
+    store = open_store()
   all_data = []
-  for season in range(1985, 2020):
-    if season == 1999:
-      continue
-    data = np.genfromtxt("./data/processed/" + str(season) + ".csv",delimiter=',',dtype=float)
-    all_data.append(data)
+  for season in SEASONS:
+    rows = season_rows(store, season)
+    all_data.append((store["features"][rows], store["all_star"][rows], season))
   
   all_index = range(len(all_data))
-  num_seasons_for_testing = int(len(all_data)*0.15)
-  test_season_indices = random.sample(all_index, num_seasons_for_testing)
+  test_season_indices = [SEASONS.index(season) for season in test_seasons()]
   train_season_indices = [i for i in all_index if not i in test_season_indices]
-  train_seasons = [all_data[i] for i in train_season_indices]
-  test_seasons = [all_data[i] for i in test_season_indices]
-  train_data = np.vstack(train_seasons)
-  test_data = np.vstack(test_seasons)
-  train_X = train_data[:,:-1].astype(float)
-  train_Y = train_data[:,-1].reshape(-1,1)
-  test_X = test_data[:,:-1].astype(float)
-  test_Y = test_data[:,-1].reshape(-1,1)
+  train_data = [all_data[i] for i in train_season_indices]
+  test_data = [all_data[i] for i in test_season_indices]
+  train_X = np.vstack([s[0] for s in train_data])
+  train_Y = np.concatenate([s[1] for s in train_data]).reshape(-1,1)
+  test_X = np.vstack([s[0] for s in test_data])
+  test_Y = np.concatenate([s[1] for s in test_data]).reshape(-1,1)
 
   train_X = np.nan_to_num(train_X)
   test_X = np.nan_to_num(test_X)
   
-  as_count = 0
-  non_count = 0
-  for y in train_Y:
-    if y == 0:
-      non_count += 1
-    else:
-      as_count +=1
+  as_count = int(np.count_nonzero(train_Y))
+  non_count = len(train_Y) - as_count
   print("Train dataset has: {} All-Stars, {} non All-Stars".format(non_count, as_count))
 
-  as_count = 0
-  non_count = 0
-  for y in test_Y:
-    if y == 0:
-      non_count += 1
-    else:
-      as_count +=1  
+  as_count = int(np.count_nonzero(test_Y))
+  non_count = len(test_Y) - as_count
   print("Test dataset has: {} All-Stars, {} non  All-Stars".format(non_count, as_count))
 
+  if return_seasons:
+    train_season_ids = np.concatenate([np.full(len(s[1]), s[2]) for s in train_data])
+    return train_X, train_Y, test_X, test_Y, train_season_ids
   return train_X, train_Y, test_X, test_Y
 
 def gen_graph(results, key, x_label, y_label, filename):
@@ -121,111 +127,194 @@ def gen_table(results, widths, filename):
   plt.savefig("./figures/{}".format(filename))
   plt.close()
 
-def gen_confusion_matrix(model, test_X, test_Y, title, filename):
+def gen_confusion_matrix(confusion_matrix, labels, title, filename):
   import matplotlib.pyplot as plt
   np.set_printoptions(suppress=True)
-  disp = metrics.plot_confusion_matrix(model, test_X, test_Y, cmap=plt.cm.Blues, normalize=None)
+  disp = metrics.ConfusionMatrixDisplay(confusion_matrix, display_labels=labels).plot(cmap=plt.cm.Blues)
   disp.ax_.set_title("Confusion Matrix: {}".format(title))
   plt.savefig("./figures/{}".format(filename))
   plt.close()
 
-def run_svm_grid_search(train_X, train_Y, test_X, test_Y, model_name):
-  start = time.time()
+"""
+Figures are rendered by a background process once figures.start() is called, so training does not wait on
+matplotlib. With figures.enabled = False (--headless) they are not rendered at all, and without start() they
+are rendered inline.
+"""
+def init_figure_worker():
+  import matplotlib
+  matplotlib.use("Agg")
+
+def render_figure(gen_fn, *args):
+  with tracing.span("render", figure=gen_fn.__name__):
+    gen_fn(*args)
+
+class FigureRenderer:
+  def __init__(self):
+    self.enabled = True
+    self.pool = None
+    self.futures = []
+
+  def start(self):
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    self.pool = ProcessPoolExecutor(1, mp_context=multiprocessing.get_context("spawn"), initializer=init_figure_worker)
+
+  def render(self, gen_fn, *args):
+    if not self.enabled:
+      return
+    if self.pool is None:
+      render_figure(gen_fn, *args)
+      return
+    self.futures.append(self.pool.submit(render_figure, gen_fn, *args))
+
+  def close(self):
+    # Wait for the figures still being rendered, and surface any error from them
+    for future in self.futures:
+      future.result()
+    self.futures = []
+    if self.pool is not None:
+      self.pool.shutdown()
+      self.pool = None
+
+figures = FigureRenderer()
 
-  param_grid = {
-    'C': [0.1, 1, 10, 100, 1000],  
-    'gamma': [1, 0.1, 0.01, 0.001, 0.0001]
-  }
-    
-  grid = GridSearchCV(
-    svm.SVC(random_state=6969, kernel="rbf", probability=True), 
-    param_grid, 
-    refit=True, 
-    cv=3, 
-    verbose=3, 
-    n_jobs=-1
-  )
-
-  # fitting the model for grid search 
-  grid.fit(train_X, train_Y.ravel())
+"""
+Each model family is searched in stages. A family is written as a generator that yields one search at a time,
+as (estimator, param_grid, refit), and is sent back the fitted GridSearchCV of that search, so a later stage can
+use the best params of an earlier one. It returns the list of all its fitted searches, the last one being the
+model that gets saved. run_searches() drives a family on its own with GridSearchCV; orchestrate.py drives all
+of them at once on a shared worker pool.
+
+refit is True or False like GridSearchCV's, or a function refit(model, X, y) that builds the saved model from
+the unfitted best candidate. The SVM uses that to only calibrate its probabilities once: sklearn's
+SVC(probability=True) runs its own 5-fold cross-validation for Platt scaling inside every fit, 6 times the
+work, for probabilities the search never looks at since it scores on accuracy. So the search fits plain SVCs,
+and the best one is refit on the training seasons except CALIBRATION_SEASONS held out ones, on which a sigmoid
+is fit to its decision function. The saved model is a CalibratedClassifierCV, with the predict_proba that
+predict.py needs. Every family is passed held_out, the mask of the training rows of those seasons, or None to
+search SVC(probability=True) like before (--platt-cv).
+"""
+SVM_PARAM_GRID = {
+  'C': [0.1, 1, 10, 100, 1000],  
+  'gamma': [1, 0.1, 0.01, 0.001, 0.0001]
+}
+
+ABC_PARAM_GRID = {
+  'n_estimators': [10, 100, 500, 1000],
+  'learning_rate': [0.1, 0.01, 0.001]
+}
+
+ABC_DEPTH_GRID = {
+  'base_estimator__max_depth': [1, 2, 5, 8, 10, 15]
+}
+
+NN_PARAM_GRID = {
+  'learning_rate_init': [0.1, 0.01, 0.001, 0.0001]
+}
+
+NN_LAYERS_GRID = {
+  'hidden_layer_sizes': [(50, 50, 50), (100, 100, 100), (200, 200, 200), (300, 300, 300), (50, 50, 50, 50), (100, 100, 100, 100), (200, 200, 200, 200), (300, 300, 300, 300)]
+}
+
+CALIBRATION_SEASONS = 4
+
+def held_out_rows(train_season_ids, num_seasons=CALIBRATION_SEASONS):
+  seasons = np.random.RandomState(6969).choice(np.unique(train_season_ids), num_seasons, replace=False)
+  return np.isin(train_season_ids, seasons)
+
+def calibrate_on_held_out(model, X, y, held_out):
+  model.fit(X[~held_out], y[~held_out])
+  return CalibratedClassifierCV(base_estimator=model, cv="prefit", method="sigmoid").fit(X[held_out], y[held_out])
+
+def svm_searches(held_out=None):
+  if held_out is None:
+    grid = yield svm.SVC(random_state=6969, kernel="rbf", probability=True), SVM_PARAM_GRID, True
+  else:
+    grid = yield svm.SVC(random_state=6969, kernel="rbf"), SVM_PARAM_GRID, partial(calibrate_on_held_out, held_out=held_out)
+  return [grid]
+
+def abc_searches(held_out=None):
+  # The first stage only picks n_estimators and learning_rate, its best model is never used so it is not refit
+  grid = yield AdaBoostClassifier(random_state=6969, base_estimator=DecisionTreeClassifier(max_depth=5)), ABC_PARAM_GRID, False
+
+  depth_grid = yield AdaBoostClassifier(
+    random_state=6969, 
+    base_estimator=DecisionTreeClassifier(),
+    n_estimators=grid.best_params_["n_estimators"], 
+    learning_rate=grid.best_params_["learning_rate"]
+  ), ABC_DEPTH_GRID, True
+  return [grid, depth_grid]
+
+def nn_searches(held_out=None):
+  grid = yield MLPClassifier(random_state=6969, max_iter=1000), NN_PARAM_GRID, False
+
+  layers_grid = yield MLPClassifier(random_state=6969, max_iter=1000, learning_rate_init=grid.best_params_["learning_rate_init"]), NN_LAYERS_GRID, True
+  return [grid, layers_grid]
+
+def grid_search(estimator, param_grid, refit, train_X, train_Y, cache=None):
+  candidates = list(ParameterGrid(param_grid))
+  if staged_groups(estimator, candidates):
+    # Only the largest AdaBoost ensemble is fit, the smaller ones are scored from its staged predictions
+    return staged_grid_search(estimator, param_grid, refit, train_X, train_Y.ravel(), n_jobs=-1, verbose=3, cache=cache)
+  if kernel_groups(estimator, candidates, len(train_X)):
+    # The RBF kernel of each gamma is computed once per fold and shared by all of its C values
+    return kernel_grid_search(estimator, param_grid, refit, train_X, train_Y.ravel(), n_jobs=-1, verbose=3, cache=cache)
+
+  # The same fits as GridSearchCV(cv=3), one by one so each can come from the fit cache
+  return fold_grid_search(estimator, param_grid, refit, train_X, train_Y.ravel(), n_jobs=-1, verbose=3, cache=cache)
+
+def run_searches(searches, train_X, train_Y, make_search=grid_search):
+  start = time.time()
+  try:
+    estimator, param_grid, refit = next(searches)
+    while True:
+      with tracing.span("search", estimator=type(estimator).__name__, candidates=len(ParameterGrid(param_grid))):
+        grid = make_search(estimator, param_grid, refit, train_X, train_Y)
+      estimator, param_grid, refit = searches.send(grid)
+  except StopIteration as e:
+    grids = e.value
 
   end = time.time()
   elapsed = round(end - start, 3)
+  return grids, elapsed
 
-  pred_Y = grid.predict(test_X)
+def report_svm(grids, test_X, test_Y, model_name):
+  grid = grids[0]
+
+  pred_Y, prob_Y = predict_test_set(grid, test_X)
   print(metrics.classification_report(test_Y, pred_Y))
 
   # plot the table
-  gen_table(grid.cv_results_, [0.2, 0.2, 0.3, 0.45], "svm_table.png")
+  figures.render(gen_table, grid.cv_results_, [0.2, 0.2, 0.3, 0.45], "svm_table.png")
 
   # save the model
   dump(grid, './models/{}.joblib'.format(model_name)) 
 
   # get scores
-  scores = get_scores(grid, test_X, test_Y)
+  scores = get_scores(test_Y, pred_Y, prob_Y)
 
   # confusion matrix
-  gen_confusion_matrix(grid, test_X, test_Y, "SVM", "svm_cm")
+  figures.render(gen_confusion_matrix, metrics.confusion_matrix(test_Y, pred_Y), grid.classes_, "SVM", "svm_cm")
 
-  return grid.best_params_, scores, elapsed
-  
-def run_adaboost_grid_search(train_X, train_Y, test_X, test_Y, model_name): 
-  start = time.time()
-  best_params = {}
-
-  param_grid = {
-    'n_estimators': [10, 100, 500, 1000],
-    'learning_rate': [0.1, 0.01, 0.001]
-  }
-    
-  grid = GridSearchCV(
-    AdaBoostClassifier(random_state=6969, base_estimator=DecisionTreeClassifier(max_depth=5)), 
-    param_grid, 
-    refit=True, cv=3, verbose=3, n_jobs=-1
-  )
-
-  # fitting the model for grid search  
-  grid.fit(train_X, train_Y.ravel())
-  best_n_estimators = grid.best_params_["n_estimators"]
-  best_learning_rate = grid.best_params_["learning_rate"]
+  return grid.best_params_, scores
 
-  end = time.time()
-  elapsed1 = round(end - start, 3)
+def report_abc(grids, test_X, test_Y, model_name):
+  best_params = {}
+  grid = grids[0]
 
   # plot the table
-  gen_table(grid.cv_results_, [0.2, 0.2, 0.3, 0.45], "abc_table.png")
+  figures.render(gen_table, grid.cv_results_, [0.2, 0.2, 0.3, 0.45], "abc_table.png")
 
   # update best params
   best_params.update(grid.best_params_)
 
-  start = time.time()
-
-  param_grid = {
-    'base_estimator__max_depth': [1, 2, 5, 8, 10, 15]
-  }
-
-  grid = GridSearchCV(
-    AdaBoostClassifier(
-      random_state=6969, 
-      base_estimator=DecisionTreeClassifier(),
-      n_estimators=best_n_estimators, 
-      learning_rate=best_learning_rate
-    ), 
-    param_grid, 
-    refit=True, cv=3, verbose=3, n_jobs=-1
-  )
-    
-  # fitting the model for grid search 
-  grid.fit(train_X, train_Y.ravel())
-
-  end = time.time()
-  elapsed2 = round(end - start, 3)
+  grid = grids[1]
 
-  pred_Y = grid.predict(test_X)
+  pred_Y, prob_Y = predict_test_set(grid, test_X)
   print(metrics.classification_report(test_Y, pred_Y))
 
   # plot the graph
-  gen_graph(grid.cv_results_, "base_estimator__max_depth", "Max Depth of Tree", "Cross Validation Score (Accuracy)", "abc_graph.png")
+  figures.render(gen_graph, grid.cv_results_, "base_estimator__max_depth", "Max Depth of Tree", "Cross Validation Score (Accuracy)", "abc_graph.png")
 
   # update best params
   best_params.update(grid.best_params_)
@@ -234,66 +323,30 @@ def run_adaboost_grid_search(train_X, train_Y, test_X, test_Y, model_name):
   dump(grid, './models/{}.joblib'.format(model_name)) 
 
   # get scores
-  scores = get_scores(grid, test_X, test_Y)
+  scores = get_scores(test_Y, pred_Y, prob_Y)
 
   # confusion matrix
-  gen_confusion_matrix(grid, test_X, test_Y, "Decision Trees with AdaBoost", "abc_cm")
+  figures.render(gen_confusion_matrix, metrics.confusion_matrix(test_Y, pred_Y), grid.classes_, "Decision Trees with AdaBoost", "abc_cm")
 
-  return best_params, scores, elapsed1 + elapsed2
-
-def run_nn_grid_search(train_X, train_Y, test_X, test_Y, model_name):
-  start = time.time()
+  return best_params, scores
 
+def report_nn(grids, test_X, test_Y, model_name):
   best_params = {}
-
-  hidden_layers = [(50, 50, 50), (100, 100, 100), (200, 200, 200), (300, 300, 300), (50, 50, 50, 50), (100, 100, 100, 100), (200, 200, 200, 200), (300, 300, 300, 300)]
-
-  param_grid = {
-    'learning_rate_init': [0.1, 0.01, 0.001, 0.0001]
-  }
-
-  grid = GridSearchCV(
-    MLPClassifier(random_state=6969, max_iter=1000), 
-    param_grid, 
-    refit=True, cv=3, verbose=3, n_jobs=-1
-  )
-  
-  # fitting the model for grid search  
-  grid.fit(train_X, train_Y.ravel())
-  best_learning_rate_init = grid.best_params_["learning_rate_init"]
-
-  end = time.time()
-  elapsed1 = round(end - start, 3)
+  grid = grids[0]
 
   # plot the graph
-  gen_graph(grid.cv_results_, "learning_rate_init", "Learning Rate", "Cross Validation Score (Accuracy)", "nn_graph.png")
+  figures.render(gen_graph, grid.cv_results_, "learning_rate_init", "Learning Rate", "Cross Validation Score (Accuracy)", "nn_graph.png")
 
   # update best params
   best_params.update(grid.best_params_)
 
-  start = time.time()
-
-  param_grid = {
-    'hidden_layer_sizes': hidden_layers
-  }
-
-  grid = GridSearchCV(
-    MLPClassifier(random_state=6969, max_iter=1000, learning_rate_init=best_learning_rate_init), 
-    param_grid, 
-    refit=True, cv=3, verbose=3, n_jobs=-1
-  )
-  
-  # fitting the model for grid search 
-  grid.fit(train_X, train_Y.ravel())
-
-  end = time.time()
-  elapsed2 = round(end - start, 3)
+  grid = grids[1]
 
-  pred_Y = grid.predict(test_X)
+  pred_Y, prob_Y = predict_test_set(grid, test_X)
   print(metrics.classification_report(test_Y, pred_Y))
 
   # plot the table
-  gen_table(grid.cv_results_, [0.3, 0.3, 0.45], "nn_table.png")
+  figures.render(gen_table, grid.cv_results_, [0.3, 0.3, 0.45], "nn_table.png")
 
   # update best params
   best_params.update(grid.best_params_)
@@ -302,61 +355,144 @@ def run_nn_grid_search(train_X, train_Y, test_X, test_Y, model_name):
   dump(grid, './models/{}.joblib'.format(model_name)) 
 
   # get scores
-  scores = get_scores(grid, test_X, test_Y)
+  scores = get_scores(test_Y, pred_Y, prob_Y)
 
   # confusion matrix
-  gen_confusion_matrix(grid, test_X, test_Y, "Neural Networks", "nn_cm")
+  figures.render(gen_confusion_matrix, metrics.confusion_matrix(test_Y, pred_Y), grid.classes_, "Neural Networks", "nn_cm")
 
-  return best_params, scores, elapsed1 + elapsed2
+  return best_params, scores
 
-def get_scores(model, test_X, test_Y):
-  pred_Y = model.predict(test_X)
-  
+# Model families in the order they are trained and written to final_scores.json
+FAMILIES = {
+  "svm": (svm_searches, report_svm),
+  "abc": (abc_searches, report_abc),
+  "nn": (nn_searches, report_nn)
+}
+
+def run_grid_search(family, train_X, train_Y, test_X, test_Y, model_name, make_search=grid_search, held_out=None):
+  searches, report = FAMILIES[family]
+  with tracing.span("train", family=family):
+    grids, elapsed = run_searches(searches(held_out), train_X, train_Y, make_search)
+  with tracing.span("report", family=family):
+    best_params, scores = report(grids, test_X, test_Y, model_name)
+  return best_params, scores, elapsed
+
+def run_svm_grid_search(train_X, train_Y, test_X, test_Y, model_name):
+  return run_grid_search("svm", train_X, train_Y, test_X, test_Y, model_name)
+
+def run_adaboost_grid_search(train_X, train_Y, test_X, test_Y, model_name):
+  return run_grid_search("abc", train_X, train_Y, test_X, test_Y, model_name)
+
+def run_nn_grid_search(train_X, train_Y, test_X, test_Y, model_name):
+  return run_grid_search("nn", train_X, train_Y, test_X, test_Y, model_name)
+
+@tracing.traced("evaluate.predict")
+def predict_test_set(model, test_X):
+  # The only inference on the test set, every report, score and figure is derived from these
+  return model.predict(test_X), model.predict_proba(test_X)[:,1]
+
+BOOTSTRAP_SAMPLES = 1000
+
+def accuracy_ci(test_Y, pred_Y, num_samples=BOOTSTRAP_SAMPLES, seed=6969):
+  # 95% bootstrap interval of the test accuracy: the accuracy of num_samples resamples of the test rows, with
+  # replacement, from the same predictions
+  correct = np.asarray(test_Y).ravel() == np.asarray(pred_Y).ravel()
+  samples = np.random.RandomState(seed).randint(len(correct), size=(num_samples, len(correct)))
+  accuracies = correct[samples].mean(axis=1)
+  return [round(float(np.percentile(accuracies, 2.5)), 3), round(float(np.percentile(accuracies, 97.5)), 3)]
+
+@tracing.traced("evaluate.scores")
+def get_scores(test_Y, pred_Y, prob_Y):
+  test_Y = test_Y.ravel()
   test_acc = round(metrics.accuracy_score(test_Y, pred_Y), 3)
   recall = round(metrics.recall_score(test_Y, pred_Y), 3)
   precision = round(metrics.precision_score(test_Y, pred_Y), 3)
   f1 = round(metrics.f1_score(test_Y, pred_Y), 3)
-  cv_score = cross_val_score(model, test_X, test_Y.ravel(), cv=3, scoring="accuracy")
-  cv_score_mean = round(cv_score.mean(), 3)
-  cv_score_ci = round(cv_score.std()*2, 3)
+  roc_auc = round(metrics.roc_auc_score(test_Y, prob_Y), 3)
+
+  test_acc_ci = accuracy_ci(test_Y, pred_Y)
   
   return {
     "test_acc": test_acc,
+    "test_acc_ci": test_acc_ci,
     "recall": recall,
     "precision": precision,
     "f1": f1,
-    "cv_score_mean": cv_score_mean,
-    "cv_score_ci": cv_score_ci 
+    "roc_auc": roc_auc
   }
 
-train_X, train_Y, test_X, test_Y = load_data()
-
-results = {}
-
-model_name = "svm"
-best_params, scores, elapsed = run_svm_grid_search(train_X, train_Y, test_X, test_Y, model_name)
-results[model_name] = {
-  "params": best_params, 
-  "scores": scores,
-  "time": elapsed
-}
-
-model_name = "abc"
-best_params, scores, elapsed = run_adaboost_grid_search(train_X, train_Y, test_X, test_Y, model_name)
-results[model_name] = {
-  "params": best_params, 
-  "scores": scores,
-  "time": elapsed
-}
-
-model_name = "nn"
-best_params, scores, elapsed = run_nn_grid_search(train_X, train_Y, test_X, test_Y, model_name)
-results[model_name] = {
-  "params": best_params, 
-  "scores": scores,
-  "time": elapsed
-}
-
-# Write to file
-with open('final_scores.json', 'w') as fp:
-  json.dump(results, fp, sort_keys=True, indent=2, separators=(',', ': '))
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Grid search the SVM, AdaBoost and neural network models")
+  parser.add_argument("--jobs", type=int, default=None, help="worker processes shared by all fits (default: one per core)")
+  parser.add_argument("--sequential", action="store_true", help="search one model family after the other with GridSearchCV(n_jobs=-1)")
+  parser.add_argument("--fresh", action="store_true", help="ignore the checkpoints of an earlier, interrupted run")
+  parser.add_argument("--search", choices=["grid", "halving"], default="grid", help="exhaustive grid search, or successive halving (see halving.py)")
+  parser.add_argument("--factor", type=int, default=3, help="halving: only the best 1/factor of the candidates move on to the next iteration")
+  parser.add_argument("--max-fits", type=int, default=None, help="halving: budget of fits per search")
+  parser.add_argument("--max-time", type=float, default=None, help="halving: budget of seconds per search")
+  parser.add_argument("--platt-cv", action="store_true", help="search SVC(probability=True), with its internal cross-validation in every fit, instead of calibrating the best SVM on held out seasons")
+  parser.add_argument("--no-fit-cache", action="store_true", help="fit every candidate again instead of reusing the fits in cache/fits (see fit_cache.py)")
+  parser.add_argument("--headless", action="store_true", help="skip the tables, graphs and confusion matrices in figures/")
+  args = parser.parse_args()
+
+  if args.headless:
+    figures.enabled = False
+  else:
+    figures.start()
+
+  train_X, train_Y, test_X, test_Y, train_season_ids = load_data(return_seasons=True)
+  held_out = None if args.platt_cv else held_out_rows(train_season_ids)
+  fit_cache = None if args.no_fit_cache else FitCache()
+
+  results = {}
+
+  if args.search == "halving":
+    from halving import HalvingGridSearch
+
+    def halving_search(estimator, param_grid, refit, train_X, train_Y):
+      search = HalvingGridSearch(estimator, param_grid, factor=args.factor, cv=3, refit=refit, max_fits=args.max_fits, max_time=args.max_time, n_jobs=args.jobs or -1, verbose=1, cache=fit_cache)
+      return search.fit(train_X, train_Y.ravel())
+
+    # Each search already runs its fits in parallel, so the families are searched one after the other
+    for model_name in FAMILIES:
+      best_params, scores, elapsed = run_grid_search(model_name, train_X, train_Y, test_X, test_Y, model_name, halving_search, held_out)
+      results[model_name] = {
+        "params": best_params, 
+        "scores": scores,
+        "time": elapsed
+      }
+  elif args.sequential:
+    for model_name in FAMILIES:
+      best_params, scores, elapsed = run_grid_search(model_name, train_X, train_Y, test_X, test_Y, model_name, partial(grid_search, cache=fit_cache), held_out)
+      results[model_name] = {
+        "params": best_params, 
+        "scores": scores,
+        "time": elapsed
+      }
+  else:
+    from orchestrate import Checkpoint, train_concurrently
+
+    # Families that were fully trained and reported by an interrupted run are not trained again
+    checkpoint = Checkpoint(train_X, train_Y, fresh=args.fresh, refit_mode=held_out)
+    for model_name in FAMILIES:
+      result = checkpoint.load_result(model_name)
+      if result is not None:
+        print("{}: already trained, loaded from {}".format(model_name, checkpoint.models_dir))
+        results[model_name] = result
+
+    families = {model_name: searches(held_out) for model_name, (searches, _) in FAMILIES.items() if model_name not in results}
+    for model_name, grids, elapsed in train_concurrently(families, train_X, train_Y, args.jobs, checkpoint, fit_cache):
+      with tracing.span("report", family=model_name):
+        best_params, scores = FAMILIES[model_name][1](grids, test_X, test_Y, model_name)
+      results[model_name] = {
+        "params": best_params, 
+        "scores": scores,
+        "time": elapsed
+      }
+      checkpoint.save_result(model_name, results[model_name])
+
+  # Write to file
+  with open('final_scores.json', 'w') as fp:
+    json.dump(results, fp, sort_keys=True, indent=2, separators=(',', ': '))
+
+  figures.close()
@@ -1,47 +1,20 @@
-import json
-import numpy as np
-from tabulate import tabulate
+from data.features import season_matrix
 
 def player_data_to_input(player_id, player_data):
-  # Individual stats
-  g = player_data["stats"]["g"]
-  gs = player_data["stats"]["gs"]
-  mp_per_g = player_data["stats"]["mp_per_g"]
-  pts_per_g = player_data["stats"]["pts_per_g"]
-  trb_per_g = player_data["stats"]["trb_per_g"]
-  ast_per_g = player_data["stats"]["ast_per_g"]
-  stl_per_g = str(float(player_data["stats"]["stl"])/float(g))
-  blk_per_g = str(float(player_data["stats"]["blk"])/float(g))
-  fg_pct = player_data["stats"]["fg_pct"]
-  fg3_pct = player_data["stats"]["fg3_pct"]
-  ft_pct = player_data["stats"]["ft_pct"]
-  # fga_per_g = str(float(player_data["stats"]["fga"])/float(g))
-  # fg3a_per_g = str(float(player_data["stats"]["fg3a"])/float(g))
-  # fta_per_g = str(float(player_data["stats"]["fta"])/float(g))
-  usg_pct = player_data["stats"]["usg_pct"]
+  # One row of the features of data/features.py
+  return season_matrix({player_id: player_data})[1]
 
-  # Team stats
-  player_team = player_data["team"]["name"]
-  win_pct = player_data["team"]["record"]
-  seed = player_data["team"]["rank"]
-
-  final_stats = np.array([[g, gs, mp_per_g, pts_per_g, trb_per_g, ast_per_g, stl_per_g, blk_per_g, fg_pct, fg3_pct, ft_pct, usg_pct, win_pct, seed]])
-  # final_stats = np.array([[g, gs, mp_per_g, pts_per_g, trb_per_g, ast_per_g, stl_per_g, blk_per_g, fg_pct, fg3_pct, ft_pct, fga_per_g, fg3a_per_g, fta_per_g, usg_pct, win_pct, seed]])
-
-  final_stats[final_stats=='']='0'
-
-  return np.nan_to_num(final_stats)
+def season_data_to_input(players_data):
+  # Stack every player of a season into one feature matrix, rows follow the order of players_data
+  return season_matrix(players_data)
 
 def get_input_and_details_for_player(player_id, season):
-  year_str = str(season)
-  with open("./data/raw/" + year_str + ".json") as players_data_file:
-    players_data = json.load(players_data_file)
-    try:
-      data = players_data[player_id]
-      return player_data_to_input(player_id, data), data
-    except:
-      return None, None
-  return None, None
+  # One row of the player store, the season JSON is not parsed. Imported here, scoring a season does not need it
+  from player_db import get_player
+  data = get_player(player_id, season)
+  if data is None:
+    return None, None
+  return player_data_to_input(player_id, data), data
 
 def format_single_result(pred, player_details, season):
   prob = round(pred,3)
@@ -132,6 +105,7 @@ def print_result_as_table(west_all_stars, east_all_stars, season, answer):
   final_table = []
   for w, e in zip(west_final_table, east_final_table):
     final_table.append(e + w)
+  from tabulate import tabulate
   print(tabulate(final_table))
 
 